@@ -27,12 +27,23 @@ __depends__ = ['Python-2.4']
 __copyright__ = """Copyright (C) 2011 Stephen Hamilton.
 This code is distributed under the terms of the GNU General Public License."""
 
+###############################
+###############################
+DEFAULT_SERVER = "second.aprs.net:10151"
+
+###############################
+def parse_server(server):
+	"""Return (host, port) of a APRS-IS server "host:port" string"""
+	try:
+		host, port = server.rsplit(":", 1)
+		return host, int(port)
+	except ValueError: raise ValueError, "Syntax error on APRS-IS server: %s" %server
+
 ###############################
 ###############################
 class Aprs:
-	def __init__(self):
-		self.serverHost = 'second.aprs.net'
-        	self.serverPort = 10151
+	def __init__(self, server=DEFAULT_SERVER):
+		self.serverHost, self.serverPort = parse_server(server)
         	self.password = '21728'
         	self.callsign = 'KJ5HY-2'
         	self.latitude = '4122.90'
@@ -43,6 +54,14 @@ class Aprs:
         	self.comment = 'KJ5HY APRStt'
         	self.packet = ''		
 
+	def get_position(self, station_number):
+		"""Return position reported for a TT user ("lat/long" with quadrants)"""
+		# calculate position underneath APRStt station
+		#Float conversions to add.  Ensure 0's aren't lost too!
+		stationlat = float(self.latitude) - (station_number*.01)
+		stationlat = '%4.2f' % stationlat
+		return stationlat + self.latquad + '/' + self.longitude + self.longquad
+
 	def send_packet(self, aprs_callsign, symbol, station_number):
 		# create socket & connect to server
 		sSock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -50,15 +69,9 @@ class Aprs:
 		#Pause
 		# logon
 		sSock.send('user ' + self.callsign + ' pass ' + self.password + ' vers "KJ5HY APRStt .1"\n')
-       		 # calculate position underneath APRStt station
-		#Float conversions to add.  Ensure 0's aren't lost too!
-		#stationlat = self.latitude - (.10 * station_number)
-		stationlat = float(self.latitude) - (station_number*.01)
-		stationlat = '%4.2f' % stationlat
-		print(stationlat)
 		# Form address for APRS packet.  Add -12 for TT user.
 		address =  aprs_callsign + '-12>APT001,WIDE1-1,qAR,' + self.callsign
-		position = ':!' + stationlat + self.latquad + '/' + self.longitude + self.longquad + symbol
+		position = ':!' + self.get_position(station_number) + symbol
 		#ID Packet
 		#working: id = self.callsign + '>APT001,TCPIP*:=4122.90N/07358.20WxAPRStt-Testing'
 		id = self.callsign + '>APT001,TCPIP*:=' + str(self.latitude) + self.latquad + '/' + str(self.longitude) + self.longquad + 'r146.58 MHz\n'
@@ -20,7 +20,7 @@
 
 # Standard Python modules
 import sys, os, optparse, tempfile
-import popen2, time, select, re
+import popen2, time, select, re, socket
 
 import signal, inspect, grp
 import syslog, errno, pwd
@@ -28,11 +28,11 @@ import threading, audioop
 
 # External phonepatch modules
 sys.path.append("/usr/lib/asterisk-phonepatch")
-import templateparser, dtmf, radio
-import radiocontrol
-import unixsocket
-import daemonize
-import aprs 
+import configcache, dtmf, radio
+import controlserver, daemonize
+import touchtone, metrics, logger
+# Loaded when used: radiocontrol (radio_control), ctcss (ctcss_rx),
+# userstore (user_store), profiler (profile command), aprs (reports)
 
 __version__ = "$Revision: 1.14 $"
 __author__ = "Arnau Sanchez <arnau@ehas.org>"
@@ -52,8 +52,42 @@ PL_CODES = {"XZ": 67.0, "WZ": 69.3, "XA": 71.9, "WA": 74.4, "XB": 77.0, "SP": 79
 OUTCALL_IDNAME = "_phonepatch_"
 GLOBAL_SECTION = "general"
 PIDFILE_DIR = "/var/run/asterisk"
+SUPERVISOR_PIDFILE = "phonepatch-supervisor.pid"
 DEFAULT_SECTION = None
 
+# Seconds a call request (control socket) may wait for the audio loop
+CALL_REQUEST_TIMEOUT = 5.0
+
+# APRStt station number (position offset of reports)
+STATION_NUMBER = 1
+
+# Maximum distance (Hz) from a ctcss_rx frequency to a CTCSS decoder tone
+CTCSS_TOLERANCE = 1.0
+
+# Metrics
+DTMF_KEYS = metrics.counter("aprstt_dtmf_keys_total", "DTMF keys detected")
+DTMF_WINDOW_TIME = metrics.histogram("aprstt_dtmf_window_seconds", "DTMF decoder time per window")
+FESTIVAL_TIME = metrics.histogram("aprstt_festival_seconds", "Festival text-to-speech run time")
+SOX_TIME = metrics.histogram("aprstt_sox_seconds", "Sox audio conversion run time")
+APRS_SEND_TIME = metrics.histogram("aprstt_aprs_send_seconds", "APRS packet send latency")
+APRS_SEND_ERRORS = metrics.counter("aprstt_aprs_send_errors_total", "APRS packets failed to send")
+CONFIG_RELOADS = metrics.counter("aprstt_config_reloads_total", "Configuration reloads (SIGHUP)")
+
+# Live reload (SIGHUP): parameters applied to the PTT/carrier containers
+# (configuration name, container attribute), parameters rebuilding the 
+# DTMF decoder and parameters that only take effect on restart
+PTT_PARAMETERS = [("ptt_threshold_signal", "threshold"), ("ptt_tail_time", "tailtime"),
+	("ptt_attack_time", "attack"), ("ptt_max_time", "maxtime"), ("ptt_wait_time", "waittime")]
+CARRIER_PARAMETERS = [("carrier_polling_time", "pollingtime"), ("carrier_threshold_signal", "threshold"),
+	("carrier_tail_time", "tailtime"), ("carrier_attack_time", "attack"), 
+	("carrier_max_time", "maxtime"), ("carrier_wait_time", "waittime")]
+DTMF_PARAMETERS = ["dtmf_sensibility", "dtmf_arithmetic", "dtmf_decoder_mode"]
+RESTART_PARAMETERS = ["soundcard_device", "soundcard_latency", "soundcard_capture_thread",
+	"soundcard_capture_fragments", "soundcard_capture_priority", "soundcard_record",
+	"full_duplex", "radio_control", "radio_control_profile", "ptt", "carrier_detection", 
+	"command_ptt_on", "command_ptt_off", "command_get_carrier", 
+	"command_get_carrier_response", "metrics_listen", "user_store", "user_store_cache_size"]
+
 ###############################
 ###############################
 class Container:
@@ -94,13 +128,19 @@ class Phonepatch:
 	while the daemon() method should be run from command-line.	
 	"""
 	###################################
-	def __init__(self, configuration, verbose=False):
+	def __init__(self, configuration, verbose=False, source=None):
 		"""Configuration is a dictionary variable whose keys with sections:
-		asterisk, soundcard, festival, telephony, dtmf, radio, incall and outcall
+		asterisk, soundcard, festival, telephony, dtmf, radio, incall and outcall.
+		Source (template, configuration file, cache file) is used to reload
+		the configuration on SIGHUP
 		"""
 		self.configuration = configuration
+		self.configuration_source = source
+		self.reload_pending = False
 		self.verbose = verbose
 		self.modules_verbose = verbose
+		self.background = False
+		self.logger = logger.Logger("aprstt", verbose)
 		self.set_state("phonepatch")
 			
 		self.phonepatch_extension = None
@@ -134,8 +174,9 @@ class Phonepatch:
 			if var.find("SIG") == 0 and var.find("SIG_") != 0: 
 				self.signals[value] = var
 
-		self.background = False
 		self.ctcss_tx = None
+		self.user_store = None
+		self.start_time = time.time()
 		self.pidfile_created = False
 		self.control_enabled = self.accept_agicalls = False
 		self.call_active = None
@@ -146,14 +187,62 @@ class Phonepatch:
 		"""Signal handler for:
 		
 		SIGTERM/SIGKILL: Kill phonepatch daemon()
+		SIGHUP: Reload configuration (applied by the daemon loop)
 		"""
 		signame = self.signals.get(signum, "unknown")
-		self.debug("signal_handler: received %s" %signame)
+		self.debug("signal_handler: received %s", signame)
 		
 		if signum == signal.SIGTERM or signum == signal.SIGINT:
 			self.debug("signal_handler: phonepatch daemon killed")
 			self.end_daemon()
+			# os._exit skips atexit handlers, write queued log lines now
+			logger.flush()
 			os._exit(0)
+		elif signum == signal.SIGHUP:
+			self.reload_pending = True
+
+	####################################
+	def reload_configuration(self):
+		"""Reparse configuration and apply changes in place (radio stays open).
+		On errors the running configuration is kept"""
+		self.reload_pending = False
+		if not self.configuration_source:
+			self.debug("reload_configuration: configuration source unknown, reload ignored")
+			return
+		try: configuration = configcache.load(*self.configuration_source)
+		except Exception, detail:
+			self.debug("reload_configuration: keeping running configuration: %s", detail)
+			return
+		if self.phonepatch_phpconfig not in configuration:
+			self.debug("reload_configuration: phonepatch %s not found, reload ignored", self.phonepatch_phpconfig)
+			return
+		CONFIG_RELOADS.inc()
+		changed = diff_configuration(self.configuration, configuration)
+		if not changed:
+			self.debug("reload_configuration: no changes")
+			return
+		self.debug("reload_configuration: changed parameters: %s", ", ".join(changed))
+		self.configuration = configuration
+		self.set_configuration_sections()
+		self.apply_configuration(changed)
+
+	####################################
+	def apply_configuration(self, changed):
+		"""Update daemon objects depending on changed parameters"""
+		restart = [x for x in RESTART_PARAMETERS if x in changed]
+		if restart: self.debug("apply_configuration: changes applied on restart: %s", ", ".join(restart))
+		if "log_levels" in changed: self.init_logging()
+		if [x for x in DTMF_PARAMETERS if x in changed]: self.init_dtmf()
+		self.init_settings()
+		for container, parameters in ((self.ptt, PTT_PARAMETERS), (self.carrier, CARRIER_PARAMETERS)):
+			if not container: continue
+			for parameter, attribute in parameters:
+				if parameter in changed: setattr(container, attribute, self.getconf(parameter))
+		self.radio.update_vox()
+		if self.user_store: self.user_store.clear_cache()
+		if "ctcss_decoder_mintime" in changed:
+			self.ctcss_decoder = self.getconf("ctcss_decoder_mintime")
+			self.radio.set_ctcss(self.ctcss_decoder)
 
 	####################################
 	def init_php(self, phonepatch):	
@@ -162,21 +251,40 @@ class Phonepatch:
 			self.debug("init_php: phonepatch name not given")
 			return
 		if phonepatch not in self.configuration: 
-			self.debug("init_php: phonepatch name not found in configuration: %s" %phonepatch)
+			self.debug("init_php: phonepatch name not found in configuration: %s", phonepatch)
 			return
 		self.phonepatch_phpconfig = phonepatch
+		self.ctcss_index = None
+		self.init_logging()
 		self.samplerate = self.asterisk_samplerate
+		self.init_dtmf()
+		self.pidfile = os.path.join(PIDFILE_DIR, self.phonepatch_phpconfig + ".pid")
+		self.controlfile = os.path.join(PIDFILE_DIR, self.phonepatch_phpconfig + ".ctl")
+		self.init_settings()
+		return phonepatch
+
+	####################################
+	def init_logging(self):
+		try: logger.set_levels(self.getconf("log_levels"))
+		except ValueError, detail: self.debug("init_logging: %s", detail)
+		self.logger = logger.Logger("aprstt", self.verbose)
+		self.set_state(self.state)
+
+	####################################
+	def init_dtmf(self):
 		self.dtmf_decoder = dtmf.Decoder(samplerate = self.samplerate, \
 			channels = self.asterisk_channels, \
 			sensibility = self.getconf("dtmf_sensibility"), \
+			arithmetic = self.getconf("dtmf_arithmetic"), \
+			mode = self.getconf("dtmf_decoder_mode"), \
 			verbose = False)
-		self.pidfile = os.path.join(PIDFILE_DIR, self.phonepatch_phpconfig + ".pid")
-		self.controlfile = os.path.join(PIDFILE_DIR, self.phonepatch_phpconfig + ".ctl")
+
+	####################################
+	def init_settings(self):
 		self.language = self.getconf("language")
 		self.sounds_dir = self.getconf("sounds_dir")
 		self.outcalls_dir = self.getconf("spool_dir") 
 		self.festival_gain = self.getconf("festival_audio_gain")
-		return phonepatch
 
 	####################################
 	def getconf(self, parameter, phpext=None):
@@ -191,9 +299,9 @@ class Phonepatch:
 			return self.configuration[self.phonepatch_global][parameter]
 		if parameter in self.configuration[self.phonepatch_default]:
 			value = self.configuration[self.phonepatch_default][parameter]
-			self.debug("getconf: %s not defined, default returned: %s" %(parameter, value))
+			self.debug("getconf: %s not defined, default returned: %s", parameter, value)
 			return value
-		self.debug("getconf: unknown parameter: %s" %parameter)
+		self.debug("getconf: unknown parameter: %s", parameter)
 
 	####################################
 	def set_configuration_sections(self):
@@ -209,6 +317,7 @@ class Phonepatch:
 				self.phonepatch_configs.append(section)
 			elif section != DEFAULT_SECTION:
 				self.phonepatch_extensions.append(section)
+		self.ctcss_index = None
 
 	###############################
 	def set_state(self, state):
@@ -216,23 +325,22 @@ class Phonepatch:
 		self.state = state
 		if state: self.state_string = state
 		else: self.state_string = ""
+		if self.state == "daemon" and self.background: self.logger.prefix = ""
+		else: self.logger.prefix = "phonepatch[%s] - " %self.state_string
 
 	###############################
-	def debug(self, log, exit=None):
-		"""Output debug lines in verbose mode"""
-		if not self.verbose: return
+	def debug(self, log, *args, **kwargs):
+		"""Output debug lines in verbose mode (log is a format string for
+		args, only formatted if the line is going to be written)"""
+		exit = kwargs.get("exit")
 		if exit: log = "fatal error - " + log
-		if self.state == "daemon" and self.background:
-			syslog.syslog(log)
-		else:
-			log = "phonepatch[%s] - %s" %(self.state_string, log)
-			self.secure_os(sys.stderr.write, log+"\n")
-			self.secure_os(sys.stderr.flush)
+		self.logger.info(log, *args)
 		
 		# Exit with code error if "exit" parameter given
 		if exit != None: 
 			self.debug("clean exit")
 			if self.pidfile_created: self.delete_pidfile()
+			logger.flush()
 			sys.exit(exit)
 
 	###############################
@@ -262,15 +370,18 @@ class Phonepatch:
 		self.ptt = self.carrier = self.radio_control = None
 		control = self.getconf("radio_control")
 		if control != "off" and (self.getconf("ptt") or self.getconf("carrier_detection") in ("on", "audio")):
-			dtype, lines, device = re.findall("(serial|parallel|command)(.*):(.*)$", control)[0]
-			try: dtype, lines, device = re.findall("(serial|parallel|command)(.*):(.*)$", control)[0]
-			except: self.debug("open_radio: syntax error on radio_control: %s" %control, exit = 1)
+			import radiocontrol
+			if control.find("socket:") == 0: dtype, lines, device = "socket", "", control[len("socket:"):]
+			else:
+				try: dtype, lines, device = re.findall("(serial|parallel|command|mock)(.*):(.*)$", control)[0]
+				except: self.debug("open_radio: syntax error on radio_control: %s", control, exit = 1)
 			if lines and lines[0] == "[" and lines[-1] == "]": lines = [x.strip() for x in lines[1:-1].split(",")]
 			else: lines = None
-			if control.find("serial") == 0:
-				self.radio_control = radiocontrol.RadioControl("serial", device, lines)
-			elif control.find("parallel") == 0:
-				self.radio_control = radiocontrol.RadioControl("parallel", device, lines)
+			profile = self.getconf("radio_control_profile")
+			if dtype == "socket":
+				self.radio_control = radiocontrol.RadioControl("socket", device)
+			elif dtype in ("serial", "parallel", "mock"):
+				self.radio_control = radiocontrol.RadioControl(dtype, device, lines, profile=profile)
 			elif control.find("command") == 0:
 				self.command_options = {"set_ptt_on": self.getconf("command_ptt_on"), \
 					"set_ptt_off": self.getconf("command_ptt_off"),
@@ -278,11 +389,12 @@ class Phonepatch:
 					"get_carrier_response": self.getconf("command_get_carrier_response"), }
 				self.radio_control = radiocontrol.RadioControl("command", device, command_options=self.command_options)
 
-			else: self.debug("open_radio: syntax error on radio_control: %s" %control, exit = 1)
+			else: self.debug("open_radio: syntax error on radio_control: %s", control, exit = 1)
 			if self.getconf("ptt"):
 				self.ptt = Container(set=self.radio_control.set_ptt, get=self.radio_control.get_ptt, \
 					threshold = self.getconf("ptt_threshold_signal"), \
 					tailtime = self.getconf("ptt_tail_time"), \
+					attack = self.getconf("ptt_attack_time"), \
 					maxtime = self.getconf("ptt_max_time"), \
 					waittime = self.getconf("ptt_wait_time"))
 			if self.getconf("carrier_detection") in ("on", "audio"):
@@ -291,20 +403,27 @@ class Phonepatch:
 					pollingtime=self.getconf("carrier_polling_time"),\
 					threshold = self.getconf("carrier_threshold_signal"), \
 					tailtime = self.getconf("carrier_tail_time"), \
+					attack = self.getconf("carrier_attack_time"), \
 					maxtime = self.getconf("carrier_max_time"), \
 					waittime = self.getconf("carrier_wait_time"))
 
 		# Create radio instance (control soundcard and PTT)
+		record = self.getconf("soundcard_record")
+		if record == "off": record = None
 		try:self.radio = radio.Radio(self.getconf("soundcard_device"), self.asterisk_samplerate, \
 			self.ptt, self.carrier, verbose=self.modules_verbose, fullduplex = self.getconf("full_duplex"), \
-			soundcard_retries = 5, latency = self.getconf("soundcard_latency"), ctcss_mintime=self.ctcss_decoder)
+			soundcard_retries = 5, latency = self.getconf("soundcard_latency"), ctcss_mintime=self.ctcss_decoder, \
+			capture = self.getconf("soundcard_capture_thread"), \
+			capture_fragments = self.getconf("soundcard_capture_fragments"), \
+			capture_priority = self.getconf("soundcard_capture_priority"), \
+			record = record)
 		except Exception, detail:
-			self.debug("open_radio: %s" %str(detail), 1)
+			self.debug("open_radio: %s", detail, exit = 1)
 			sys.exit(1)
 			
-		self.debug("open_radio: soundcard opened: %s (%s sps)" %(self.getconf("soundcard_device"), self.samplerate))
+		self.debug("open_radio: soundcard opened: %s (%s sps)", self.getconf("soundcard_device"), self.samplerate)
 		#if self.radio_control:
-		#	self.debug("open_radio: radio control opened: %s" %control)
+		#	self.debug("open_radio: radio control opened: %s", control)
 			
 		# Phonepatch also uses audio_fd, so save it.
 		self.audio_fd = self.radio.get_audiofd()
@@ -313,6 +432,15 @@ class Phonepatch:
 	def play_text(self, text):
 		"""Sintetize text using Festival text-to-speech and return audio data"""
 		
+		if self.user_store:
+			try: audio_data = self.user_store.get_readback(text, self.language, self.asterisk_samplerate)
+			except self.user_store.Error, detail:
+				self.debug("play_text: user store error: %s", detail)
+				audio_data = None
+			if audio_data:
+				self.debug("play_text: using stored readback audio")
+				return audio_data
+
 		# Festival only supports english, spanish and welsh. 
 		# Get long name from ISO code
 		audio_data = ""
@@ -329,13 +457,18 @@ class Phonepatch:
 		#s = "(SayText \"%s\")\n" %text
 		s = ""
 		self.radio.set_ptt(True) 
+		start = time.time()
 		audio_data = self.command_output(command, input=s)
-		self.debug("play_text: festival spawned: %s" %command)
+		FESTIVAL_TIME.observe(time.time() - start)
+		self.debug("play_text: festival spawned: %s", command)
 		self.radio.set_ptt(False)
 		# Check that festival was succesfully run
 		if not audio_data: 
 			#self.debug("play_text: festival error")
 			return ""
+		if self.user_store:
+			try: self.user_store.put_readback(text, self.language, self.asterisk_samplerate, audio_data)
+			except self.user_store.Error, detail: self.debug("play_text: cannot store readback audio: %s", detail)
 		return audio_data
 		
 	###################################
@@ -357,13 +490,15 @@ class Phonepatch:
 			if os.path.isfile(cfile):
 				break
 		else:
-			self.debug("play_file: file not found: %s" %audio_file)
+			self.debug("play_file: file not found: %s", audio_file)
 			return audio_data
 		
 		# Convert file to raw format with sox, so the soundcard can play it
 		command = "sox %s -t raw -r%d %s -" %(cfile, self.asterisk_samplerate, self.sox_pars)
-		self.debug("play_file: sox spawned: %s" %os.path.join(cfile, audio_file))
+		self.debug("play_file: sox spawned: %s", os.path.join(cfile, audio_file))
+		start = time.time()
 		audio_data = self.command_output(command)
+		SOX_TIME.observe(time.time() - start)
 		if not audio_data: 
 			self.debug("play_file: sox returned error")
 			audio_data = ""
@@ -381,8 +516,8 @@ class Phonepatch:
 		# Some sanity checks
 		if not play_radio and not play_asterisk or args == None: return
 		
-		if play_radio: self.debug("play: playing to soundcard: %s" %str(args))
-		if play_asterisk: self.debug("play: playing to asterisk: %s" %str(args))
+		if play_radio: self.debug("play: playing to soundcard: %s", args)
+		if play_asterisk: self.debug("play: playing to asterisk: %s", args)
 		try: args = args.strip().replace("%u", self.getconf("username"))
 		except: pass
 			
@@ -409,39 +544,26 @@ class Phonepatch:
 		written = 0
 					
 		if max_time: 
-			max_data = max_time * self.asterisk_samplerate * self.sample_width * self.asterisk_channels
-			self.debug("play: playing time limited to %0.2f seconds" %max_time)
+			max_data = int(max_time * self.asterisk_samplerate) * self.sample_width * self.asterisk_channels
+			data = data[:max_data]
+			self.debug("play: playing time limited to %0.2f seconds", max_time)
 		else:
-			t = float(len(self.raw_data)) / self.asterisk_samplerate
-			self.debug("play: playing audio data (%0.2f seconds)" %t)
+			t = float(len(self.raw_data)) / (self.asterisk_samplerate * self.sample_width)
+			self.debug("play: playing audio data (%0.2f seconds)", t)
 		
-		txdelay = self.getconf("ptt_txdelay")
-		if txdelay and play_radio: 
-			txtime = time.time() + self.getconf("ptt_txdelay")
-		pttflag = False
-		while 1:
-			if not data:
-				if not loop: break
-				data = self.raw_data
+		# PTT timing (txdelay preamble and tail) is done by the radio transmit envelope
+		txdelay = txtail = 0.0
+		if self.ptt:
+			txdelay = self.getconf("ptt_txdelay")
+			txtail = self.getconf("ptt_txtail")
+		while play_radio:
 			if test_function and not test_function(): 
-				written=None; break
-			if txdelay and time.time() < txtime:
-				continue
-			if play_radio and self.ptt and not pttflag: 
-				self.radio.set_ptt(True)
-				pttflag = True
-			if play_radio:
-				try: self.radio.send_audio(data[:self.buffer_size], self.ctcss_tx)
-				except: self.debug("play: radio send_audio error"); written=None; break
-			
-		
-		# Soundcards have internal buffer, make sure they are empty
-		try: self.radio.flush_audio()
-		except: pass
-		
-		# If playing to the radio, turn PTT off
-		if play_radio and self.ptt and pttflag: 
-			self.radio.set_ptt(False)
+				written = None; break
+			try: sent = self.radio.transmit(data, self.ctcss_tx, txdelay, txtail, test_function=test_function)
+			except: self.debug("play: radio transmit error"); written = None; break
+			if sent == None: written = None; break
+			written += sent
+			if not loop: break
 			
 		return written
 		
@@ -464,7 +586,7 @@ class Phonepatch:
 		if ctcss_id in PL_CODES: ctcss_freq = PL_CODES[ctcss_id]
 		else: ctcss_freq = ctcss_id
 		try: ctcss_freq = float(ctcss_freq)
-		except: self.debug("get_ctcss: invalid CTCSS frequency: %s" %(str(ctcss_id))); return
+		except: self.debug("get_ctcss: invalid CTCSS frequency: %s", ctcss_id); return
 		return ctcss_freq
 
 	###################################
@@ -476,7 +598,7 @@ class Phonepatch:
 		try: os.unlink(self.pidfile)
 		except OSError, e: 
 			if e.errno != errno.ENOENT: raise
-		else: self.debug("delete_pidfile: deleted %s" %self.pidfile)
+		else: self.debug("delete_pidfile: deleted %s", self.pidfile)
 		try: 
 			self.control.server_close()
 			self.control_enabled = False
@@ -484,7 +606,7 @@ class Phonepatch:
 		try: os.unlink(self.controlfile)
 		except OSError, e: 
 			if e.errno != errno.ENOENT: raise
-		else: self.debug("delete_pidfile: deleted %s" %self.controlfile)
+		else: self.debug("delete_pidfile: deleted %s", self.controlfile)
 			
 	###################################
 	def close_interface(self):
@@ -495,49 +617,98 @@ class Phonepatch:
 		self.asterisk_out.close()
 
 	###################################
-	def control_handler(self, rfile, wfile):
-		self.debug("control_handler: start")
-		if not self.accept_agicalls:
-			self.debug("control_handler: AGI calls not accepted now")
-			wfile.write("ko\n")
+	def call_command(self, command):
+		"""Control commands "incall|extension" and "outcall" (answered here
+		if rejected, otherwise handed to the audio loop: handle_call)"""
+		if not self.accept_agicalls or self.call_active:
+			self.debug("call_command: AGI calls not accepted now")
+			return "ko\n"
+		if (command[0] == "incall" and len(command) != 2) or (command[0] == "outcall" and len(command) != 1):
+			self.debug("call_command: syntax error")
+			return "syntax error\n"
+
+	###################################
+	def handle_call(self, request):
+		"""Run a call requested through the control socket (audio loop)"""
+		if time.time() > request.time + CALL_REQUEST_TIMEOUT:
+			self.debug("handle_call: %s request timed out", request.command)
+			try: request.wfile.write("ko\n")
+			except socket.error: pass
+			request.close()
 			return
-		s = rfile.readline().strip().split("|")
-		self.debug("control_handler: received: %s"%s)
-		if len(s) == 2 and s[0] == "incall":
-			command, self.phonepatch_extension = s
-		elif len(s) == 1 and s[0] == "outcall":
-			command = s
-		else:
-			self.debug("control_handler: syntax error")
-			wfile.write("syntax error\n")
+		try: request.wfile.write("ok")
+		except socket.error:
+			self.debug("handle_call: %s client hung up", request.command)
+			request.close()
 			return
-		wfile.write("ok")
-		self.asterisk_in = wfile
-		self.asterisk_out = rfile
-		self.call_active = "ask"
-		itime = time.time()
-		while self.call_active == "ask":
-			self.debug("control_handler: waiting for thread access")
-			if time.time() > itime + 5.0:
-				self.close_interface()
-				self.call_active = None
-				return
-			time.sleep(0.01)
+		if request.command == "incall": self.phonepatch_extension = request.args[0]
+		self.asterisk_in = request.wfile
+		self.asterisk_out = request.rfile
+		self.call_active = request.command
 		try:
-			if command == "incall":
-				if self.process_incall():
+			try:
+				if request.command == "incall":
+					if self.process_incall():
+						self.audio_loop()
+				else: 
 					self.audio_loop()
-			else: 
-				self.audio_loop()
-		except Exception, e: self.print_exception(e)
-		self.close_interface()
-		self.call_active = None
+			except Exception, e: self.print_exception(e)
+			try: self.close_interface()
+			except socket.error: self.debug("handle_call: %s client hung up", request.command)
+		finally:
+			request.close()
+			self.call_active = None
+
+	###################################
+	def status_command(self, command):
+		"""Control command "status": daemon state (answered during calls)"""
+		lines = ["phonepatch: %s" %self.phonepatch_phpconfig, "pid: %d" %os.getpid(),
+			"state: %s" %self.state_string, "uptime: %0.0f" %(time.time() - self.start_time), 
+			"call: %s" %(self.call_active or "none"), "accept_calls: %s" %self.accept_agicalls]
+		radio = getattr(self, "radio", None)
+		if radio:
+			lines += ["ptt: %s" %radio.ptt_state, "carrier: %s" %radio.carrier_state,
+				"ctcss_tone: %s" %radio.get_ctcss_tone(), "capture: %s" %radio.format_capture_stats()]
+		return "ok\n" + "\n".join(lines) + "\n"
 
+	###################################
+	def stats_command(self, command):
+		"""Control command "stats": metrics (Prometheus text format)"""
+		return "ok\n" + metrics.REGISTRY.render()
+
+	###################################
+	def reports_command(self, command):
+		"""Control command "reports[|number]": last heard users"""
+		try:
+			limit = 10
+			if len(command) >= 2: limit = int(command[1])
+			if len(command) > 2 or limit < 0: raise ValueError
+		except ValueError: return "syntax error\n"
+		if not self.user_store: return "ko\nuser store disabled\n"
+		lines = ["%s %s %s %s %d" %(time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(user["last_heard"])), \
+			user["callsign"], user["keys"], user["symbol"], user["reports"]) for user in self.user_store.recent(limit)]
+		return "ok\n" + "".join([line + "\n" for line in lines])
+
+	###################################
+	def profile_command(self, command):
+		"""Control command "profile[|seconds[|interval]]": sample the stacks
+		of all daemon threads and write stage timings plus collapsed stacks"""
+		import profiler
+		try:
+			seconds, interval = 5.0, profiler.INTERVAL
+			if len(command) >= 2: seconds = float(command[1])
+			if len(command) >= 3: interval = float(command[2])
+			if len(command) > 3 or interval <= 0: raise ValueError
+		except ValueError:
+			self.debug("profile_command: syntax error")
+			return "syntax error\n"
+		self.debug("profile_command: profiling %0.1f seconds", seconds)
+		return "ok\n" + profiler.Profiler(interval).run(seconds).report()
 
 	###################################
 	def create_pidfile(self):
 		"""Create pidfile when a daemon process starts"""
-		self.debug("create_pidfile: %s" %self.pidfile)
+		self.debug("create_pidfile: %s", self.pidfile)
 		try: fd = open(self.pidfile, "w")
 		except: self.debug("create_pidfile: pidfile could not be opened for writing", exit=1)
 		fd.write(str(os.getpid()) + "\n")
@@ -545,12 +716,15 @@ class Phonepatch:
 		self.pidfile_created = True
 		
 		#os.chown(self.pidfile, *ids)
-		self.control = unixsocket.UnixSocketServer(self.controlfile, reuse=True)
-		self.control.set_handler(self.control_handler)
+		self.control = controlserver.ControlServer(self.controlfile, reuse=True, debug=self.debug)
+		self.control.register("status", self.status_command)
+		self.control.register("stats", self.stats_command)
+		self.control.register("reports", self.reports_command)
+		self.control.register("profile", self.profile_command, controlserver.THREAD)
+		self.control.register("incall", self.call_command, controlserver.LOOP)
+		self.control.register("outcall", self.call_command, controlserver.LOOP)
 		self.control_enabled = True
-		self.control_thread = threading.Thread(target=self.control.serve_forever)
-		self.control_thread.setDaemon(True)
-		self.control_thread.start()
+		self.control.start()
 		#os.chown(self.controlfile, *ids)
 
 	###################################
@@ -561,19 +735,32 @@ class Phonepatch:
 		fd.close()
 		return pid
 
+	###################################
+	def build_ctcss_index(self):
+		"""Build index: CTCSS decoder tone -> extensions (in configuration
+		order) whose ctcss_rx is that tone"""
+		import ctcss
+		self.ctcss_index = {}
+		for section in self.phonepatch_extensions:
+			freq = self.get_ctcss(self.getconf("ctcss_rx", section))
+			if not freq: continue
+			distance, tone = min([(abs(freq - x), x) for x in ctcss.CTCSS_FREQS])
+			if distance > CTCSS_TOLERANCE:
+				self.debug("build_ctcss_index: ctcss_rx %0.1f of extension %s is not a CTCSS tone", freq, section)
+				continue
+			self.ctcss_index.setdefault(tone, []).append(section)
+
 	###################################
 	def check_ctcss(self, extension=None):
 		tone = self.radio.get_ctcss_tone()
 		if not tone: return
-		if extension == None: extensions = self.phonepatch_extensions
-		else: extensions = [extension]
-		for section in extensions:
-			freq = self.get_ctcss(self.getconf("ctcss_rx", section))
-			if freq and freq == tone:
-				return section
+		if self.ctcss_index == None: self.build_ctcss_index()
+		sections = self.ctcss_index.get(tone, [])
+		if extension == None and sections: return sections[0]
+		if extension in sections: return extension
 		if extension == None:
-			self.debug("check_ctcss: CTCSS tone %0.1f not found in any phonepatch extension" %tone)
-		else: self.debug("check_ctcss: CTCSS tone %0.1f not found in phonepatch extension %d" %(tone, extension))
+			self.debug("check_ctcss: CTCSS tone %0.1f not found in any phonepatch extension", tone)
+		else: self.debug("check_ctcss: CTCSS tone %0.1f not found in phonepatch extension %s", tone, extension)
 
 	###################################
 	def set_ctcss_tx(self):
@@ -583,7 +770,7 @@ class Phonepatch:
 		except: ctcss_tx_freq = None
 		if ctcss_tx_freq and ctcss_tx_amplitude: 
 			self.ctcss_tx = ctcss_tx_freq, ctcss_tx_amplitude
-			self.debug("loop_daemon: using ctcss_tx tone: %0.1f Hz, amplitude: %0.2f" %self.ctcss_tx)
+			self.debug("loop_daemon: using ctcss_tx tone: %0.1f Hz, amplitude: %0.2f", *self.ctcss_tx)
 		else: self.ctcss_tx = None
 
 	###################################
@@ -591,7 +778,7 @@ class Phonepatch:
 		self.debug("process_incall: start")
 		"""Waits for DTMF answer_button or CTCSS tone (with a timeout) and open the interface if received"""
 		if not self.getconf("incall"):
-			self.debug("process_incall: incalls disabled for extension: %s" %self.phonepatch_extension)
+			self.debug("process_incall: incalls disabled for extension: %s", self.phonepatch_extension)
 			return
 		calltimeout = time.time() +self.getconf("incall_report_timeout")
 		answer_button = self.getconf("incall_answer_button")
@@ -609,8 +796,8 @@ class Phonepatch:
 			if not mode or mode == "open": 
 				self.debug("process_incall: answer mode set to open, opening channel")
 				return "answered"
-			elif mode == "dtmf": self.debug("process_incall: waiting for DTMF button: %s" %answer_button)
-			elif mode == "ctcss": self.debug("process_incall: waiting for CTCSS tone %0.1f" %ctcss_rx_freq)
+			elif mode == "dtmf": self.debug("process_incall: waiting for DTMF button: %s", answer_button)
+			elif mode == "ctcss": self.debug("process_incall: waiting for CTCSS tone %0.1f", ctcss_rx_freq)
 			timeout = time.time() + self.getconf("incall_report_audio_wait")
 			while time.time() < timeout:
 				if not self.flush_asterisk(): 
@@ -619,19 +806,19 @@ class Phonepatch:
 				data = self.radio.read_audio(self.buffer_size)
 				if not self.radio.carrier_state: continue
 				if mode == "dtmf":
-					keys = self.dtmf_decoder.decode_buffer(data)
-					for key in keys: self.debug("process_incall: DTMF button received: %s" %key)
+					keys = self.decode_dtmf(data)
+					for key in keys: self.debug("process_incall: DTMF button received: %s", key)
 					if answer_button in keys:				
 						return "answered"
 				elif mode == "ctcss":
 					self.radio.decode_ctcss(data)
 					tone = self.radio.get_ctcss_tone()
 					if tone == ctcss_rx_freq:
-						self.debug("process_incall: extension ctcss_rx tone %0.1f detected" %ctcss_rx_freq)
+						self.debug("process_incall: extension ctcss_rx tone %0.1f detected", ctcss_rx_freq)
 						return "answered"
 			
 			if time.time() > calltimeout:
-				self.debug("process_incall: timeout reached: %d seconds" %self.getconf("incall_report_timeout"))
+				self.debug("process_incall: timeout reached: %d seconds", self.getconf("incall_report_timeout"))
 				self.play(True, True, self.getconf("incall_report_timeout_audio"))
 				return
 
@@ -640,100 +827,20 @@ class Phonepatch:
 		"""Callback function to test if an outcall is still active"""
 		return (os.path.exists(self.outcallfile) and not self.call_active)
 	###################################
-	def dtmf_replace(self, pair):
-		d = {}
-		d["2A"] = "A"
-		d["2B"] = "B"
-		d["2C"] = "C"
-		d["3A"] = "D"
-		d["3B"] = "E"
-		d["3C"] = "F"
-		d["4A"] = "G"
-		d["4B"] = "H"
-		d["4C"] = "I"
-		d["5A"] = "J"
-		d["5B"] = "K"
-		d["5C"] = "L"
-		d["6A"] = "M"
-		d["6B"] = "N"
-		d["6C"] = "O"
-		d["7A"] = "P"
-		d["7B"] = "Q"
-		d["7C"] = "R"
-		d["7D"] = "S"
-		d["8A"] = "T"
-		d["8B"] = "U"
-		d["8C"] = "V"
-		d["9A"] = "W"
-		d["9B"] = "X"
-		d["9C"] = "Y"
-		d["9D"] = "Z"
-		#return d[pair]
-		return d[pair]
-
-	###################################
-	def verify_checksum(self, number):
-		verify = 0	
-		checksum = number[len(number)-1]
-		for p in range(1, (len(number) - 1)):
-			c = number[p]
-			if c == "A":
-				verify = verify + 0 
-			elif c == "B":
-				verify = verify + 1
-			elif c == "C":
-				verify = verify + 2
-			elif c == "D":
-				verify = verify + 3
-			else:
-				verify = verify + int(number[p])
-		if str(verify)[len(str(verify))-1]  == checksum:
-			self.debug("Checksum Verified!")
-			return True
-		else: 
-			self.debug("Checksum Failed")
-			self.debug("Expected " + checksum)
-			self.debug("Calculated " + str(verify)[len(str(verify))-1])
-			return False
-
-	###################################
-	def process_number(self, number):
-		def is_number(s):
-			try:
-				int(s)
-				return True
-			except ValueError:
-				return False
-
-		# DTMF mode
-		#Loop through pairs and if repeating digit, return digit, otherwise translate.
-		translated_number = ""
-		if number[0] == "A": #This is a callsign, so decode it.
-			pairstart = True
-			for p in range(1,(len(number) - 3)):
-				nextchar = number[p+1]
-				if ( is_number(number[p]) and not is_number(nextchar)): #Valid number letter pair
-					newpair = number[p] + nextchar
-					self.debug(newpair)
-					translated_number = translated_number + self.dtmf_replace(newpair)
-				elif (is_number(number[p]) and is_number(nextchar)): #valid number.
-					translated_number = translated_number + number[p] #this is for the callsign number
-				else:
-					self.debug("Mid Pair!")
-			return translated_number	
-		else:
-			return null
-		#self.debug(number.length)
-			
-	###################################
 	def make_call(self, callsign, symbol):
 				
 		# Now make the outcall and wait for asterisk response
 		self.debug("make_call: start")
 		#number = "@" + number
 	        self.play(True, False,"@"+ callsign)
-		self.aprs = aprs.Aprs()
-                self.aprs.send_packet(callsign,symbol, 1)
+		import aprs
+		self.aprs = aprs.Aprs(self.getconf("aprs_server"))
+		start = time.time()
+		try: self.aprs.send_packet(callsign, symbol, STATION_NUMBER)
+		except:
+			APRS_SEND_ERRORS.inc()
+			raise
+		APRS_SEND_TIME.observe(time.time() - start)
 		return True
 		
 	###################################
@@ -741,12 +848,9 @@ class Phonepatch:
 		"""Bind a list of signal to default signal_handler"""
 		for sig in signals:
 			signal.signal(sig, self.signal_handler)
-
-	#####################################
-	def sleep_daemon(self):
-		self.call_active = "active"
-		while self.call_active:
-			time.sleep(0.1)
+		# Reload must not interrupt audio reads (restart system calls)
+		if signal.SIGHUP in signals and hasattr(signal, "siginterrupt"):
+			signal.siginterrupt(signal.SIGHUP, False)
 
 	#######################################
 	def check_daemon(self):
@@ -755,12 +859,12 @@ class Phonepatch:
 		# Check /proc info to check if it is really a phonepatch daemon running
 		statfile = "/proc/%d/stat" % pid 
 		try: fd = open(statfile)
-		except IOError: self.debug("check_daemon: cannot read process status (%s)" %statfile); return
+		except IOError: self.debug("check_daemon: cannot read process status (%s)", statfile); return
 		name = fd.read().split()[1]
 		if name.find("phonepatch") < 0 and name.find("asterisk-phone") < 0 :
 			self.debug("check_daemon: pidfile found but not a phonepatch daemon, so deleting it")
 			try: os.unlink(self.pidfile)
-			except: self.debug("check_daemon: error deleting pidfile" %self.pidfile)
+			except: self.debug("check_daemon: error deleting pidfile: %s", self.pidfile)
 			return
 		return pid
 
@@ -768,37 +872,78 @@ class Phonepatch:
 	def init_daemon(self):
 		if self.background: 
 			syslog.openlog("phonepatch", syslog.LOG_PID, syslog.LOG_DAEMON)
+			logger.set_output(syslog.syslog)
 			self.modules_verbose = False
 		
 		pid = self.check_daemon()
-		if pid: self.debug("init_daemon: phonepatch daemon is already runnning with pid %d" %pid, 1)
+		if pid: self.debug("init_daemon: phonepatch daemon is already runnning with pid %d", pid, exit = 1)
 			
 		# Init flag variables (pause and continue) and set signals
-		self.set_signals([signal.SIGTERM, signal.SIGINT])
+		self.set_signals([signal.SIGTERM, signal.SIGINT, signal.SIGHUP])
 
 		asterisk_groups = [x[2] for x in grp.getgrall() if "asterisk" in x[3]]
 		self.create_pidfile()
+		self.start_metrics()
+		self.open_user_store()
+
+	###################################
+	def open_user_store(self):
+		"""Open APRStt user store if user_store is enabled"""
+		path = self.getconf("user_store")
+		if not path or path == "off": return
+		try:
+			import userstore
+			self.user_store = userstore.UserStore(path, self.getconf("user_store_cache_size"))
+		except Exception, detail:
+			self.debug("open_user_store: cannot open %s: %s", path, detail)
+			return
+		self.debug("open_user_store: using user store %s", path)
+
+	###################################
+	def start_metrics(self):
+		"""Serve metrics endpoint if metrics_listen is enabled"""
+		address = self.getconf("metrics_listen")
+		if not address or address == "off": return
+		try: metrics.start_server(address)
+		except Exception, detail:
+			self.debug("start_metrics: cannot listen on %s: %s", address, detail)
+			return
+		self.debug("start_metrics: serving metrics on %s", address)
 		
 	###################################
-	def process_noisy_number(self, number, noisy_button):
-		"""All repetitions between a noisy_button are 
-		removed (and noisy_button itself)"""
-		if not noisy_button or type(noisy_button) != str or len(noisy_button) != 1: 
-			return number
-		output = ""
-		memory = None
-		for n in number:
-			if n == noisy_button and memory != None:
-				output += memory
-				memory = None
-			elif n != noisy_button and memory != None and n != memory: 
-				output += memory
-				memory = n
-			elif n != noisy_button and memory == None:
-				memory = n
-		if n != noisy_button:
-			output = output + n
-		return output
+	def decode_dtmf(self, data):
+		"""Decode DTMF keys from audio data (updates decoder metrics)"""
+		windows = self.dtmf_decoder.windows
+		start = time.time()
+		keys = self.dtmf_decoder.decode_buffer(data)
+		windows = self.dtmf_decoder.windows - windows
+		if windows: DTMF_WINDOW_TIME.observe((time.time() - start) / windows, windows)
+		if keys: DTMF_KEYS.inc(len(keys))
+		return keys
+
+	###################################
+	def resolve_callsign(self, fields):
+		"""Return callsign for an accepted number: abbreviated entries and 
+		known users from the user store, then the decoded callsign"""
+		callsign = fields["callsign"]
+		if not self.user_store: return callsign
+		keys = fields["number"][:-2]
+		try:
+			callsign = self.user_store.resolve(keys) or callsign
+			if callsign:
+				import aprs
+				position = aprs.Aprs(self.getconf("aprs_server")).get_position(STATION_NUMBER)
+				self.user_store.heard(keys, callsign, fields["symbol"], position)
+		except self.user_store.Error, detail: 
+			self.debug("resolve_callsign: user store error: %s", detail)
+		return callsign
+
+	###################################
+	def create_validator(self):
+		"""Return APRStt number validator for the dial keys"""
+		noisy_button = self.getconf("dtmf_noisy_mode_button")
+		if noisy_button == "off": noisy_button = None
+		return touchtone.Validator(self.getconf("outcall_button"), self.getconf("clear_button"), noisy_button)
 
 	###################################
 	def loop_daemon(self):
@@ -809,23 +954,25 @@ class Phonepatch:
 		self.accept_agicalls = True
 		while 1:
 			self.radio.set_ptt(False)
-			if mode == "dtmf": self.debug("loop_daemon: waiting askfortone DTMF button: %s" %button)
+			if mode == "dtmf": self.debug("loop_daemon: waiting askfortone DTMF button: %s", button)
 			if self.ctcss_decoder: self.debug("loop_daemon: CTCSS decoding enabled")
 			self.radio.clear_ctcss()
 			
 			# CTCSS decoding always done (as it can be enabled inside an extension)
 			# DTMF decoding only if asked globally
 			while 1:
-				if self.call_active:
-					self.sleep_daemon()
+				if self.reload_pending: self.reload_configuration()
+				request = self.control_enabled and self.control.get_request()
+				if request:
+					self.handle_call(request)
 					continue
 
 				try: data = self.radio.read_audio(self.buffer_size)
 				except: self.debug("loop_daemon: error reading from radio"); return
 				if mode == "dtmf": # and self.radio.carrier_state:
 										
-					keys = self.dtmf_decoder.decode_buffer(data)
-					for key in keys: self.debug("loop_daemon: DTMF button received: %s" %key)
+					keys = self.decode_dtmf(data)
+					for key in keys: self.debug("loop_daemon: DTMF button received: %s", key)
 					if button in keys:				
 						break
 				self.radio.decode_ctcss(data)
@@ -836,14 +983,14 @@ class Phonepatch:
 				number = self.getconf("outcall_ctcss_autocall", extension)
 				if number:
 					self.accept_agicalls = False
-					self.debug("loop_daemon: ctcss autocall: %s" %number)
+					self.debug("loop_daemon: ctcss autocall: %s", number)
 					self.phonepatch_extension = extension
 					if not self.make_call(number):
 						self.play(True, False, self.getconf("ring_timeout_audio"))
 					self.accept_agicalls = True
 					continue
 				elif extension:
-					self.debug("loop_daemon: ctcss_rx tone detected for extension: %s" %extension)
+					self.debug("loop_daemon: ctcss_rx tone detected for extension: %s", extension)
 					self.phonepatch_extension = extension
 					break
 
@@ -852,10 +999,13 @@ class Phonepatch:
 	 		self.play(True, False, "@A P R S Touch Tone")
 			
 			self.debug("loop_daemon: waiting for number and outcall_button")
-			timeout_time = time.time() + self.getconf("tone_timeout")
-			dtmf_keys = []
-			while 1:
-				now = time.time()
+			clock = self.radio.clock
+			timeout_time = clock.time() + self.getconf("tone_timeout")
+			validator = self.create_validator()
+			result = touchtone.INCOMPLETE
+			while result not in (touchtone.ACCEPTED, touchtone.REJECTED):
+				if self.reload_pending: self.reload_configuration()
+				now = clock.time()
 				if now >= timeout_time:
 					self.debug("loop_daemon: dial period number timed out")
 					self.play(True, False, self.getconf("tone_timeout_audio"))
@@ -863,32 +1013,28 @@ class Phonepatch:
 				data = self.radio.read_audio(self.buffer_size)
 				if not data: break
 				#if not self.radio.carrier_state: continue
-				keys = self.dtmf_decoder.decode_buffer(data)
-				dtmf_keys += keys
-				for key in keys: 
-					self.debug("loop_daemon: DTMF button received: %s (current number: %s)" %(key, "".join(dtmf_keys)))
-				if self.getconf("clear_button") in dtmf_keys:
-					dtmf_keys = dtmf_keys[dtmf_keys.index(self.getconf("clear_button"))+1:]
-					self.debug("loop_daemon: clear_button received, restart dial process")
-					continue
-				if self.getconf("outcall_button") in dtmf_keys: 
-					dtmf_keys = dtmf_keys[:dtmf_keys.index(self.getconf("outcall_button"))]
-					if not dtmf_keys: self.debug("loop_daemon: number void"); continue
-					# We have a number (in a list) to call to, convert to string
-					number = "".join(dtmf_keys)
-					noisy_button = self.getconf("dtmf_noisy_mode_button")
-					if noisy_button and noisy_button != "off":
-						number = self.process_noisy_number(number, noisy_button)
-					self.debug("loop_daemon: outcall_button received, making a call to %s" %number)
-					if self.verify_checksum(number):
-						symbol = number[len(number)-2]
-						if not self.make_call(self.process_number(number), symbol):
-							self.play(True, False, self.getconf("ring_timeout_audio"))
-						dtmf_keys = []
-					else:
-						time.sleep(0.1)
-						self.play(True, False, "@Error in checksum. Please try again")	
-					break
+				for key in self.decode_dtmf(data):
+					result = validator.feed(key)
+					self.debug("loop_daemon: DTMF button received: %s (current number: %s)", key, validator.get_number())
+					if result == touchtone.CLEARED:
+						self.debug("loop_daemon: clear_button received, restart dial process")
+					elif result == touchtone.VOID: self.debug("loop_daemon: number void")
+					elif result != touchtone.INCOMPLETE: break
+			if result == touchtone.ACCEPTED:
+				fields = validator.fields
+				self.debug("loop_daemon: outcall_button received, checksum verified, making a call to %s", fields["number"])
+				callsign = self.resolve_callsign(fields)
+				if not callsign:
+					self.debug("loop_daemon: unknown callsign for %s", fields["number"])
+					self.play(True, False, "@Unknown callsign. Please try again")
+				elif not self.make_call(callsign, fields["symbol"]):
+					self.play(True, False, self.getconf("ring_timeout_audio"))
+			elif result == touchtone.REJECTED:
+				fields = validator.fields
+				self.debug("loop_daemon: checksum failed for %s (expected %s, calculated %s)", \
+					fields["number"], fields["number"][-1:], fields["expected_checksum"])
+				time.sleep(0.1)
+				self.play(True, False, "@Error in checksum. Please try again")	
 		self.accept_agicalls = False
 
 	###################################
@@ -910,11 +1056,16 @@ class Phonepatch:
 		if not self.init_php(phonepatch): return
 		if not self.getconf("outcall_daemon"):
 			if not background:
-				self.debug("daemon: outcall_daemon disabled, daemon not loaded for phonepatch: %s" %phonepatch)
+				self.debug("daemon: outcall_daemon disabled, daemon not loaded for phonepatch: %s", phonepatch)
 			return
 		if self.background:
 			pid = daemonize.daemonize(return_child=True)
 			if pid: return pid
+		self.run_daemon(testcall)
+
+	###################################
+	def run_daemon(self, testcall=None):
+		"""Run daemon loop for the phonepatch initialized with init_php()"""
 		self.set_state("daemon")
 		self.init_daemon()
 		self.open_radio()
@@ -934,6 +1085,38 @@ class Phonepatch:
 					break
 			except Exception, e: 
 				self.print_exception(e)
+
+	###################################
+	def preload(self, phonepatch):
+		"""Initialize phonepatch and build its decoder tables before the
+		supervisor forks, so workers share them (copy-on-write)"""
+		if not self.init_php(phonepatch): return
+		mintime = self.getconf("ctcss_decoder_mintime")
+		if mintime:
+			import ctcss
+			ctcss.Decoder(self.asterisk_samplerate, self.sample_width, mintime)
+		return phonepatch
+
+	###################################
+	def remove_stale_pidfile(self):
+		"""Delete pidfile and control socket left by a dead daemon"""
+		try: pid = self.read_pidfile()
+		except (IOError, ValueError): return
+		try: os.kill(pid, 0)
+		except OSError, e:
+			if e.errno != errno.ESRCH: return
+			self.debug("remove_stale_pidfile: daemon %d not running", pid)
+			self.delete_pidfile()
+
+	###################################
+	def worker(self):
+		"""Supervisor worker: run background daemon, return exit code.
+		The daemon loop only ends on errors (e.g. soundcard read failure),
+		so the supervisor restarts the worker. SIGTERM exits with 0"""
+		self.background = True
+		self.run_daemon()
+		self.end_daemon()
+		return 1
 			
 
 	####################################
@@ -943,6 +1126,41 @@ class Phonepatch:
 		for line in str(e).splitlines():
 			self.debug(line)
 
+####################################
+def diff_configuration(old, new):
+	"""Return sorted list of parameters changed (in any section)"""
+	changed = {}
+	for section in dict.fromkeys(list(old) + list(new)):
+		oldsection, newsection = old.get(section, {}), new.get(section, {})
+		for parameter in dict.fromkeys(list(oldsection) + list(newsection)):
+			if parameter not in oldsection or parameter not in newsection or \
+					oldsection[parameter] != newsection[parameter]:
+				changed[parameter] = True
+	changed = changed.keys()
+	changed.sort()
+	return changed
+
+####################################
+def supervise(configuration, phonepatchs, verbose, source):
+	"""Run background daemons for phonepatchs as supervised workers"""
+	import supervisor
+	daemons = {}
+	def preload():
+		for phpname in phonepatchs:
+			php = Phonepatch(configuration, verbose=verbose, source=source)
+			php.background = True
+			if php.preload(phpname) and php.getconf("outcall_daemon"):
+				daemons[phpname] = php
+	def cleanup(phpname):
+		daemons[phpname].remove_stale_pidfile()
+	def run_worker(phpname):
+		return daemons[phpname].worker()
+	preload()
+	names = [phpname for phpname in phonepatchs if phpname in daemons]
+	if not names: sys.stderr.write("no phonepatch daemons enabled\n"); return 1
+	pidfile = os.path.join(PIDFILE_DIR, SUPERVISOR_PIDFILE)
+	return supervisor.Supervisor(names, run_worker, pidfile, cleanup=cleanup, verbose=verbose).run()
+
 ####################################
 def get_phpconfigs(configuration):
 	phpconfigs = []
@@ -964,15 +1182,20 @@ and spawn outgoing calls when required (via DTMF tones)"""
 	optpar = optparse.OptionParser(usage)
 	optpar.add_option('-q', '--quiet', dest='verbose', default = True, action='store_false', help = 'Be quiet (disable verbose mode)')
 	optpar.add_option('-f', '--configuration-file',  dest='configuration_file', type = "string", default = default_configuration, help = 'Use configuration file')
+	optpar.add_option('-c', '--cache-file',  dest='cache_file', type = "string", default = "", help = 'Compiled configuration cache (default: CONFIGURATION.cache, "off" to disable)')
 	optpar.add_option('-p', '--phonepatch',  dest='phonepatch',  metavar = 'NAME', default="", type = "string", help = 'Use phonepatch in foreground mode')
 	optpar.add_option('-o', '--test-outcall',  dest='test_outcall', metavar = 'NUMBER', type = "string", help = 'Make an outcall test')
 	optpar.add_option('-b', '--background',  dest='background',  default = False, action = 'store_true', help = 'Run in background')
 
 	options, args = optpar.parse_args()
 	
-	config = templateparser.Parser(verbose = True)
-	config.read_template(default_template)
-	configuration = config.read_configuration(options.configuration_file)
+	# Absolute paths, as background daemons chdir to / and reload on SIGHUP
+	template = os.path.abspath(default_template)
+	configuration_file = os.path.abspath(options.configuration_file)
+	cachefile = options.cache_file or None
+	if cachefile == "off": cachefile = ""
+	elif cachefile: cachefile = os.path.abspath(cachefile)
+	configuration = configcache.load(template, configuration_file, cachefile, verbose = True)
 		
 	# Run daemon (default), incall or outcall mode
 	
@@ -984,8 +1207,11 @@ and spawn outgoing calls when required (via DTMF tones)"""
 		if not options.background: 
 			phonepatchs = [phonepatchs[0]]
 			sys.stdout.write("using default phonepatch: %s\n" %phonepatchs[0])
+	source = (template, configuration_file, cachefile)
+	if options.background and options.test_outcall == None:
+		sys.exit(supervise(configuration, phonepatchs, options.verbose, source))
 	for phpname in phonepatchs:
-		php = Phonepatch(configuration, verbose=options.verbose)
+		php = Phonepatch(configuration, verbose=options.verbose, source=source)
 		php.daemon(phpname, options.background, options.test_outcall)		
 	sys.exit(0)
 
@@ -0,0 +1,317 @@
+#!/usr/bin/python
+
+# This file is part of asterisk-phonepatch
+
+# Copyright (C) 2011 Stephen Hamilton
+#
+# Asterisk-phonepatch is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+"""Audio backends for radio.Radio.
+
+A device is given as "backend:arguments" (a plain path uses the OSS
+backend). Every backend returns a soundcard-like object with read(size),
+write(data), sync() and close() methods, and optionally obufcount()
+(frames written but not played yet).
+
+	oss:/dev/dsp        OSS device (soundcard module)
+	alsa:DEVICE         ALSA PCM device (pyalsaaudio), e.g. alsa:default,
+	                    alsa:hw:0,0 or alsa:pipewire/alsa:jack through the
+	                    ALSA plugins for PipeWire and JACK
+	pipe:[INPUT,OUTPUT] raw audio from/to files or FIFOs (default: stdin
+	                    and stdout, "-" also selects them)
+	null:               silence in, audio out discarded (real-time paced)
+	loopback:[NAME]     audio written (or injected) is read back
+	replay:FILE         recording fed back faster than real time
+"""
+
+# Standard Python modules
+import os, sys, time, errno
+import threading
+
+# External phonepatch modules
+import audiofile
+
+__version__ = "$Revision: 0.1 $"
+__author__ = "Stephen Hamilton <stephenshamilton@gmail.com>"
+__depends__ = ['Python-2.4']
+__copyright__ = """Copyright (C) 2011 Stephen Hamilton.
+This code is distributed under the terms of the GNU General Public License."""
+
+DEFAULT_BACKEND = "oss"
+
+###############################
+def optional_module(name):
+	"""Import a backend module when the backend is opened (None if it is
+	not installed, so the backend fails to open)"""
+	try: return __import__(name)
+	except ImportError: return None
+
+###############################
+###############################
+class Pacer:
+	"""Sleep so that audio is consumed/produced at real-time rate"""
+	###############################
+	def __init__(self, bytes_per_second, realtime=True):
+		self.bytes_per_second = float(bytes_per_second)
+		self.realtime = realtime
+		self.next_time = None
+
+	###############################
+	def wait(self, size):
+		if not self.realtime: return
+		now = time.time()
+		if self.next_time == None or self.next_time < now - 1.0:
+			self.next_time = now
+		self.next_time += size / self.bytes_per_second
+		if self.next_time > now: time.sleep(self.next_time - now)
+
+###############################
+###############################
+class NullSoundcard:
+	"""Read silence, discard writes"""
+	###############################
+	def __init__(self, samplerate, channels, sample_width, realtime=True):
+		self.frame = channels * sample_width
+		bytes_per_second = samplerate * self.frame
+		self.read_pacer = Pacer(bytes_per_second, realtime)
+		self.write_pacer = Pacer(bytes_per_second, realtime)
+
+	###############################
+	def read(self, size):
+		size -= size % self.frame
+		self.read_pacer.wait(size)
+		return "\x00" * size
+
+	###############################
+	def write(self, data):
+		self.write_pacer.wait(len(data))
+		return len(data)
+
+	###############################
+	def obufcount(self):
+		return 0
+
+	###############################
+	def sync(self):
+		pass
+
+	###############################
+	def close(self):
+		pass
+
+###############################
+###############################
+class LoopbackSoundcard(NullSoundcard):
+	"""Audio written (or given to inject) is read back, silence otherwise.
+	Loopbacks are shared by name, so a test can inject audio into the
+	device a Radio has opened (see get_loopback)"""
+	###############################
+	def __init__(self, samplerate, channels, sample_width, realtime=True):
+		NullSoundcard.__init__(self, samplerate, channels, sample_width, realtime)
+		self.buffer = []
+		self.buffered = 0
+		self.written = 0
+		self.lock = threading.Lock()
+
+	###############################
+	def inject(self, data):
+		"""Queue audio to be read"""
+		self.lock.acquire()
+		self.buffer.append(data)
+		self.buffered += len(data)
+		self.lock.release()
+
+	###############################
+	def pending(self):
+		return self.buffered
+
+	###############################
+	def read(self, size):
+		size -= size % self.frame
+		self.read_pacer.wait(size)
+		self.lock.acquire()
+		data = "".join(self.buffer)
+		output, data = data[:size], data[size:]
+		self.buffer = data and [data] or []
+		self.buffered = len(data)
+		self.lock.release()
+		return output + "\x00" * (size - len(output))
+
+	###############################
+	def write(self, data):
+		NullSoundcard.write(self, data)
+		self.written += len(data)
+		self.inject(data)
+		return len(data)
+
+loopbacks = {}
+
+###############################
+def get_loopback(name="", samplerate=8000, channels=1, sample_width=2, realtime=True):
+	"""Return loopback device <name> (created if it does not exist)"""
+	if name not in loopbacks:
+		loopbacks[name] = LoopbackSoundcard(samplerate, channels, sample_width, realtime)
+	return loopbacks[name]
+
+###############################
+###############################
+class PipeSoundcard:
+	"""Raw audio read from a file descriptor and written to another one.
+	End of input raises IOError"""
+	###############################
+	def __init__(self, infd, outfd, frame):
+		self.infd = infd
+		self.outfd = outfd
+		self.frame = frame
+
+	###############################
+	def read(self, size):
+		size -= size % self.frame
+		data = ""
+		while len(data) < size:
+			try: chunk = os.read(self.infd, size - len(data))
+			except OSError, e:
+				if e.errno == errno.EINTR: continue
+				raise IOError, (e.errno, e.strerror)
+			if not chunk: break
+			data += chunk
+		if not data: raise IOError, (errno.ENODATA, "end of audio input")
+		return data[:len(data) - len(data) % self.frame]
+
+	###############################
+	def write(self, data):
+		total = len(data)
+		while data:
+			try: written = os.write(self.outfd, data)
+			except OSError, e:
+				if e.errno == errno.EINTR: continue
+				raise IOError, (e.errno, e.strerror)
+			data = data[written:]
+		return total
+
+	###############################
+	def sync(self):
+		pass
+
+	###############################
+	def close(self):
+		for fd in (self.infd, self.outfd):
+			if fd > 2: os.close(fd)
+
+###############################
+###############################
+class AlsaSoundcard:
+	"""ALSA capture/playback PCMs (blocking) with negotiated period size.
+	Reads return exactly the requested size, assembled from periods"""
+	###############################
+	def __init__(self, device, samplerate, channels, sample_width, fragmentsize):
+		alsaaudio = optional_module("alsaaudio")
+		if not alsaaudio: raise IOError, (errno.ENODEV, "ALSA backend needs pyalsaaudio")
+		if sample_width != 2: raise ValueError, "ALSA backend only supports 16 bits samples"
+		self.frame = channels * sample_width
+		self.period = max(1, int(fragmentsize or 1024) / self.frame)
+		self.pcms = []
+		for pcmtype in (alsaaudio.PCM_CAPTURE, alsaaudio.PCM_PLAYBACK):
+			pcm = alsaaudio.PCM(pcmtype, alsaaudio.PCM_NORMAL, device)
+			pcm.setchannels(channels)
+			pcm.setrate(samplerate)
+			pcm.setformat(alsaaudio.PCM_FORMAT_S16_LE)
+			self.period = pcm.setperiodsize(self.period) or self.period
+			self.pcms.append(pcm)
+		self.capture, self.playback = self.pcms
+		self.fragmentsize = self.period * self.frame
+		self.buffer = ""
+		self.overruns = 0
+
+	###############################
+	def read(self, size):
+		size -= size % self.frame
+		while len(self.buffer) < size:
+			length, data = self.capture.read()
+			if length < 0:
+				# Overrun (-EPIPE): the PCM is recovered by pyalsaaudio
+				self.overruns += 1
+				continue
+			self.buffer += data
+		data, self.buffer = self.buffer[:size], self.buffer[size:]
+		return data
+
+	###############################
+	def write(self, data):
+		self.playback.write(data)
+		return len(data)
+
+	###############################
+	def sync(self):
+		try: self.playback.drain()
+		except AttributeError: pass
+
+	###############################
+	def close(self):
+		for pcm in self.pcms: pcm.close()
+		self.pcms = []
+
+###############################
+def open_oss(arguments, samplerate, channels, sample_width, sampleformat, fragmentsize, mode):
+	soundcard = optional_module("soundcard")
+	if not soundcard: raise IOError, (errno.ENODEV, "OSS backend needs the soundcard module")
+	return soundcard.Soundcard(device = arguments, channels = channels, mode = mode, \
+		library = "oss", samplerate = samplerate, sampleformat = sampleformat, \
+		fragmentsize = fragmentsize)
+
+###############################
+def open_alsa(arguments, samplerate, channels, sample_width, sampleformat, fragmentsize, mode):
+	return AlsaSoundcard(arguments or "default", samplerate, channels, sample_width, fragmentsize)
+
+###############################
+def open_pipe(arguments, samplerate, channels, sample_width, sampleformat, fragmentsize, mode):
+	fds = []
+	paths = (arguments or "-,-").split(",")
+	if len(paths) != 2: raise ValueError, "Pipe device syntax: pipe:[INPUT,OUTPUT]"
+	for path, stdfd, flags in zip(paths, (0, 1), (os.O_RDONLY, os.O_WRONLY | os.O_CREAT | os.O_APPEND)):
+		if path in ("", "-"): fds.append(stdfd)
+		else: fds.append(os.open(path, flags, 0644))
+	return PipeSoundcard(fds[0], fds[1], channels * sample_width)
+
+###############################
+def open_null(arguments, samplerate, channels, sample_width, sampleformat, fragmentsize, mode):
+	return NullSoundcard(samplerate, channels, sample_width)
+
+###############################
+def open_loopback(arguments, samplerate, channels, sample_width, sampleformat, fragmentsize, mode):
+	return get_loopback(arguments, samplerate, channels, sample_width)
+
+###############################
+def open_replay(arguments, samplerate, channels, sample_width, sampleformat, fragmentsize, mode):
+	return audiofile.ReplaySoundcard(arguments, samplerate, channels, sample_width)
+
+BACKENDS = {"oss": open_oss, "alsa": open_alsa, "pipe": open_pipe,
+	"null": open_null, "loopback": open_loopback, "replay": open_replay}
+
+###############################
+def parse_device(device):
+	"""Return (backend, arguments) for a device string"""
+	backend, arguments = DEFAULT_BACKEND, device
+	if device.find(":") > 0 and device[:device.find(":")] in BACKENDS:
+		backend, arguments = device.split(":", 1)
+	return backend, arguments
+
+###############################
+def open_device(device, samplerate, channels=1, sample_width=2, sampleformat="S16_LE", \
+		fragmentsize=None, mode="rw"):
+	"""Open an audio device (see module documentation for syntax)"""
+	backend, arguments = parse_device(device)
+	return BACKENDS[backend](arguments, samplerate, channels, sample_width, \
+		sampleformat, fragmentsize, mode)
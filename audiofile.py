@@ -0,0 +1,257 @@
+#!/usr/bin/python
+
+# This file is part of asterisk-phonepatch
+
+# Copyright (C) 2011 Stephen Hamilton
+#
+# Asterisk-phonepatch is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+# Standard Python modules
+import sys, time, errno
+import struct, zlib, optparse
+
+__version__ = "$Revision: 0.1 $"
+__author__ = "Stephen Hamilton <stephenshamilton@gmail.com>"
+__depends__ = ['Python-2.4']
+__copyright__ = """Copyright (C) 2011 Stephen Hamilton.
+This code is distributed under the terms of the GNU General Public License."""
+
+# Recording file: header (magic + format) followed by records
+MAGIC = "APRSTTREC1\n"
+HEADER_FORMAT = "<IHH"
+RECORD_FORMAT = "<cdI"
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+# Record types: audio read (zlib-compressed), audio written (length only), events
+AUDIO_IN = "A"
+AUDIO_OUT = "O"
+PTT_EVENT = "P"
+CARRIER_EVENT = "C"
+
+###############################
+###############################
+class Clock:
+	"""Wall clock"""
+	###############################
+	def time(self):
+		return time.time()
+
+	###############################
+	def sleep(self, seconds):
+		if seconds > 0: time.sleep(seconds)
+
+###############################
+###############################
+class VirtualClock:
+	"""Clock advanced by the audio consumed (and sleeps), never by wall time"""
+	###############################
+	def __init__(self, start=0.0):
+		self.now = start
+
+	###############################
+	def time(self):
+		return self.now
+
+	###############################
+	def sleep(self, seconds):
+		if seconds > 0: self.now += seconds
+
+	###############################
+	def advance(self, seconds):
+		self.now += seconds
+
+###############################
+###############################
+class Recorder:
+	"""Write audio read/written by the radio, plus PTT and carrier events,
+	to a chunked recording file. Each record is timestamped"""
+	###############################
+	def __init__(self, path, samplerate, channels, sample_width, clock=None, level=1):
+		self.fd = open(path, "wb")
+		self.fd.write(MAGIC + struct.pack(HEADER_FORMAT, samplerate, channels, sample_width))
+		self.clock = clock or Clock()
+		self.level = level
+
+	###############################
+	def write(self, rtype, payload, length=None):
+		if not self.fd: return
+		if length == None: length = len(payload)
+		self.fd.write(struct.pack(RECORD_FORMAT, rtype, self.clock.time(), length) + payload)
+
+	###############################
+	def audio_in(self, data):
+		self.write(AUDIO_IN, zlib.compress(data, self.level))
+
+	###############################
+	def audio_out(self, data):
+		self.write(AUDIO_OUT, "", len(data))
+
+	###############################
+	def event(self, rtype, state):
+		self.write(rtype, chr(int(bool(state))))
+
+	###############################
+	def close(self):
+		if not self.fd: return
+		self.fd.close()
+		self.fd = None
+
+###############################
+def read_recording(path):
+	"""Return (samplerate, channels, sample_width) and a generator of
+	(type, timestamp, data) records (data decompressed for audio input,
+	state for events, length for audio output)"""
+	fd = open(path, "rb")
+	if fd.read(len(MAGIC)) != MAGIC:
+		fd.close()
+		raise ValueError, "Not an audio recording: %s" %path
+	header = struct.unpack(HEADER_FORMAT, fd.read(struct.calcsize(HEADER_FORMAT)))
+	return header, iter_records(fd)
+
+###############################
+def iter_records(fd):
+	try:
+		while 1:
+			data = fd.read(RECORD_SIZE)
+			if len(data) < RECORD_SIZE: break
+			rtype, timestamp, length = struct.unpack(RECORD_FORMAT, data)
+			if rtype == AUDIO_IN: yield rtype, timestamp, zlib.decompress(fd.read(length))
+			elif rtype == AUDIO_OUT: yield rtype, timestamp, length
+			else: yield rtype, timestamp, bool(ord(fd.read(length)))
+	finally:
+		fd.close()
+
+###############################
+###############################
+class RecordingSoundcard:
+	"""Soundcard wrapper recording everything read and written"""
+	###############################
+	def __init__(self, soundcard, recorder):
+		self.soundcard = soundcard
+		self.recorder = recorder
+
+	###############################
+	def __getattr__(self, name):
+		return getattr(self.soundcard, name)
+
+	###############################
+	def read(self, size):
+		data = self.soundcard.read(size)
+		if data: self.recorder.audio_in(data)
+		return data
+
+	###############################
+	def write(self, data):
+		self.recorder.audio_out(data)
+		return self.soundcard.write(data)
+
+	###############################
+	def close(self):
+		self.soundcard.close()
+		self.recorder.close()
+
+###############################
+###############################
+class ReplaySoundcard:
+	"""Soundcard-like object that feeds a recording back (as fast as it is
+	read) and advances a virtual clock with the audio read and written.
+	Reads past the end of the recording raise IOError"""
+	###############################
+	def __init__(self, path, samplerate, channels, sample_width):
+		header, self.records = read_recording(path)
+		if header != (samplerate, channels, sample_width):
+			raise ValueError, "Recording format %s does not match %s" \
+				%(header, (samplerate, channels, sample_width))
+		self.bytes_per_second = float(samplerate * channels * sample_width)
+		self.clock = VirtualClock()
+		self.buffer = ""
+		self.carrier = False
+		self.written = 0
+		self.started = False
+		# Start the virtual clock at the recording start time
+		self.fill(1)
+
+	###############################
+	def fill(self, size):
+		while len(self.buffer) < size:
+			try: rtype, timestamp, data = self.records.next()
+			except StopIteration: return
+			if not self.started:
+				self.clock.now = timestamp
+				self.started = True
+			if rtype == AUDIO_IN: self.buffer += data
+			elif rtype == CARRIER_EVENT: self.carrier = data
+
+	###############################
+	def read(self, size):
+		self.fill(size)
+		if not self.buffer: raise IOError, (errno.ENODATA, "end of replayed recording")
+		data, self.buffer = self.buffer[:size], self.buffer[size:]
+		self.clock.advance(len(data) / self.bytes_per_second)
+		return data
+
+	###############################
+	def write(self, data):
+		self.written += len(data)
+		self.clock.advance(len(data) / self.bytes_per_second)
+		return len(data)
+
+	###############################
+	def get_carrier(self):
+		"""Carrier state recorded up to the current replay position"""
+		return self.carrier
+
+	###############################
+	def obufcount(self):
+		return 0
+
+	###############################
+	def sync(self):
+		pass
+
+	###############################
+	def close(self):
+		self.buffer = ""
+		self.records = iter(())
+
+###############################
+def main():
+	usage = """
+	audiofile.py [options] RECORDING: Show or extract a radio audio recording"""
+	parser = optparse.OptionParser(usage)
+	parser.add_option('-x', '--extract', dest='extract', default="", metavar='FILE', type='string', help='Extract received audio (raw) to file')
+	options, args = parser.parse_args()
+	if len(args) != 1:
+		parser.print_help()
+		sys.exit(1)
+	(samplerate, channels, sample_width), records = read_recording(args[0])
+	print "format: %d sps, %d channels, %d bytes/sample" %(samplerate, channels, sample_width)
+	bytes_per_second = float(samplerate * channels * sample_width)
+	output = None
+	if options.extract: output = open(options.extract, "wb")
+	names = {PTT_EVENT: "ptt", CARRIER_EVENT: "carrier"}
+	received = sent = 0
+	for rtype, timestamp, data in records:
+		if rtype == AUDIO_IN:
+			received += len(data)
+			if output: output.write(data)
+		elif rtype == AUDIO_OUT: sent += data
+		else: print "%0.3f %s %s" %(timestamp, names.get(rtype, rtype), {False: "off", True: "on"}[data])
+	if output: output.close()
+	print "received: %0.2f seconds, sent: %0.2f seconds" %(received / bytes_per_second, sent / bytes_per_second)
+
+############################
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,67 @@
+#!/usr/bin/python
+
+# This file is part of asterisk-phonepatch
+
+# Copyright (C) 2011 Stephen Hamilton
+#
+# Asterisk-phonepatch is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+"""Sin/cos correlation tables shared by the DTMF and CTCSS decoders.
+
+Tables are computed with array operations and cached per (samplerate,
+window size, frequencies), so decoders with the same parameters share
+them. A process that builds them before forking shares them with its
+children. Cached arrays must not be modified."""
+
+# Standard Python modules
+import math
+import numarray
+
+__version__ = "$Revision: 0.1 $"
+__author__ = "Stephen Hamilton <stephenshamilton@gmail.com>"
+__depends__ = ['Numeric-Extension', 'Python-2.4']
+__copyright__ = """Copyright (C) 2011 Stephen Hamilton.
+This code is distributed under the terms of the GNU General Public License."""
+
+cache = {}
+
+###############################
+def correlation_tables(samplerate, windowsize, freqs):
+	"""Return Float64 array (2 * frequencies, windowsize) with the sin and
+	cos rows of each frequency"""
+	key = ("float", samplerate, windowsize, tuple(freqs))
+	tables = cache.get(key)
+	if tables is None:
+		x = numarray.arange(windowsize, type=numarray.Float64)
+		tables = numarray.zeros((2 * len(freqs), windowsize), type=numarray.Float64)
+		for index, freq in enumerate(freqs):
+			phase = x * (2 * math.pi * freq / samplerate)
+			tables[2*index] = numarray.sin(phase)
+			tables[2*index+1] = numarray.cos(phase)
+		cache[key] = tables
+	return tables
+
+###############################
+def fixed_tables(samplerate, windowsize, freqs, one):
+	"""Return correlation tables scaled by <one> and rounded (Int64)"""
+	key = ("fixed", samplerate, windowsize, tuple(freqs), one)
+	tables = cache.get(key)
+	if tables is None:
+		scaled = correlation_tables(samplerate, windowsize, freqs) * one
+		# Round half away from zero (as round())
+		tables = numarray.where(scaled < 0, -numarray.floor(0.5 - scaled), 
+			numarray.floor(scaled + 0.5)).astype(numarray.Int64)
+		cache[key] = tables
+	return tables
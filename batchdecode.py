@@ -0,0 +1,210 @@
+#!/usr/bin/python
+
+# This file is part of asterisk-phonepatch
+
+# Copyright (C) 2011 Stephen Hamilton
+#
+# Asterisk-phonepatch is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+# Standard Python modules
+import sys, os, optparse
+import struct, mmap, json
+import audioop, multiprocessing
+
+# External phonepatch modules
+import dtmf, ctcss, touchtone
+
+__version__ = "$Revision: 0.1 $"
+__author__ = "Stephen Hamilton <stephenshamilton@gmail.com>"
+__depends__ = ['Numeric-Extension', 'Python-2.6']
+__copyright__ = """Copyright (C) 2011 Stephen Hamilton.
+This code is distributed under the terms of the GNU General Public License."""
+
+AUDIO_EXTENSIONS = (".wav", ".raw", ".sw", ".s16")
+SAMPLE_WIDTH = 2
+
+###########################
+def debug(text, verbose=True):
+	if not verbose: return
+	sys.stderr.write(text + "\n")
+	sys.stderr.flush()
+
+###########################
+def find_files(paths):
+	"""Expand directories (recursively) to audio files"""
+	files = []
+	for path in paths:
+		if not os.path.isdir(path):
+			files.append(path)
+			continue
+		for dirpath, dirnames, filenames in os.walk(path):
+			dirnames.sort()
+			filenames.sort()
+			for filename in filenames:
+				if os.path.splitext(filename)[1].lower() in AUDIO_EXTENSIONS:
+					files.append(os.path.join(dirpath, filename))
+	return files
+
+###########################
+def parse_wav(data):
+	"""Return (samplerate, channels, offset, length) of PCM data in a WAV
+	file (memory-mapped data), or None if data is not a WAV file"""
+	if data[:4] != "RIFF" or data[8:12] != "WAVE": return
+	offset = 12
+	fmt = None
+	while offset + 8 <= len(data):
+		chunkid = data[offset:offset+4]
+		size = struct.unpack("<I", data[offset+4:offset+8])[0]
+		if chunkid == "fmt ":
+			fmt = struct.unpack("<HHIIHH", data[offset+8:offset+24])
+		elif chunkid == "data":
+			if not fmt: raise ValueError, "WAV data chunk found before fmt chunk"
+			audioformat, channels, samplerate, byterate, align, bits = fmt
+			if audioformat != 1 or bits != 8 * SAMPLE_WIDTH:
+				raise ValueError, "Only 16 bits PCM WAV files are supported"
+			return samplerate, channels, offset + 8, min(size, len(data) - offset - 8)
+		offset += 8 + size + (size % 2)
+	raise ValueError, "WAV file has no data chunk"
+
+###########################
+def decode_file(args):
+	"""Decode a file and return a list of records (dictionaries)"""
+	filename, options = args
+	try: return list(decode_file_records(filename, options))
+	except Exception, detail:
+		return [{"file": filename, "type": "error", "error": str(detail)}]
+
+###########################
+def decode_file_records(filename, options):
+	fd = open(filename, "rb")
+	size = os.fstat(fd.fileno()).st_size
+	if not size: fd.close(); return
+	data = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+	try:
+		info = parse_wav(data)
+		if info: samplerate, channels, offset, length = info
+		else: samplerate, channels, offset, length = options["samplerate"], options["channels"], 0, size
+		if channels > 2: raise ValueError, "Only mono or stereo audio is supported"
+		for record in decode_audio(data, offset, length, samplerate, channels, options):
+			record["file"] = filename
+			yield record
+	finally:
+		data.close()
+		fd.close()
+
+###########################
+def decode_audio(data, offset, length, samplerate, channels, options):
+	"""Decode memory-mapped audio, yield DTMF keys, CTCSS spans and APRStt numbers"""
+	decoder = dtmf.Decoder(samplerate = samplerate, channels = channels, \
+		sensibility = options["sensibility"])
+	ctcss_decoder = None
+	if options["ctcss_mintime"]:
+		ctcss_decoder = ctcss.Decoder(samplerate, SAMPLE_WIDTH, options["ctcss_mintime"])
+	frame = SAMPLE_WIDTH * channels
+	chunksize = decoder.windowsize * frame
+	end = offset + length - length % frame
+	validator = touchtone.Validator(options["outcall_button"], options["clear_button"], options["noisy_button"])
+	tone = tone_start = None
+	number_start = None
+
+	for position in xrange(offset, end, chunksize):
+		buffer = data[position:min(end, position + chunksize)]
+		now = float(position + len(buffer) - offset) / (frame * samplerate)
+		for key in decoder.decode_buffer(buffer):
+			yield {"type": "dtmf", "key": key, "time": round(now, 3)}
+			keys = validator.get_number()
+			result = validator.feed(key)
+			if result == touchtone.INCOMPLETE:
+				if number_start == None: number_start = now
+				continue
+			if result in (touchtone.ACCEPTED, touchtone.REJECTED):
+				yield number_record(validator.fields, keys, number_start, now)
+			number_start = None
+		if ctcss_decoder:
+			if channels == 2: buffer = audioop.tomono(buffer, SAMPLE_WIDTH, 0.5, 0.5)
+			ctcss_decoder.decode_buffer(buffer)
+			newtone = ctcss_decoder.get_tone()
+			if newtone != tone:
+				if tone: yield {"type": "ctcss", "tone": tone, "start": round(tone_start, 3), "end": round(now, 3)}
+				tone, tone_start = newtone, now
+	if tone:
+		now = float(end - offset) / (frame * samplerate)
+		yield {"type": "ctcss", "tone": tone, "start": round(tone_start, 3), "end": round(now, 3)}
+
+###########################
+def number_record(fields, keys, start, end):
+	"""Return APRStt record for the fields of a number (see touchtone.Validator)"""
+	record = dict(fields)
+	record.update({"type": "aprstt", "keys": keys, "start": round(start, 3), "end": round(end, 3)})
+	return record
+
+###########################
+def main():
+	usage = """
+	batchdecode.py [options] FILE|DIRECTORY ...: Offline DTMF/CTCSS/APRStt decoder
+
+	Decode recorded audio (WAV or raw files, directories are searched
+	recursively) in parallel, and write JSON lines with timestamped DTMF keys,
+	CTCSS tone spans and APRStt numbers. Times are seconds from file start."""
+
+	parser = optparse.OptionParser(usage)
+	parser.add_option('-q', '--quiet', dest='verbose', default=True, action='store_false', help='Be quiet')
+	parser.add_option('-o', '--output', dest='output', default="", metavar='FILE', type='string', help='Write JSON lines to file (default: standard output)')
+	parser.add_option('-j', '--jobs', dest='jobs', default=0, metavar='NUMBER', type='int', help='Decoding processes (default: number of CPUs)')
+	parser.add_option('-s', '--samplerate', dest='samplerate', default=8000, metavar='SPS', type='int', help = 'Sampling rate of raw files')
+	parser.add_option('-c', '--channels', dest='channels', default=1, metavar='NUMBER', type='int', help = 'Channels of raw files')
+	parser.add_option('-e', '--sensibility', dest='sensibility', default=1.0, metavar='VALUE', type='float', help = 'DTMF decoding sensibility (1.0 for normal)')
+	parser.add_option('-m', '--ctcss-mintime', dest='ctcss_mintime', default=0.5, metavar='SECONDS', type='float', help = 'CTCSS threshold detection time (0 disables CTCSS decoding)')
+	parser.add_option('', '--outcall-button', dest='outcall_button', default="#", metavar='KEY', type='string', help = 'Key ending a APRStt number')
+	parser.add_option('', '--clear-button', dest='clear_button', default="*", metavar='KEY', type='string', help = 'Key clearing the current APRStt number')
+	parser.add_option('', '--noisy-button', dest='noisy_button', default="", metavar='KEY', type='string', help = 'DTMF noisy mode button')
+
+	options, args = parser.parse_args()
+	if not args:
+		parser.print_help()
+		sys.exit(1)
+	files = find_files(args)
+	if not files:
+		debug("no audio files found", options.verbose)
+		sys.exit(1)
+	decode_options = {"samplerate": options.samplerate, "channels": options.channels, \
+		"sensibility": options.sensibility, "ctcss_mintime": options.ctcss_mintime, \
+		"outcall_button": options.outcall_button, "clear_button": options.clear_button, \
+		"noisy_button": options.noisy_button}
+
+	if options.output: output = open(options.output, "w")
+	else: output = sys.stdout
+	jobs = options.jobs or multiprocessing.cpu_count()
+	debug("decoding %d files with %d processes" %(len(files), jobs), options.verbose)
+	pool = multiprocessing.Pool(jobs)
+	errors = 0
+	try:
+		for records in pool.imap(decode_file, [(filename, decode_options) for filename in files]):
+			for record in records:
+				if record["type"] == "error":
+					errors += 1
+					debug("%s: %s" %(record["file"], record["error"]), options.verbose)
+				output.write(json.dumps(record, sort_keys=True) + "\n")
+			output.flush()
+	finally:
+		pool.close()
+		pool.join()
+	if options.output: output.close()
+	if errors: sys.exit(2)
+	sys.exit(0)
+
+############################
+if __name__ == "__main__":
+	main()
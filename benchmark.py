@@ -0,0 +1,456 @@
+#!/usr/bin/python
+
+# This file is part of asterisk-phonepatch
+
+# Copyright (C) 2011 Stephen Hamilton
+#
+# Asterisk-phonepatch is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+# Standard Python modules
+import sys, os, time, math
+import struct, random, optparse
+import resource, json
+
+# External phonepatch modules
+import numarray
+import dtmf, ctcss, touchtone
+
+__version__ = "$Revision: 0.1 $"
+__author__ = "Stephen Hamilton <stephenshamilton@gmail.com>"
+__depends__ = ['Numeric-Extension', 'Python-2.6']
+__copyright__ = """Copyright (C) 2011 Stephen Hamilton.
+This code is distributed under the terms of the GNU General Public License."""
+
+# Vowel formants (F1, F2) used for the synthetic talk-off speech
+FORMANTS = ((730, 1090), (270, 2290), (300, 870), (530, 1840), (660, 1720), (490, 1350), (570, 840))
+FORMANT_BANDWIDTH = 120.0
+
+SAMPLE_WIDTH = 2
+SAMPLE_MAX = 32767
+
+###########################
+def debug(text, verbose=True):
+	if not verbose: return
+	sys.stderr.write(text + "\n")
+	sys.stderr.flush()
+
+###########################
+def silence(samplerate, seconds):
+	return "\x00" * (int(seconds * samplerate) * SAMPLE_WIDTH)
+
+###########################
+def add_noise(buffer, snr, signal_rms, rng):
+	"""Add white gaussian noise to buffer for a given SNR (dB) relative to signal_rms"""
+	if snr == None: return buffer
+	sigma = signal_rms / (10.0 ** (snr / 20.0))
+	nsamples = len(buffer) / SAMPLE_WIDTH
+	samples = struct.unpack("<%dh" %nsamples, buffer)
+	gauss = rng.gauss
+	noisy = [max(-SAMPLE_MAX, min(SAMPLE_MAX, int(x + gauss(0.0, sigma)))) for x in samples]
+	return struct.pack("<%dh" %nsamples, *noisy)
+
+###########################
+def speech_like(samplerate, seconds, rng, level=0.3):
+	"""Synthetic voiced speech: syllables with gliding pitch whose harmonics are
+	shaped by vowel formants. Harmonics crossing DTMF pairs make it a talk-off test"""
+	output = []
+	total = int(seconds * samplerate)
+	while total > 0:
+		nsamples = min(total, int(rng.uniform(0.12, 0.35) * samplerate))
+		f0 = rng.uniform(90.0, 220.0)
+		glide = rng.uniform(-0.2, 0.2)
+		f1, f2 = rng.choice(FORMANTS)
+		pitch = f0 * (1.0 + glide * numarray.arange(nsamples) / float(nsamples))
+		phase = numarray.add.accumulate(2 * math.pi * pitch / samplerate)
+		signal = numarray.zeros(nsamples, type=numarray.Float64)
+		for harmonic in range(1, int(3500 / f0)):
+			freq = harmonic * f0
+			amplitude = 0.0
+			for formant in (f1, f2):
+				amplitude += 1.0 / (1.0 + ((freq - formant) / FORMANT_BANDWIDTH) ** 2)
+			signal += amplitude / harmonic * numarray.sin(harmonic * phase)
+		# Syllable envelope (raised cosine)
+		envelope = 0.5 - 0.5 * numarray.cos(2 * math.pi * numarray.arange(nsamples) / float(nsamples))
+		signal = signal * envelope
+		peak = max(abs(numarray.maximum.reduce(signal)), abs(numarray.minimum.reduce(signal))) or 1.0
+		signal = signal * (level * SAMPLE_MAX / peak)
+		output.append(struct.pack("<%dh" %nsamples, *[int(x) for x in signal]))
+		output.append(silence(samplerate, rng.uniform(0.03, 0.2)))
+		total -= nsamples
+	return "".join(output)
+
+###########################
+def dtmf_corpus(samplerate, keys, tonetime, waittime, twist, snr, rng, gain=0.5):
+	"""Return (buffer, expected) where expected is a list of (key, start, end) in samples"""
+	generator = dtmf.Generator(samplerate = samplerate)
+	buffers = [silence(samplerate, 0.2)]
+	expected = []
+	position = len(buffers[0]) / SAMPLE_WIDTH
+	tones = []
+	for key in keys:
+		tone = "".join(generator.encode_key(key, tonetime, gain, twist))
+		tones.append(tone)
+		expected.append((key, position, position + len(tone) / SAMPLE_WIDTH))
+		buffers += [tone, silence(samplerate, waittime)]
+		position += (len(tone) + len(buffers[-1])) / SAMPLE_WIDTH
+	buffers.append(silence(samplerate, 0.2))
+	buffer = "".join(buffers)
+	import audioop
+	return add_noise(buffer, snr, audioop.rms(tones[0], SAMPLE_WIDTH), rng), expected
+
+###########################
+def ctcss_corpus(samplerate, tones, duration, amplitude, snr, rng):
+	"""Return (buffer, expected) where expected is a list of (freq, start, end) in samples"""
+	buffers = []
+	expected = []
+	position = 0
+	for freq in tones:
+		generator = ctcss.Generator(samplerate, SAMPLE_WIDTH)
+		buffers.append(silence(samplerate, 0.5))
+		position += len(buffers[-1]) / SAMPLE_WIDTH
+		nbytes = int(duration * samplerate) * SAMPLE_WIDTH
+		buffers.append(generator.generate(nbytes, amplitude, freq))
+		expected.append((freq, position, position + nbytes / SAMPLE_WIDTH))
+		position += nbytes / SAMPLE_WIDTH
+	buffers.append(silence(samplerate, 0.5))
+	signal_rms = amplitude * SAMPLE_MAX / math.sqrt(2)
+	return add_noise("".join(buffers), snr, signal_rms, rng), expected
+
+###########################
+def maxrss():
+	"""Maximum resident set size (kilobytes)"""
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+###########################
+def run_dtmf(decoder, buffer, chunksize):
+	"""Decode buffer in chunks. Return (detected, cpu seconds), where
+	detected is a list of (key, sample position of detection)"""
+	detected = []
+	start = time.clock()
+	for offset in range(0, len(buffer), chunksize):
+		keys = decoder.decode_buffer(buffer[offset:offset+chunksize])
+		position = min(len(buffer), offset + chunksize) / SAMPLE_WIDTH
+		for key in keys: detected.append((key, position))
+	return detected, time.clock() - start
+
+###########################
+def run_ctcss(decoder, buffer, chunksize):
+	"""Decode buffer in chunks. Return (detected, cpu seconds), where
+	detected is a list of (tone, sample position) for each tone change"""
+	detected = []
+	current = None
+	start = time.clock()
+	for offset in range(0, len(buffer), chunksize):
+		decoder.decode_buffer(buffer[offset:offset+chunksize])
+		tone = decoder.get_tone()
+		if tone != current:
+			detected.append((tone, min(len(buffer), offset + chunksize) / SAMPLE_WIDTH))
+			current = tone
+	return [x for x in detected if x[0] != None], time.clock() - start
+
+###########################
+def score(expected, detected, samplerate, tolerance):
+	"""Match detections with expected events (same value, inside event time
+	plus tolerance). Return dictionary with hits, missed, false and latencies"""
+	used = {}
+	latencies = []
+	missed = []
+	maxdelay = int(tolerance * samplerate)
+	for value, start, end in expected:
+		hit = False
+		for index, (dvalue, position) in enumerate(detected):
+			if index in used or position < start: continue
+			if position > end + maxdelay: break
+			if dvalue == value:
+				used[index] = hit = True
+				latencies.append(float(position - start) / samplerate)
+				break
+		if not hit: missed.append(value)
+	false = [detected[index][0] for index in range(len(detected)) if index not in used]
+	result = {"expected": len(expected), "hits": len(latencies), "missed": len(missed), \
+		"false": len(false), "missed_values": missed, "false_values": false}
+	if latencies:
+		latencies.sort()
+		result["latency_mean"] = sum(latencies) / len(latencies)
+		result["latency_max"] = latencies[-1]
+		result["latency_median"] = latencies[len(latencies)/2]
+	return result
+
+###########################
+def parse_list(text, function=float):
+	values = []
+	for item in [x.strip() for x in text.split(",") if x.strip()]:
+		if item.lower() == "none": values.append(None)
+		else: values.append(function(item))
+	return values
+
+###########################
+def bench_dtmf(options, rng, verbose):
+	cases = []
+	for samplerate in parse_list(options.samplerates, int):
+		for tonetime in parse_list(options.durations):
+			for twist in parse_list(options.twists):
+				for snr in parse_list(options.snrs):
+					buffer, expected = dtmf_corpus(samplerate, options.keys, tonetime, \
+						options.waittime, twist, snr, rng)
+					cases.append(run_dtmf_case(options, samplerate, buffer, expected, \
+						{"tonetime": tonetime, "twist": twist, "snr": snr}, verbose))
+		if options.talkoff_seconds or options.talkoff_file:
+			if options.talkoff_file:
+				buffer = open(options.talkoff_file).read()
+				if len(buffer) % 2: buffer = buffer[:-1]
+			else: buffer = speech_like(samplerate, options.talkoff_seconds, rng)
+			cases.append(run_dtmf_case(options, samplerate, buffer, [], {"talkoff": True}, verbose))
+	return cases
+
+###########################
+def run_dtmf_case(options, samplerate, buffer, expected, parameters, verbose):
+	rss = maxrss()
+	arithmetic = options.arithmetic
+	if arithmetic == "both": arithmetic = "float"
+	decoder = dtmf.Decoder(samplerate = samplerate, sensibility = options.sensibility, \
+		arithmetic = arithmetic, mode = options.mode)
+	chunksize = options.chunksize or decoder.windowsize * SAMPLE_WIDTH
+	detected, cpu = run_dtmf(decoder, buffer, chunksize)
+	case = {"decoder": "dtmf", "samplerate": samplerate, "samples": len(buffer) / SAMPLE_WIDTH, \
+		"cpu": cpu, "maxrss_kb": maxrss(), "maxrss_delta_kb": maxrss() - rss, \
+		"arithmetic": arithmetic, "mode": options.mode}
+	case["samples_per_sec"] = case["samples"] / max(cpu, 1e-9)
+	case.update(parameters)
+	case.update(score(expected, detected, samplerate, options.tolerance))
+	debug("dtmf %s: %d/%d keys, %d false, %0.0f samples/sec" %(parameters, case["hits"], \
+		case["expected"], case["false"], case["samples_per_sec"]), verbose)
+	if options.arithmetic == "both":
+		# Fixed-point decoder must take the same decisions as the float one
+		decoder = dtmf.Decoder(samplerate = samplerate, sensibility = options.sensibility, \
+			arithmetic = "fixed", mode = options.mode)
+		fixed_detected, fixed_cpu = run_dtmf(decoder, buffer, chunksize)
+		case["fixed_cpu"] = fixed_cpu
+		case["fixed_samples_per_sec"] = case["samples"] / max(fixed_cpu, 1e-9)
+		case["arithmetic_mismatch"] = fixed_detected != detected
+		debug("dtmf %s: fixed-point %s, %0.0f samples/sec" %(parameters, \
+			{False: "identical", True: "DIFFERENT"}[case["arithmetic_mismatch"]], \
+			case["fixed_samples_per_sec"]), verbose)
+	return case
+
+###########################
+def bench_ctcss(options, rng, verbose):
+	cases = []
+	tones = parse_list(options.ctcss_tones)
+	for samplerate in parse_list(options.samplerates, int):
+		for snr in parse_list(options.snrs):
+			buffer, expected = ctcss_corpus(samplerate, tones, options.ctcss_duration, \
+				options.ctcss_amplitude, snr, rng)
+			rss = maxrss()
+			decoder = ctcss.Decoder(samplerate, SAMPLE_WIDTH, options.ctcss_mintime)
+			detected, cpu = run_ctcss(decoder, buffer, options.chunksize or 1024)
+			case = {"decoder": "ctcss", "samplerate": samplerate, "snr": snr, \
+				"samples": len(buffer) / SAMPLE_WIDTH, "cpu": cpu, \
+				"maxrss_kb": maxrss(), "maxrss_delta_kb": maxrss() - rss}
+			case["samples_per_sec"] = case["samples"] / max(cpu, 1e-9)
+			case.update(score(expected, detected, samplerate, options.tolerance + options.ctcss_mintime))
+			debug("ctcss %d sps, snr %s: %d/%d tones, %d false, %0.0f samples/sec" %(samplerate, \
+				snr, case["hits"], case["expected"], case["false"], case["samples_per_sec"]), verbose)
+			cases.append(case)
+	return cases
+
+###########################
+def aprstt_keys(rng, noisy_button=None):
+	"""Return keys of a random APRStt number (valid or corrupted), noisy
+	encoded (keys repeated and separated by noisy_button) if given"""
+	letters = touchtone.LETTERS.keys()
+	keys = [touchtone.CALLSIGN_PREFIX]
+	for index in range(rng.randint(0, 6)):
+		if rng.random() < 0.7: keys += list(rng.choice(letters))
+		else: keys += [rng.choice("0123456789")] * 2
+	keys.append(rng.choice("0123456789ABCD"))
+	keys.append(touchtone.get_checksum(keys + ["0"]) or "0")
+	# Corruptions: replaced and dropped keys, no prefix
+	for index in range(len(keys)):
+		if rng.random() < 0.05: keys[index] = rng.choice("0123456789ABCD*")
+	if rng.random() < 0.1 and keys: del keys[rng.randrange(len(keys))]
+	if rng.random() < 0.1 and keys: del keys[0]
+	if not noisy_button: return keys
+	output = []
+	for key in keys: output += [key] * rng.randint(1, 3) + [noisy_button]
+	if rng.random() < 0.2 and output: del output[rng.randrange(len(output))]
+	return output
+
+###########################
+def reference_touchtone(keys, terminator, clear, noisy_button):
+	"""Results of the key stream as processed by process_noisy_number and 
+	parse_number (the reference for touchtone.Validator)"""
+	output, number = [], []
+	for key in keys:
+		if key == clear: number = []
+		elif key != terminator: number.append(key)
+		else:
+			fields = touchtone.parse_number(touchtone.process_noisy_number("".join(number), noisy_button))
+			number = []
+			if not fields["number"]: continue
+			if fields["checksum"]: output.append((touchtone.ACCEPTED, fields))
+			else: output.append((touchtone.REJECTED, fields))
+	return output
+
+###########################
+def bench_touchtone(options, rng, verbose):
+	"""Fuzz touchtone.Validator against the reference functions"""
+	cases = []
+	for noisy_button in (None, options.noisy_button):
+		streams = []
+		for index in range(options.fuzz_numbers):
+			keys = aprstt_keys(rng, noisy_button)
+			if rng.random() < 0.05: keys.insert(rng.randint(0, len(keys)), "*")
+			streams.append(keys + ["#"])
+		start = time.clock()
+		reference = [reference_touchtone(keys, "#", "*", noisy_button) for keys in streams]
+		reference_cpu = time.clock() - start
+		start = time.clock()
+		validator = touchtone.Validator("#", "*", noisy_button)
+		results = [validator.feed_keys(keys) for keys in streams]
+		cpu = time.clock() - start
+		mismatches = 0
+		fieldnames = ("number", "checksum", "callsign", "symbol")
+		for expected, result in zip(reference, results):
+			expected = [(x, [y[name] for name in fieldnames]) for x, y in expected]
+			result = [(x, [y[name] for name in fieldnames]) for x, y in result]
+			if expected != result: mismatches += 1
+		nkeys = sum([len(keys) for keys in streams])
+		case = {"decoder": "touchtone", "noisy_button": noisy_button, "numbers": len(streams), 
+			"keys": nkeys, "accepted": len([1 for result in results if result and result[0][0] == touchtone.ACCEPTED]),
+			"mismatches": mismatches, "cpu": cpu, "reference_cpu": reference_cpu,
+			"keys_per_sec": nkeys / max(cpu, 1e-9), "reference_keys_per_sec": nkeys / max(reference_cpu, 1e-9)}
+		debug("touchtone noisy=%s: %d numbers, %d accepted, %d mismatches, %0.0f keys/s (reference %0.0f keys/s)" %(noisy_button, \
+			case["numbers"], case["accepted"], mismatches, case["keys_per_sec"], case["reference_keys_per_sec"]), verbose)
+		cases.append(case)
+	return cases
+
+###########################
+def summarize(cases):
+	summary = {}
+	selected = [case for case in cases if case["decoder"] == "touchtone"]
+	if selected:
+		result = {}
+		for key in ("numbers", "keys", "accepted", "mismatches", "cpu", "reference_cpu"):
+			result[key] = sum([case[key] for case in selected])
+		result["keys_per_sec"] = result["keys"] / max(result["cpu"], 1e-9)
+		result["reference_keys_per_sec"] = result["keys"] / max(result["reference_cpu"], 1e-9)
+		summary["touchtone"] = result
+	for decoder in ("dtmf", "ctcss"):
+		selected = [case for case in cases if case["decoder"] == decoder]
+		if not selected: continue
+		result = {}
+		for key in ("expected", "hits", "missed", "false", "samples", "cpu"):
+			result[key] = sum([case[key] for case in selected])
+		result["samples_per_sec"] = result["samples"] / max(result["cpu"], 1e-9)
+		latencies = [case["latency_mean"] for case in selected if "latency_mean" in case]
+		if latencies: result["latency_mean"] = sum(latencies) / len(latencies)
+		mismatches = [case for case in selected if "arithmetic_mismatch" in case]
+		if mismatches: 
+			result["arithmetic_mismatches"] = len([case for case in mismatches if case["arithmetic_mismatch"]])
+			result["fixed_samples_per_sec"] = result["samples"] / max(sum([case["fixed_cpu"] for case in mismatches]), 1e-9)
+		summary[decoder] = result
+	return summary
+
+###########################
+def compare(summary, reference, verbose=True):
+	"""Print differences between two summaries. Return False if accuracy got worse"""
+	ok = True
+	for decoder in summary:
+		if decoder not in reference: continue
+		new, old = summary[decoder], reference[decoder]
+		for key in ("hits", "missed", "false", "mismatches", "samples_per_sec", "latency_mean"):
+			if key not in new or key not in old: continue
+			if old[key]: change = "%+0.1f%%" %(100.0 * (new[key] - old[key]) / old[key])
+			else: change = "n/a"
+			debug("%s %s: %s -> %s (%s)" %(decoder, key, old[key], new[key], change), verbose)
+		for key in ("missed", "false", "mismatches"):
+			if key in new and key in old and new[key] > old[key]: ok = False
+	return ok
+
+###########################
+def main():
+	usage = """
+	benchmark.py [options]: DTMF/CTCSS decoders benchmark and accuracy suite
+
+	Corpora are generated with dtmf.Generator and ctcss.Generator for each
+	combination of sample rates, tone durations, twists and SNRs (and
+	synthetic talk-off speech), and decoded with dtmf.Decoder and ctcss.Decoder.
+	Results (throughput, latency, missed/false detections, memory) are
+	written as JSON for regression comparison."""
+
+	parser = optparse.OptionParser(usage)
+	parser.add_option('-q', '--quiet', dest='verbose', default=True, action='store_false', help='Be quiet')
+	parser.add_option('-o', '--output', dest='output', default="", metavar='FILE', type='string', help='Write JSON results to file')
+	parser.add_option('-c', '--compare', dest='compare', default="", metavar='FILE', type='string', help='Compare with previous JSON results (exit 2 if accuracy is worse)')
+	parser.add_option('-d', '--decoders', dest='decoders', default="dtmf,ctcss,touchtone", metavar='LIST', type='string', help='Decoders to benchmark: dtmf, ctcss, touchtone (APRStt number validator fuzzing)')
+	parser.add_option('-s', '--samplerates', dest='samplerates', default="8000,16000", metavar='LIST', type='string', help='Sample rates')
+	parser.add_option('-k', '--keys', dest='keys', default=dtmf.get_dtmf_keys(), metavar='KEYS', type='string', help='DTMF keys sequence')
+	parser.add_option('-t', '--durations', dest='durations', default="0.04,0.07,0.1", metavar='LIST', type='string', help='DTMF tone durations (seconds)')
+	parser.add_option('-w', '--waittime', dest='waittime', default=0.07, metavar='SECONDS', type='float', help='Silence between DTMF tones')
+	parser.add_option('-x', '--twists', dest='twists', default="-6,0,4", metavar='LIST', type='string', help='DTMF twists (dB of high tone over low tone)')
+	parser.add_option('-n', '--snrs', dest='snrs', default="none,20,10", metavar='LIST', type='string', help='Signal to noise ratios (dB, "none" for no noise)')
+	parser.add_option('-e', '--sensibility', dest='sensibility', default=1.0, metavar='VALUE', type='float', help='DTMF decoder sensibility')
+	parser.add_option('-m', '--mode', dest='mode', default="simple", metavar='MODE', type='string', help='DTMF decoder mode: simple or adaptive')
+	parser.add_option('-a', '--arithmetic', dest='arithmetic', default="float", metavar='TYPE', type='string', help='DTMF decoder arithmetic: float, fixed or both (check that fixed-point takes the same decisions, exit 3 if not)')
+	parser.add_option('', '--talkoff-seconds', dest='talkoff_seconds', default=20.0, metavar='SECONDS', type='float', help='Synthetic talk-off speech length (0 to disable)')
+	parser.add_option('', '--talkoff-file', dest='talkoff_file', default="", metavar='FILE', type='string', help='Raw S16_LE speech file for talk-off test (at each sample rate)')
+	parser.add_option('', '--ctcss-tones', dest='ctcss_tones', default="67.0,100.0,136.5,203.5,254.1", metavar='LIST', type='string', help='CTCSS tones')
+	parser.add_option('', '--ctcss-duration', dest='ctcss_duration', default=3.0, metavar='SECONDS', type='float', help='CTCSS tone duration')
+	parser.add_option('', '--ctcss-amplitude', dest='ctcss_amplitude', default=0.1, metavar='VALUE', type='float', help='CTCSS amplitude (0..1)')
+	parser.add_option('', '--ctcss-mintime', dest='ctcss_mintime', default=0.5, metavar='SECONDS', type='float', help='CTCSS decoder mintime')
+	parser.add_option('', '--fuzz-numbers', dest='fuzz_numbers', default=20000, metavar='NUMBER', type='int', help='Random APRStt numbers for touchtone fuzzing (exit 4 if validator differs)')
+	parser.add_option('', '--noisy-button', dest='noisy_button', default="D", metavar='KEY', type='string', help='Noisy mode button used in touchtone fuzzing')
+	parser.add_option('-b', '--chunksize', dest='chunksize', default=0, metavar='BYTES', type='int', help='Bytes fed to decoders at once (default: one DTMF window, 1024 for CTCSS)')
+	parser.add_option('', '--tolerance', dest='tolerance', default=0.1, metavar='SECONDS', type='float', help='Allowed detection delay after a tone ends')
+	parser.add_option('', '--seed', dest='seed', default=0, metavar='NUMBER', type='int', help='Random seed for noise and speech')
+
+	options, args = parser.parse_args()
+	verbose = options.verbose
+	rng = random.Random(options.seed)
+	decoders = parse_list(options.decoders, str)
+
+	cases = []
+	if "dtmf" in decoders: cases += bench_dtmf(options, rng, verbose)
+	if "ctcss" in decoders: cases += bench_ctcss(options, rng, verbose)
+	if "touchtone" in decoders: cases += bench_touchtone(options, rng, verbose)
+	results = {"version": __version__, "time": time.time(), "platform": sys.platform, \
+		"python": sys.version.split()[0], "options": options.__dict__, \
+		"cases": cases, "summary": summarize(cases)}
+
+	if options.output:
+		fd = open(options.output, "w")
+		json.dump(results, fd, indent=1, sort_keys=True)
+		fd.close()
+	else: json.dump(results["summary"], sys.stdout, indent=1, sort_keys=True); sys.stdout.write("\n")
+
+	mismatches = results["summary"].get("dtmf", {}).get("arithmetic_mismatches")
+	if mismatches:
+		debug("fixed-point decoder differs from float decoder in %d cases" %mismatches, verbose)
+		sys.exit(3)
+	mismatches = results["summary"].get("touchtone", {}).get("mismatches")
+	if mismatches:
+		debug("touchtone validator differs from reference in %d numbers" %mismatches, verbose)
+		sys.exit(4)
+	if options.compare:
+		reference = json.load(open(options.compare))
+		if not compare(results["summary"], reference["summary"], verbose):
+			debug("accuracy is worse than reference: %s" %options.compare, verbose)
+			sys.exit(2)
+	sys.exit(0)
+
+############################
+if __name__ == "__main__":
+	main()
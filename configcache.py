@@ -0,0 +1,165 @@
+#!/usr/bin/python
+
+# This file is part of asterisk-phonepatch
+
+# Copyright (C) 2011 Stephen Hamilton
+#
+# Asterisk-phonepatch is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+"""Compiled configuration cache.
+
+The template and the configuration file are parsed and validated by
+templateparser once, and the resulting (typed) configuration is saved to a
+cache file together with the mtime, size and SHA-1 of both inputs. Later
+loads only stat the inputs and unpickle the cache. If an input was touched
+but its contents did not change (same hash), the cache is still used."""
+
+# Standard Python modules
+import sys, os, errno
+import cPickle, tempfile, optparse
+try: from hashlib import sha1
+except ImportError: from sha import new as sha1
+
+__version__ = "$Revision: 0.1 $"
+__author__ = "Stephen Hamilton <stephenshamilton@gmail.com>"
+__depends__ = ['templateparser', 'Python-2.4']
+__copyright__ = """Copyright (C) 2011 Stephen Hamilton.
+This code is distributed under the terms of the GNU General Public License."""
+
+# Increase when the cache file layout changes
+CACHE_VERSION = 1
+CACHE_SUFFIX = ".cache"
+
+###############################
+def debug(text, verbose=True):
+	if not verbose: return
+	sys.stderr.write("configcache: " + text + "\n")
+	sys.stderr.flush()
+
+###############################
+def default_cachefile(configuration_file):
+	return configuration_file + CACHE_SUFFIX
+
+###############################
+def file_stat(path):
+	"""Return (absolute path, mtime, size) of a file"""
+	st = os.stat(path)
+	return os.path.abspath(path), st.st_mtime, st.st_size
+
+###############################
+def file_hash(path):
+	fd = open(path, "rb")
+	try: return sha1(fd.read()).hexdigest()
+	finally: fd.close()
+
+###############################
+def source_keys(paths):
+	"""Return [(stat, sha1), ...] for input files"""
+	return [(file_stat(path), file_hash(path)) for path in paths]
+
+###############################
+def compile_configuration(template, configuration_file, verbose=False):
+	"""Parse and validate template and configuration (templateparser)"""
+	import templateparser
+	config = templateparser.Parser(verbose = verbose)
+	config.read_template(template)
+	return config.read_configuration(configuration_file)
+
+###############################
+def read_cache(cachefile):
+	"""Return (sources, configuration) from a cache file, None if missing
+	or not readable"""
+	try:
+		fd = open(cachefile, "rb")
+		try: version, sources, configuration = cPickle.load(fd)
+		finally: fd.close()
+	except (IOError, OSError, EOFError, ValueError, TypeError, cPickle.UnpicklingError):
+		return None
+	if version != CACHE_VERSION: return None
+	return sources, configuration
+
+###############################
+def write_cache(cachefile, sources, configuration):
+	"""Write cache atomically (temporary file + rename)"""
+	directory = os.path.dirname(os.path.abspath(cachefile))
+	fdnum, tmppath = tempfile.mkstemp(prefix=".configcache", dir=directory)
+	try:
+		fd = os.fdopen(fdnum, "wb")
+		try: cPickle.dump((CACHE_VERSION, sources, configuration), fd, cPickle.HIGHEST_PROTOCOL)
+		finally: fd.close()
+		os.rename(tmppath, cachefile)
+	except:
+		os.unlink(tmppath)
+		raise
+
+###############################
+def cache_valid(sources, paths):
+	"""Check cached sources against input files. Return (valid, refresh):
+	refresh is true if the contents match but mtime/size changed"""
+	if len(sources) != len(paths): return False, False
+	refresh = False
+	for (stat, digest), path in zip(sources, paths):
+		if stat == file_stat(path): continue
+		if digest != file_hash(path): return False, False
+		refresh = True
+	return True, refresh
+
+###############################
+def save(cachefile, paths, configuration, verbose=False, sources=None):
+	if sources == None: sources = source_keys(paths)
+	try: write_cache(cachefile, sources, configuration)
+	except (IOError, OSError, cPickle.PicklingError), e:
+		debug("cannot write cache %s: %s" %(cachefile, e), verbose)
+
+###############################
+def load(template, configuration_file, cachefile=None, verbose=False):
+	"""Return configuration, from cache if it is up to date (compiling and
+	caching it otherwise). A cache file that cannot be written is not an error"""
+	if cachefile == None: cachefile = default_cachefile(configuration_file)
+	paths = [template, configuration_file]
+	cached = cachefile and read_cache(cachefile)
+	if cached:
+		sources, configuration = cached
+		valid, refresh = cache_valid(sources, paths)
+		if valid:
+			if refresh: save(cachefile, paths, configuration, verbose)
+			return configuration
+	sources = source_keys(paths)
+	configuration = compile_configuration(template, configuration_file, verbose)
+	if cachefile: save(cachefile, paths, configuration, verbose, sources)
+	return configuration
+
+###############################
+def main():
+	usage = """
+	configcache.py [options] CONFIGURATION: Validate configuration and write its cache"""
+	parser = optparse.OptionParser(usage)
+	parser.add_option('-t', '--template', dest='template', default="aprstt.conf.template", metavar='FILE', type='string', help='Configuration template')
+	parser.add_option('-c', '--cache-file', dest='cachefile', default="", metavar='FILE', type='string', help='Cache file (default: CONFIGURATION%s)' %CACHE_SUFFIX)
+	options, args = parser.parse_args()
+	if len(args) != 1:
+		parser.print_help()
+		sys.exit(1)
+	cachefile = options.cachefile or default_cachefile(args[0])
+	configuration = compile_configuration(options.template, args[0], verbose = True)
+	try: write_cache(cachefile, source_keys([options.template, args[0]]), configuration)
+	except (IOError, OSError), e:
+		sys.stderr.write("cannot write cache %s: %s\n" %(cachefile, e))
+		sys.exit(1)
+	sys.stdout.write("%s: %d sections\n" %(cachefile, len(configuration)))
+
+############################
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,288 @@
+#!/usr/bin/python
+
+# This file is part of asterisk-phonepatch
+
+# Copyright (C) 2011 Stephen Hamilton
+#
+# Asterisk-phonepatch is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+"""Daemon control socket (unix stream socket).
+
+A client sends one command line ("name|arg|arg...") and reads the
+answer until the server closes the connection. One select() thread serves
+all clients. Commands are registered with a mode:
+
+	INLINE  answered by the server thread (must be fast)
+	THREAD  run in a thread of their own (slow commands like profile)
+	LOOP    handed to the audio loop: the connection is queued; the loop
+	        polls get_request() once per audio buffer and owns the
+	        connection from then on
+"""
+
+# Standard Python modules
+import os, errno, socket, select
+import threading, time, fcntl
+
+__version__ = "$Revision: 0.1 $"
+__author__ = "Stephen Hamilton <stephenshamilton@gmail.com>"
+__depends__ = ['Python-2.4']
+__copyright__ = """Copyright (C) 2011 Stephen Hamilton.
+This code is distributed under the terms of the GNU General Public License."""
+
+INLINE = "inline"
+THREAD = "thread"
+LOOP = "loop"
+
+# Maximum length of a command line, listen backlog
+MAX_LINE = 4096
+BACKLOG = 32
+
+###############################
+def set_nonblocking(fd):
+	fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+###############################
+def drain(fd):
+	"""Read everything pending in a non-blocking pipe"""
+	while 1:
+		try: 
+			if not os.read(fd, 512): return
+		except OSError, e:
+			if e.errno in (errno.EAGAIN, errno.EINTR): return
+			raise
+
+###############################
+###############################
+class Request:
+	"""Command handed to the audio loop. rfile/wfile are the client connection"""
+	###############################
+	def __init__(self, command, args, sock):
+		self.command = command
+		self.args = args
+		self.sock = sock
+		self.time = time.time()
+		sock.setblocking(1)
+		self.rfile = sock.makefile("rb", 0)
+		self.wfile = sock.makefile("wb", 0)
+
+	###############################
+	def close(self):
+		for fd in (self.rfile, self.wfile, self.sock):
+			try: fd.close()
+			except socket.error: pass
+
+###############################
+###############################
+class Connection:
+	###############################
+	def __init__(self, sock):
+		self.sock = sock
+		self.input = ""
+		self.output = ""
+		self.closing = False
+
+###############################
+###############################
+class ControlServer:
+	"""Select-based control server (see module documentation)"""
+	###############################
+	def __init__(self, path, reuse=True, debug=None):
+		self.path = path
+		self.debug = debug or (lambda log, *args: None)
+		if reuse:
+			try: os.unlink(path)
+			except OSError, e:
+				if e.errno != errno.ENOENT: raise
+		self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self.sock.bind(path)
+		self.sock.listen(BACKLOG)
+		self.sock.setblocking(0)
+		self.commands = {}
+		self.connections = {}
+		self.lock = threading.Lock()
+		# Answers from other threads (connection, text), handed to the server thread
+		self.answers = []
+		# Requests for the audio loop
+		self.requests = []
+		# Pipe waking the server thread up when answers are queued
+		self.server_r, self.server_w = os.pipe()
+		for fd in (self.server_r, self.server_w): set_nonblocking(fd)
+		self.running = False
+		self.thread = None
+
+	###############################
+	def register(self, name, function, mode=INLINE):
+		"""Register command. INLINE and THREAD functions are called with the
+		argument list and return the answer; LOOP functions are called with
+		the argument list (in the server thread) and return an answer to 
+		reject the command or None to hand it to the audio loop"""
+		self.commands[name] = (function, mode)
+
+	###############################
+	def get_request(self):
+		"""Return next Request for the audio loop or None (does not block)"""
+		if not self.requests: return
+		self.lock.acquire()
+		try:
+			if not self.requests: return
+			return self.requests.pop(0)
+		finally: self.lock.release()
+
+	###############################
+	def answer(self, connection, text):
+		"""Send answer and close connection (any thread)"""
+		self.lock.acquire()
+		self.answers.append((connection, text))
+		self.lock.release()
+		self.notify(self.server_w)
+
+	###############################
+	def notify(self, fd):
+		try: os.write(fd, "x")
+		except OSError, e:
+			if e.errno not in (errno.EAGAIN, errno.EINTR): raise
+
+	###############################
+	def start(self):
+		self.running = True
+		self.thread = threading.Thread(target=self.serve_forever)
+		self.thread.setDaemon(True)
+		self.thread.start()
+
+	###############################
+	def serve_forever(self):
+		self.running = True
+		while self.running:
+			readers = [self.sock, self.server_r] + self.connections.keys()
+			writers = [sock for sock, connection in self.connections.items() if connection.output]
+			try: readable, writable, error = select.select(readers, writers, [])
+			except select.error, e:
+				if e[0] == errno.EINTR: continue
+				raise
+			if not self.running: break
+			if self.server_r in readable: self.take_answers()
+			for sock in readable:
+				if sock is self.sock: self.accept()
+				elif sock in self.connections: self.read(self.connections[sock])
+			for sock in writable:
+				if sock in self.connections: self.write(self.connections[sock])
+
+	###############################
+	def accept(self):
+		while 1:
+			try: sock, address = self.sock.accept()
+			except socket.error, e:
+				if e[0] in (errno.EAGAIN, errno.EINTR, errno.ECONNABORTED): return
+				raise
+			sock.setblocking(0)
+			self.connections[sock] = Connection(sock)
+
+	###############################
+	def take_answers(self):
+		drain(self.server_r)
+		self.lock.acquire()
+		answers, self.answers = self.answers, []
+		self.lock.release()
+		for connection, text in answers:
+			if connection.sock not in self.connections: continue
+			connection.output += text
+			connection.closing = True
+
+	###############################
+	def close_connection(self, connection):
+		self.connections.pop(connection.sock, None)
+		try: connection.sock.close()
+		except socket.error: pass
+
+	###############################
+	def read(self, connection):
+		try: data = connection.sock.recv(MAX_LINE)
+		except socket.error, e:
+			if e[0] in (errno.EAGAIN, errno.EINTR): return
+			self.close_connection(connection)
+			return
+		if not data:
+			self.close_connection(connection)
+			return
+		if connection.closing: return
+		connection.input += data
+		if connection.input.find("\n") < 0:
+			if len(connection.input) >= MAX_LINE:
+				connection.output, connection.closing = "syntax error\n", True
+			return
+		line = connection.input[:connection.input.find("\n")].strip()
+		connection.closing = True
+		self.dispatch(connection, line)
+
+	###############################
+	def write(self, connection):
+		try: written = connection.sock.send(connection.output)
+		except socket.error, e:
+			if e[0] in (errno.EAGAIN, errno.EINTR): return
+			self.close_connection(connection)
+			return
+		connection.output = connection.output[written:]
+		if not connection.output and connection.closing: self.close_connection(connection)
+
+	###############################
+	def dispatch(self, connection, line):
+		args = line.split("|")
+		self.debug("control: received: %s", args)
+		if args[0] not in self.commands:
+			connection.output = "unknown command\n"
+			return
+		function, mode = self.commands[args[0]]
+		if mode == INLINE:
+			connection.output = self.call(function, args)
+		elif mode == THREAD:
+			thread = threading.Thread(target=self.run_thread, args=(function, args, connection))
+			thread.setDaemon(True)
+			thread.start()
+		else:
+			answer = self.call(function, args)
+			if answer != None:
+				connection.output = answer
+				return
+			# The audio loop owns the connection from now on
+			del self.connections[connection.sock]
+			self.lock.acquire()
+			self.requests.append(Request(args[0], args[1:], connection.sock))
+			self.lock.release()
+
+	###############################
+	def call(self, function, args):
+		try: return function(args)
+		except Exception, detail:
+			self.debug("control: command %s failed: %s", args[0], detail)
+			return "error: %s\n" %detail
+
+	###############################
+	def run_thread(self, function, args, connection):
+		self.answer(connection, self.call(function, args))
+
+	###############################
+	def server_close(self):
+		"""Stop serving and close sockets (pending requests are dropped)"""
+		self.running = False
+		self.notify(self.server_w)
+		try: self.sock.close()
+		except socket.error: pass
+		for connection in self.connections.values(): self.close_connection(connection)
+		while 1:
+			request = self.get_request()
+			if not request: break
+			request.close()
+		try: os.unlink(self.path)
+		except OSError: pass
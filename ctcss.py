@@ -20,11 +20,14 @@
 
 # Standard Python modules
 import struct, math
-import numarray, FFT
+import numarray
+
+# External phonepatch modules
+import basis
 
 __version__ = "$Revision: 1.5 $"
 __author__ = "Arnau Sanchez <arnau@ehas.org>"
-__depends__ = ['OSSAudioDev', 'FFT', 'Numeric-Extension', 'Python-2.4']
+__depends__ = ['OSSAudioDev', 'Numeric-Extension', 'Python-2.4']
 __copyright__ = """Copyright (C) 2006 Arnau Sanchez <arnau@ehas.org>.
 This code is distributed under the terms of the GNU General Public License."""
 
@@ -86,10 +89,10 @@ class Decoder:
 		self.downfactor = self.DOWNFACTOR
 		self.cosarray = {}
 		self.sinarray = {}
-		for freq in self.detect_tones:
-			k = 2*math.pi*freq/self.samplerate
-			self.sinarray[freq] = numarray.array([math.sin(k*x) for x in xrange(self.windowsize)])
-			self.cosarray[freq] = numarray.array([math.cos(k*x) for x in xrange(self.windowsize)])
+		self.tables = basis.correlation_tables(self.samplerate, self.windowsize, self.detect_tones)
+		for index, freq in enumerate(self.detect_tones):
+			self.sinarray[freq] = self.tables[2*index]
+			self.cosarray[freq] = self.tables[2*index+1]
 
 	#########################
 	def get_tone(self):
@@ -108,43 +111,87 @@ class Decoder:
 			buffer = self.buffer[:length]
 			self.buffer = self.buffer[length:]			
 			window = numarray.array(struct.unpack("%d%s" %(len(buffer)/self.samplewidth, format), buffer))
-			out = []
+			powers = []
 			for freq in self.detect_tones:
-				value = ((((self.sinarray[freq] * window)).sum())**2 + (((self.cosarray[freq] * window)).sum())**2)
-				out.append((value, freq))
-			out.sort()
-			out.reverse()
-			maxpower, freq = out[0]
-			
-			meanused = self.MEANFREQSUSED
-			meanpower = 0
-			for value in [x[0] for x in out[-meanused:]]:
-				meanpower += value
-			meanpower = math.sqrt(meanpower/meanused) / (self.windowsize * self.samplemax)
-			maxpower = math.sqrt(maxpower) / (self.windowsize * self.samplemax)
-			if meanpower < 0.0000000001:
-				overpower = 10*self.OVERPOWER
-			else: overpower = maxpower / meanpower
-			
-			#print "debug: %f, %f, %f, %f, %d, %d" %(maxpower, meanpower, overpower, freq, self.windowsize, self.threshold)
-			mindiff = CTCSS_FREQS[-1]
-			for f in self.detect_tones:
-				diff = abs(freq - f)
-				if diff < mindiff:
-					mindiff = diff
-					ctcssfreq = f
-				else: break
-			if maxpower > self.MINPOWER and overpower > self.OVERPOWER and self.tone_current == ctcssfreq:
-				self.ntone += self.upfactor
-				if self.ntone >= self.threshold:
-					self.ntone = self.threshold
-					self.tone_detected = ctcssfreq
-			else:
-				self.ntone -= self.downfactor
-				if self.ntone < 0:
-					self.tone_current = ctcssfreq
-					self.ntone = self.upfactor
-					self.tone_detected = None
+				powers.append((((self.sinarray[freq] * window)).sum())**2 + (((self.cosarray[freq] * window)).sum())**2)
+			self.decode_powers(powers)
+
+	#########################
+	def decode_powers(self, powers):
+		"""Update tone state with the powers of a window (one per detect_tones)"""
+		out = zip(powers, self.detect_tones)
+		out.sort()
+		out.reverse()
+		maxpower, freq = out[0]
+		
+		meanused = self.MEANFREQSUSED
+		meanpower = 0
+		for value in [x[0] for x in out[-meanused:]]:
+			meanpower += value
+		meanpower = math.sqrt(meanpower/meanused) / (self.windowsize * self.samplemax)
+		maxpower = math.sqrt(maxpower) / (self.windowsize * self.samplemax)
+		if meanpower < 0.0000000001:
+			overpower = 10*self.OVERPOWER
+		else: overpower = maxpower / meanpower
+		
+		#print "debug: %f, %f, %f, %f, %d, %d" %(maxpower, meanpower, overpower, freq, self.windowsize, self.threshold)
+		mindiff = CTCSS_FREQS[-1]
+		for f in self.detect_tones:
+			diff = abs(freq - f)
+			if diff < mindiff:
+				mindiff = diff
+				ctcssfreq = f
+			else: break
+		if maxpower > self.MINPOWER and overpower > self.OVERPOWER and self.tone_current == ctcssfreq:
+			self.ntone += self.upfactor
+			if self.ntone >= self.threshold:
+				self.ntone = self.threshold
+				self.tone_detected = ctcssfreq
+		else:
+			self.ntone -= self.downfactor
+			if self.ntone < 0:
+				self.tone_current = ctcssfreq
+				self.ntone = self.upfactor
+				self.tone_detected = None
+
+#########################
+class MultiDecoder:
+	"""CTCSS decoder for interleaved N-channel audio. Channels are
+	deinterleaved with a (frames, channels) view and correlated in a single
+	matrix product per window; each channel keeps its own Decoder state"""
+	#########################
+	def __init__(self, channels, samplerate=8000, samplewidth=2, mintime=0.5):
+		if channels < 1: raise ValueError, "Invalid number of channels: %s" %channels
+		self.channels = channels
+		self.samplewidth = samplewidth
+		self.decoders = [Decoder(samplerate, samplewidth, mintime) for channel in range(channels)]
+		decoder = self.decoders[0]
+		self.windowsize = decoder.windowsize
+		self.tables = decoder.tables
+		self.numtype = {1: numarray.Int8, 2: numarray.Int16}[samplewidth]
+		self.buffer = ""
+
+	#########################
+	def get_tones(self):
+		"""Return list of detected tones (None if no tone) per channel"""
+		return [decoder.get_tone() for decoder in self.decoders]
+
+	#########################
+	def clear_tones(self):
+		for decoder in self.decoders: decoder.clear_tone()
+
+	#########################
+	def decode_buffer(self, buffer):
+		self.buffer += buffer
+		length = self.samplewidth * self.windowsize * self.channels
+		while len(self.buffer) >= length: 
+			buffer = self.buffer[:length]
+			self.buffer = self.buffer[length:]
+			block = numarray.fromstring(buffer, self.numtype, shape=(self.windowsize, self.channels))
+			products = numarray.matrixmultiply(self.tables, block.astype(numarray.Float64))
+			powers = products[0::2]**2 + products[1::2]**2
+			for channel, decoder in enumerate(self.decoders):
+				decoder.decode_powers(powers[:, channel].tolist())
 
 
 ###########################
@@ -163,10 +210,24 @@ def main():
 	parser.add_option('-g', '--generate', dest='generate', default = "", metavar='TIME,AMPLITUDE,FREQ', type='string', help = 'CTCSS generator')
 	parser.add_option('-d', '--decode', dest='decode', default = False, action='store_true', help = 'CTCSS decoder')
 	parser.add_option('-m', '--mintime', dest='mintime', default = 0.5, metavar = "SECONDS", type = 'float', help = 'Threshold detection time')
+	parser.add_option('-c', '--channels', dest='channels', default = 1, metavar = "NUMBER", type = 'int', help = 'Decode interleaved channels independently')
 
 	options, args = parser.parse_args()
 	
-	if options.decode:
+	if options.decode and options.channels > 1:
+		dec = MultiDecoder(options.channels, options.samplerate, options.samplewidth, options.mintime)
+		oldtones = [None] * options.channels
+		while 1:
+			buffer = os.read(0, options.buffersize)
+			if not buffer: break
+			dec.decode_buffer(buffer)
+			tones = dec.get_tones()
+			for channel, tone in enumerate(tones):
+				if tone != oldtones[channel]: 
+					sys.stdout.write("%d %s\n" %(channel, tone))
+			sys.stdout.flush()
+			oldtones = tones
+	elif options.decode:
 		dec = Decoder(options.samplerate, options.samplewidth, options.mintime)
 		oldtone = None
 		while 1:
@@ -19,12 +19,15 @@
 # Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
 
 # Standard Python modules
-import os, sys, struct
-import math, numarray, optparse, FFT
+import os, sys, struct, array
+import math, numarray, optparse
+
+# External phonepatch modules
+import logger, basis
 
 __version__ = "$Revision: 1.7 $"
 __author__ = "Arnau Sanchez <arnau@ehas.org>"
-__depends__ = ['FFT', 'Numeric-Extension', 'Python-2.4']
+__depends__ = ['Numeric-Extension', 'Python-2.4']
 __copyright__ = """Copyright (C) 2006 Arnau Sanchez <arnau@ehas.org>.
 This code is distributed under the terms of the GNU General Public License."""
 
@@ -53,8 +56,24 @@ DEF_MAX_DIFF12_POWER = 10
 PEAK_UP = 1
 PEAK_DOWN = 1
 
+# Decoder arithmetic: float (samples scaled to -1..1) or fixed (int16 samples
+# correlated with Q15 tables using integer arithmetic)
+ARITHMETICS = ("float", "fixed")
+FIXED_SHIFT = 15
+
+# Decoder modes: simple (fixed thresholds) or adaptive (running noise floor 
+# and twist estimates, second harmonic check)
+MODES = ("simple", "adaptive")
+NOISE_ALPHA = 0.05
+TWIST_ALPHA = 0.1
+DEF_FLOOR_OVERPOWER = 10
+DEF_MAX_TWIST_DB = 10.0
+DEF_TWIST_TOLERANCE_DB = 6.0
+DEF_MAX_HARMONIC_POWER = 0.1
+
 # dictionary: string_format : bit_order, sample size, signed/unsigned
 AFMT_TO_DEF = { "S8": "=bS", "U8": "=BU", "S16_LE": "<hS", "U16_LE": "<HU", "S16_BE": ">hS", "U16_BE": ">HU"}
+SAMPLE_NUMTYPES = {"b": numarray.Int8, "B": numarray.UInt8, "h": numarray.Int16, "H": numarray.UInt16}
 	
 ### Global functions
 
@@ -107,49 +126,84 @@ class Generator:
 		self.float_to_audio = (1 << len(struct.pack(self.samplectype, 0)) * 8) / 2.0
 		self.audio_offset = 0
 		if self.samplesign == "U": self.audio_offset = 1.0
+		self.numtype = SAMPLE_NUMTYPES[self.samplectype]
+		self.byteswap = (self.samplebyteorder == "<") != (sys.byteorder == "little")
+		# Sample limits (after scaling to float_to_audio)
+		self.audio_min = -self.float_to_audio * (1.0 - self.audio_offset)
+		self.audio_max = self.float_to_audio * (1.0 + self.audio_offset) - 1
+		self.tables = {}
+
+	################################################
+	def get_table(self, freq, nsamples):
+		"""Return sin table (at least nsamples long) for a frequency. Tables
+		are computed once with a vectorized sin and then sliced"""
+		table = self.tables.get(freq)
+		if table is None or len(table) < nsamples:
+			size = max(nsamples, self.samplerate)
+			table = numarray.sin(2 * math.pi * freq / self.samplerate * numarray.arange(size, type=numarray.Float64))
+			self.tables[freq] = table
+		return table
+
+	################################################
+	def to_audio(self, samples):
+		"""Convert a float array (full scale: 1.0) to audio bytes"""
+		output = self.float_to_audio * (samples + self.audio_offset)
+		output = numarray.clip(output, self.audio_min, self.audio_max).astype(self.numtype)
+		if self.channels > 1:
+			output = output.repeat(self.channels)
+		if not self.byteswap: return output.tostring()
+		output = array.array(self.samplectype, output.tostring())
+		output.byteswap()
+		return output.tostring()
+
+	################################################
+	def key_samples(self, key, nsamples, index=0, gain=1.0, twist=0.0):
+		"""Return float array (samples index..index+nsamples) of a DTMF key"""
+		low_freq, high_freq = key_to_freqs(key)
+		high_gain = 10.0 ** (twist / 20.0)
+		low_gain = 1.0 / (1.0 + high_gain)
+		high_gain = high_gain / (1.0 + high_gain)
+		end = index + nsamples
+		low = self.get_table(low_freq, end)[index:end]
+		high = self.get_table(high_freq, end)[index:end]
+		return gain * (low_gain * low + high_gain * high)
 
 	################################################
-	def encode_keys(self, keys, time, wait, gain = 1.0):
+	def encode_keys(self, keys, time, wait, gain = 1.0, twist = 0.0):
 		for index, key in enumerate(keys):
-			for buffer in self.encode_key(key, time, gain):
+			for buffer in self.encode_key(key, time, gain, twist):
 				yield buffer
 			if index == len(keys) - 1: break			
 			for buffer in self.silence(wait):
 				yield buffer
 
 	################################################
-	def encode_key(self, key, time, gain = 1.0):
+	def encode_key(self, key, time, gain = 1.0, twist = 0.0):
+		"""Generate audio for a DTMF key. Twist is the level (dB) of the high 
+		frequency tone relative to the low frequency one"""
 		if type(key) != str or len(key) != 1 or key not in get_dtmf_keys():
 			raise NameError, "Unknown DTMF key: %s" %key
-		low_freq, high_freq = key_to_freqs(key)
 		index = 0
-		c1 = 2 * math.pi * low_freq /  self.samplerate 
-		c2 = 2 * math.pi * high_freq /  self.samplerate 
 		nsamples_pending = int(time * self.samplerate)
-				
 		while nsamples_pending:
 			size = self.buffersize or nsamples_pending
 			nsamples = min(nsamples_pending, size)
 			nsamples_pending -= nsamples
-			v1 = numarray.array([ math.sin(c1 * (index+i)) for i in range(nsamples)])
-			v2 = numarray.array([ math.sin(c2 * (index+i)) for i in range(nsamples)])
+			yield self.to_audio(self.key_samples(key, nsamples, index, gain, twist))
 			index += nsamples
-			output = gain * self.float_to_audio * (0.5 * v1 + 0.5 * v2 + self.audio_offset)
-			if self.channels > 1:
-				output = output.repeat(self.channels)
-			format = self.samplebyteorder + str(nsamples*self.channels) + self.samplectype
-			buffer = struct.pack(format, *output)			
-			yield buffer
 
 	################################################
 	def silence(self, time):
 		nsamples = int(time * self.samplerate) * self.channels
 		format = self.samplebyteorder + self.samplectype
-		buffer = struct.pack(format, self.audio_offset) * nsamples 
-		size = self.buffersize or len(buffer)
-		while buffer:
-			yield buffer[:size]
-			buffer = buffer[size:]
+		# Unsigned formats are silent at mid-scale
+		sample = struct.pack(format, int(self.float_to_audio * self.audio_offset))
+		size = self.buffersize / len(sample) or nsamples
+		block = sample * min(size, nsamples)
+		while nsamples > 0:
+			if nsamples >= size: yield block
+			else: yield block[:nsamples*len(sample)]
+			nsamples -= size
 
 ###################################################
 ###################################################
@@ -171,13 +225,26 @@ class Decoder:
 		
 		self.channels = args.get("channels", 1)
 		self.verbose = args.get("verbose", 0)
+		self.logger = logger.Logger("dtmf", self.verbose, "decoder - ")
 		self.sensibility = args.get("sensibility", 1.0)
+		self.arithmetic = args.get("arithmetic", "float")
+		if self.arithmetic not in ARITHMETICS:
+			raise ValueError, "Decoder arithmetic must be one of %s: %s" %(", ".join(ARITHMETICS), self.arithmetic)
+		self.mode = args.get("mode", "simple")
+		if self.mode not in MODES:
+			raise ValueError, "Decoder mode must be one of %s: %s" %(", ".join(MODES), self.mode)
 		
 		# Decoding parameters
 		self.min_f1_power = DEF_MIN_F1_POWER * self.sensibility
 		self.decode_overpower = DEF_DECODE_OVERPOWER / self.sensibility
 		self.max_diff12_power = DEF_MAX_DIFF12_POWER * self.sensibility
 		self.min_diff23_power = DEF_MIN_DIFF23_POWER / self.sensibility
+		self.floor_overpower = DEF_FLOOR_OVERPOWER / self.sensibility
+		self.max_twist_db = DEF_MAX_TWIST_DB * self.sensibility
+		self.twist_tolerance_db = DEF_TWIST_TOLERANCE_DB * self.sensibility
+		self.max_harmonic_power = DEF_MAX_HARMONIC_POWER * self.sensibility
+		self.noise_floor = 0.0
+		self.twist_db = 0.0
 		
 		base_format = args.get("sampleformat", "S16_LE")
 		format = base_format.upper()
@@ -195,26 +262,109 @@ class Decoder:
 		self.freqs_to_key_dict = dict(d1 + d2)
 		self.windowsize = int(MIN_TONETIME * self.samplerate / SUBWINDOW)
 		self.ds = Decoder_state(self)
+		# Number of windows decoded (for callers measuring time per window)
+		self.windows = 0
 		
 		self.cosarray = {}
 		self.sinarray = {}
-		for freq in DTMF_FREQS:
-			self.sinarray[freq] = numarray.array([math.sin(2*math.pi*freq*x/self.samplerate) for x in range(0, self.windowsize)])
-			self.cosarray[freq] = numarray.array([math.cos(2*math.pi*freq*x/self.samplerate) for x in range(0, self.windowsize)])
+		tables = basis.correlation_tables(self.samplerate, self.windowsize, DTMF_FREQS)
+		for index, freq in enumerate(DTMF_FREQS):
+			self.sinarray[freq] = tables[2*index]
+			self.cosarray[freq] = tables[2*index+1]
+		# Correlation frequencies for matrix products (fixed or adaptive
+		# decoding): DTMF frequencies (and their second harmonics)
+		self.table_freqs = list(DTMF_FREQS)
+		if self.mode == "adaptive":
+			self.table_freqs += [2 * freq for freq in DTMF_FREQS]
+			self.float_tables = self.correlation_rows()
+		if self.arithmetic == "fixed": self.init_fixed()
+
+		self.logger.info("sampling rate: %d", self.samplerate)
+		self.logger.info("channels: %d", self.channels)
+		self.logger.info("window size: %d samples", self.windowsize)
+		self.logger.info("min peaks decoding: %d", self.ds.min_peaks)
+		self.logger.info("Freqs 1&2 overpower: %0.2f dB", 10*math.log(self.decode_overpower, 10))
+		self.logger.info("Freqs 1&2 max diff: %0.2f dB", 10*math.log(self.max_diff12_power, 10))
+		self.logger.info("Freqs 2&3 min diff: %0.2f dB", 10*math.log(self.min_diff23_power, 10))
+		self.logger.info("mode: %s, arithmetic: %s", self.mode, self.arithmetic)
+
+	################################################
+	def correlation_rows(self):
+		"""Sin and cos rows (one pair per frequency in table_freqs), shared
+		array (see basis module)"""
+		return basis.correlation_tables(self.samplerate, self.windowsize, self.table_freqs)
 
-		self.debug("sampling rate: %d" %self.samplerate)
-		self.debug("channels: %d" %self.channels)
-		self.debug("window size: %d samples" %self.windowsize)
-		self.debug("min peaks decoding: %d" %self.ds.min_peaks)
-		self.debug("Freqs 1&2 overpower: %0.2f dB" %(10*math.log(self.decode_overpower, 10)))
-		self.debug("Freqs 1&2 max diff: %0.2f dB" %(10*math.log(self.max_diff12_power, 10)))
-		self.debug("Freqs 2&3 min diff: %0.2f dB" %(10*math.log(self.min_diff23_power, 10)))
+	################################################
+	def init_fixed(self):
+		"""Prepare integer decoding: Q15 sin/cos tables (one row per
+		frequency) multiplied with int16 windows in a single matrix product"""
+		if self.sample_length != 2 or self.samplesign != "S":
+			raise ValueError, "Fixed-point decoding needs signed 16 bits samples"
+		self.byteswap = (self.samplebyteorder == "<") != (sys.byteorder == "little")
+		self.input_bytes = ""
+		one = (1 << FIXED_SHIFT) - 1
+		self.fixed_tables = basis.fixed_tables(self.samplerate, self.windowsize, self.table_freqs, one)
+		# Scale of integer powers relative to the float path (samples / 2^15, 
+		# tables / one). Applied once per frequency after the integer part
+		self.fixed_scale = 1.0 / (float(1 << FIXED_SHIFT) * one)**2
 
+	################################################
+	def decode_fixed(self, buffer):
+		if self.channels == 2:
+			import audioop
+			buffer = audioop.tomono(buffer, self.sample_length, 0.5, 0.5)
+		self.input_bytes += buffer
+		length = self.windowsize * self.sample_length
+		dtmf_output = []
+		while len(self.input_bytes) >= length:
+			samples = array.array("h", self.input_bytes[:length])
+			self.input_bytes = self.input_bytes[length:]
+			if self.byteswap: samples.byteswap()
+			window = numarray.fromstring(samples.tostring(), numarray.Int16).astype(numarray.Int64)
+			products = numarray.matrixmultiply(self.fixed_tables, window).tolist()
+			powers = []
+			for index in range(len(self.table_freqs)):
+				im, re = int(products[2*index]), int(products[2*index+1])
+				powers.append((im*im + re*re) * self.fixed_scale)
+			self.windows += 1
+			if self.mode == "adaptive": 
+				dtmf_output += self.decoding_adaptive(numarray.array(powers))
+			else: dtmf_output += self.decoding_simple(dict(zip(DTMF_FREQS, powers)))
+		return dtmf_output
 
-	###############################
-	def debug(self, log, level = 1):
-		if self.verbose < level: return
-		debug("decoder - " + log)
+	#################################
+	def decoding_adaptive(self, powers):
+		"""Decode a window given an array with the powers of DTMF_FREQS 
+		followed by the powers of their second harmonics.
+		
+		The strongest low and high group tones must be over the mean of the
+		other six bins and over a running noise floor, their twist must be
+		near the running twist estimate, and their second harmonics must be
+		weak (speech is rich in harmonics, DTMF tones are not)."""
+		nfreqs = len(DTMF_FREQS)
+		low = int(numarray.argmax(powers[:4]))
+		high = 4 + int(numarray.argmax(powers[4:nfreqs]))
+		plow, phigh = float(powers[low]), float(powers[high])
+		total = float(numarray.add.reduce(powers[:nfreqs]))
+		mean_power = (total - plow - phigh) / (nfreqs - 2)
+		weaker = min(plow, phigh)
+		realpower = (1000000 * max(plow, phigh)) / (self.windowsize)**2
+		key_max = None
+		if realpower > self.min_f1_power and weaker > mean_power * self.decode_overpower \
+				and weaker > self.noise_floor * self.floor_overpower:
+			twist_db = 10 * math.log10(phigh / plow)
+			harmonics = float(powers[nfreqs + low] + powers[nfreqs + high])
+			if abs(twist_db) <= self.max_twist_db and \
+					abs(twist_db - self.twist_db) <= self.twist_tolerance_db and \
+					harmonics < (plow + phigh) * self.max_harmonic_power:
+				key_max = self.freqs_to_key_dict[(DTMF_FREQS[low], DTMF_FREQS[high])]
+				self.twist_db += TWIST_ALPHA * (twist_db - self.twist_db)
+		if not key_max:
+			self.noise_floor += NOISE_ALPHA * (total / nfreqs - self.noise_floor)
+		if self.logger.level >= 2:
+			self.logger.debug("low=%0.2f (%0.5f), high=%0.2f (%0.5f), mean=%0.5f, floor=%0.5f, twist=%0.1f dB: %s", \
+				DTMF_FREQS[low], plow, DTMF_FREQS[high], phigh, mean_power, self.noise_floor, self.twist_db, key_max)
+		return self.update_state(key_max)
 
 	#################################
 	def decoding_simple(self, freq_power):		
@@ -228,7 +378,9 @@ class Decoder:
 		f1realpower = (1000000 * f1power) / (self.windowsize)**2
 		try: key_max = self.freqs_to_key_dict[(f1,f2)]
 		except: key_max = None
-		self.debug("f1=%0.2f (%0.5f), f2=%0.2f (%0.5f), f3=%0.2f (%0.5f)" %(f1, f1power, f2, f2power, f3, f3power), 2)
+		verbose = self.logger.level
+		if verbose >= 2:
+			self.logger.debug("f1=%0.2f (%0.5f), f2=%0.2f (%0.5f), f3=%0.2f (%0.5f)", f1, f1power, f2, f2power, f3, f3power)
 		if key_max:
 			# Calculate mean power (discard the 2 max-frequencies) and min acceptable power
 			mean_power = 0
@@ -240,23 +392,29 @@ class Decoder:
 			# Check if higher frequencies are greater than minimum acceptable power
 			if f1realpower > self.min_f1_power and f2power > min_overpower and f1power < f2power * self.max_diff12_power and f2power > f3power * self.min_diff23_power:			
 				key_max = self.freqs_to_key_dict[(f1,f2)]
-				self.debug("key_max: %s. ** ok **" %key_max, 2)
-				self.debug("f1power -- %f" %(f1realpower), 1)
-				self.debug("f2power > min_overpower -- %f > %f" %(f2power, min_overpower), 1)
-				self.debug("f1power < f2power * max_diff12 -- %f < %f" %(f1power, f2power * self.max_diff12_power), 1)
-				self.debug("f2power > f3power * min_diff23 -- %f > %f" %(f2power, f3power * self.min_diff23_power), 1)
+				if verbose:
+					self.logger.debug("key_max: %s. ** ok **", key_max)
+					self.logger.info("f1power -- %f", f1realpower)
+					self.logger.info("f2power > min_overpower -- %f > %f", f2power, min_overpower)
+					self.logger.info("f1power < f2power * max_diff12 -- %f < %f", f1power, f2power * self.max_diff12_power)
+					self.logger.info("f2power > f3power * min_diff23 -- %f > %f", f2power, f3power * self.min_diff23_power)
 			else: 
-				self.debug("key_max: %s. ko" %key_max, 2)
+				if verbose >= 2:
+					self.logger.debug("key_max: %s. ko", key_max)
+					self.logger.debug("f2power > min_overpower -- %f / %f", f2power, min_overpower)
+					self.logger.debug("f1power < f2power * max_diff12 -- %f / %f", f1power, f2power * self.max_diff12_power)
+					self.logger.debug("f2power > f3power * min_diff23 -- %f / %f", f2power, f3power * self.min_diff23_power)
 				key_max = None
-				self.debug("f2power > min_overpower -- %f / %f" %(f2power, min_overpower), 2)
-				self.debug("f1power < f2power * max_diff12 -- %f / %f" %(f1power, f2power * self.max_diff12_power), 2)
-				self.debug("f2power > f3power * min_diff23 -- %f / %f" %(f2power, f3power * self.min_diff23_power), 2)
+		return self.update_state(key_max)
 
+	#################################
+	def update_state(self, key_max):
+		"""Update state for each key. If min_peaks is reached for a key, 
+		return it (in a list)"""
 		output = []
-
-		# Update state for each key. If min_peaks is reached for a key, append in DTMF output
-		if key_max or self.ds.current_key:
-			self.debug("%s-%s" %(key_max, self.ds.current_key))
+		verbose = self.logger.level
+		if verbose and (key_max or self.ds.current_key):
+			self.logger.info("%s-%s", key_max, self.ds.current_key)
 		for key in get_dtmf_keys():
 			old_state = self.ds.key_state[key]
 			if key == key_max:
@@ -269,7 +427,7 @@ class Decoder:
 					self.ds.current_key = key
 					break
 			elif key == self.ds.current_key and old_state > 0:
-				self.debug("peak_down: %f" %self.ds.key_state[key])
+				if verbose: self.logger.info("peak_down: %f", self.ds.key_state[key])
 				self.ds.key_state[key] -= PEAK_DOWN
 				if self.ds.key_state[key] <= 0:
 					self.ds.key_state[key] = 0
@@ -278,6 +436,7 @@ class Decoder:
 
 	################################################
 	def decode_buffer(self, buffer):
+		if self.arithmetic == "fixed": return self.decode_fixed(buffer)
 		import audioop
 		if self.channels == 2:
 			buffer = audioop.tomono(buffer, self.sample_length, 0.5, 0.5)
@@ -291,6 +450,11 @@ class Decoder:
 		while len(self.input) >= self.windowsize:
 			window = numarray.array(self.input[:self.windowsize])
 			self.input = self.input[self.windowsize:]
+			self.windows += 1
+			if self.mode == "adaptive":
+				products = numarray.matrixmultiply(self.float_tables, window)
+				dtmf_output += self.decoding_adaptive(products[0::2]**2 + products[1::2]**2)
+				continue
 			fft = {}
 			for freq in DTMF_FREQS:
 				fft[freq] = (((self.sinarray[freq] * window)).sum())**2 + (((self.cosarray[freq] * window)).sum())**2
@@ -299,6 +463,68 @@ class Decoder:
 		
 		return dtmf_output
 
+###################################################
+###################################################
+class MultiDecoder:
+	"""Decode the channels of interleaved N-channel audio independently.
+
+	Frames are deinterleaved with a (frames, channels) view of the buffer,
+	and the correlations of all channels are computed with one matrix
+	product per window. Each channel keeps its own Decoder (state, noise
+	floor and twist estimates), which takes the decisions."""
+	################################################
+	def __init__(self, channels, **args):
+		if channels < 1: raise ValueError, "Invalid number of channels: %s" %channels
+		self.channels = channels
+		args = dict(args)
+		args["channels"] = 1
+		self.decoders = [Decoder(**args) for channel in range(channels)]
+		decoder = self.decoders[0]
+		if decoder.sample_length != 2 or decoder.samplesign != "S":
+			raise ValueError, "Multichannel decoding needs signed 16 bits samples"
+		self.byteswap = (decoder.samplebyteorder == "<") != (sys.byteorder == "little")
+		self.windowsize = decoder.windowsize
+		self.mode = decoder.mode
+		self.arithmetic = decoder.arithmetic
+		if self.arithmetic == "fixed":
+			self.tables = decoder.fixed_tables
+			self.scale = decoder.fixed_scale
+		else:
+			self.tables = decoder.correlation_rows()
+			self.scale = decoder.audio_to_float ** 2
+		self.nfreqs = len(decoder.table_freqs)
+		self.input = ""
+		self.windows = 0
+
+	################################################
+	def decode_buffer(self, buffer):
+		"""Decode interleaved audio. Return a list of (channel, key)"""
+		self.input += buffer
+		length = self.windowsize * self.channels * 2
+		output = []
+		while len(self.input) >= length:
+			data, self.input = self.input[:length], self.input[length:]
+			if self.byteswap:
+				samples = array.array("h", data)
+				samples.byteswap()
+				data = samples.tostring()
+			block = numarray.fromstring(data, numarray.Int16, shape=(self.windowsize, self.channels))
+			if self.arithmetic == "fixed": block = block.astype(numarray.Int64)
+			else: block = block.astype(numarray.Float64)
+			# (2 * frequencies, channels): sin and cos correlations of each channel
+			products = numarray.matrixmultiply(self.tables, block)
+			self.windows += 1
+			for channel, decoder in enumerate(self.decoders):
+				column = products[:, channel].tolist()
+				if self.arithmetic == "fixed": column = [int(x) for x in column]
+				powers = [(column[2*index]**2 + column[2*index+1]**2) * self.scale \
+					for index in range(self.nfreqs)]
+				decoder.windows += 1
+				if self.mode == "adaptive": keys = decoder.decoding_adaptive(numarray.array(powers))
+				else: keys = decoder.decoding_simple(dict(zip(DTMF_FREQS, powers)))
+				for key in keys: output.append((channel, key))
+		return output
+
 ###########################
 def main():
 	usage = """
@@ -312,7 +538,10 @@ def main():
 	parser.add_option('-s', '--samplerate', dest='samplerate', default=8000, metavar='SPS', type='int', help = 'Set sampling rate')
 	parser.add_option('-f', '--sampleformat', dest='sampleformat', default = "S16_LE", metavar='AFMT_FORMAT', type='string', help='Set audio sample format')
 	parser.add_option('-c', '--channels', dest='channels', default=1, metavar='NUMBER', type='int', help = 'Set audio channels')
+	parser.add_option('-n', '--multichannel', dest='multichannel', default=False, action='store_true', help = 'Decode each channel independently (output: CHANNEL KEY lines)')
 	parser.add_option('-e', '--sensibility', dest='sensibility', default=1.0, metavar='VALUE', type='float', help = 'Decoding sensibility (1.0 for normal)')
+	parser.add_option('-m', '--mode', dest='mode', default="simple", metavar='MODE', type='string', help = 'Decoding mode: simple or adaptive')
+	parser.add_option('-a', '--arithmetic', dest='arithmetic', default="float", metavar='TYPE', type='string', help = 'Decoding arithmetic: float or fixed')
 	parser.add_option('-g', '--generate', dest='generate', default = "", metavar='KEYS, TONETIME, WAITTIME, GAIN', type='string', help = 'DTMF generator')
 	parser.add_option('-d', '--decode', dest='decode', default=False, action='store_true', help = 'DTMF decoder')
 	parser.add_option('-b', '--buffersize', dest='buffersize', default=1024, metavar="BYTES", type='int', help='Buffer size for input/output')
@@ -326,9 +555,19 @@ def main():
 		for buffer in enc.encode_keys(keys, float(tonetime), float(waittime), float(gain)):
 			os.write(stdout, buffer)
 	
+	elif options.decode and options.multichannel:
+		dec = MultiDecoder(options.channels, samplerate = options.samplerate, \
+			sampleformat = options.sampleformat, sensibility = options.sensibility, \
+			verbose = options.verbose, arithmetic = options.arithmetic, mode = options.mode)
+		while 1:
+			buffer = os.read(stdin, options.buffersize)
+			if not buffer: break
+			for channel, key in dec.decode_buffer(buffer):
+				os.write(stdout, "%d %s\n" %(channel, key))
 	elif options.decode:
 		dec = Decoder(samplerate = options.samplerate, sampleformat = options.sampleformat, \
-			channels = options.channels, sensibility = options.sensibility, verbose = options.verbose)
+			channels = options.channels, sensibility = options.sensibility, verbose = options.verbose, \
+			arithmetic = options.arithmetic, mode = options.mode)
 		while 1:
 			buffer = os.read(stdin, options.buffersize)
 			if not buffer: break		
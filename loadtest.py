@@ -0,0 +1,424 @@
+#!/usr/bin/python
+
+# This file is part of asterisk-phonepatch
+
+# Copyright (C) 2011 Stephen Hamilton
+#
+# Asterisk-phonepatch is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+# Standard Python modules
+import sys, os, time
+import random, optparse, threading
+import resource, json, audioop
+import SocketServer
+
+# External phonepatch modules
+import configcache, audiodev, signaling
+import aprstt
+
+__version__ = "$Revision: 0.1 $"
+__author__ = "Stephen Hamilton <stephenshamilton@gmail.com>"
+__depends__ = ['Numeric-Extension', 'Python-2.6']
+__copyright__ = """Copyright (C) 2011 Stephen Hamilton.
+This code is distributed under the terms of the GNU General Public License."""
+
+SAMPLE_WIDTH = 2
+LOOPBACK_NAME = "loadtest"
+
+# Audio injected into the loopback soundcard per feeder step (seconds)
+FEED_TIME = 0.05
+
+###########################
+def debug(text, verbose=True):
+	if not verbose: return
+	sys.stderr.write(text + "\n")
+	sys.stderr.flush()
+
+###########################
+def parse_list(text, function=float):
+	return [function(x.strip()) for x in text.split(",") if x.strip()]
+
+###########################
+def percentile(values, fraction):
+	if not values: return
+	values = sorted(values)
+	return values[min(len(values) - 1, int(fraction * len(values)))]
+
+###########################
+def cpu_time():
+	usage = resource.getrusage(resource.RUSAGE_SELF)
+	return usage.ru_utime + usage.ru_stime
+
+###########################
+def current_rss():
+	"""Resident set size (kilobytes)"""
+	try: pages = int(open("/proc/self/statm").read().split()[1])
+	except (IOError, IndexError, ValueError): return
+	return pages * resource.getpagesize() / 1024
+
+###########################
+###########################
+class AprsHandler(SocketServer.StreamRequestHandler):
+	"""Record APRStt position packets (CALLSIGN-12>...) with arrival time"""
+	###########################
+	def handle(self):
+		for line in self.rfile:
+			if line.find("-12>") < 0: continue
+			self.server.add_packet(line[:line.find("-12>")], time.time())
+
+###########################
+###########################
+class FakeAprsServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+	"""Fake APRS-IS server on localhost (ephemeral port)"""
+	daemon_threads = True
+	allow_reuse_address = True
+	###########################
+	def __init__(self):
+		SocketServer.TCPServer.__init__(self, ("127.0.0.1", 0), AprsHandler)
+		self.packets = []
+		self.lock = threading.Lock()
+
+	###########################
+	def add_packet(self, callsign, packet_time):
+		self.lock.acquire()
+		self.packets.append((callsign, packet_time))
+		self.lock.release()
+
+	###########################
+	def get_address(self):
+		return "%s:%d" %self.server_address
+
+	###########################
+	def start(self):
+		thread = threading.Thread(target=self.serve_forever)
+		thread.setDaemon(True)
+		thread.start()
+
+###########################
+###########################
+class DriverLoopback(audiodev.LoopbackSoundcard):
+	"""Loopback soundcard behaving like a capture driver: reads block until
+	audio is injected, audio not read within maxtime seconds is overwritten
+	(counted in lost) and transmitted audio is not heard back"""
+	###########################
+	def __init__(self, samplerate, maxtime):
+		audiodev.LoopbackSoundcard.__init__(self, samplerate, 1, SAMPLE_WIDTH)
+		self.maxsize = int(maxtime * samplerate) * SAMPLE_WIDTH
+		self.lost = 0
+		self.condition = threading.Condition(self.lock)
+
+	###########################
+	def inject(self, data):
+		self.condition.acquire()
+		self.buffer.append(data)
+		self.buffered += len(data)
+		while self.buffered > self.maxsize:
+			overrun = min(len(self.buffer[0]), self.buffered - self.maxsize)
+			self.buffer[0] = self.buffer[0][overrun:]
+			if not self.buffer[0]: del self.buffer[0]
+			self.buffered -= overrun
+			self.lost += overrun
+		self.condition.notify()
+		self.condition.release()
+
+	###########################
+	def read(self, size):
+		size -= size % self.frame
+		self.condition.acquire()
+		while self.buffered < size: self.condition.wait(1.0)
+		data = "".join(self.buffer)
+		output, data = data[:size], data[size:]
+		self.buffer = data and [data] or []
+		self.buffered = len(data)
+		self.condition.release()
+		return output
+
+	###########################
+	def write(self, data):
+		return audiodev.NullSoundcard.write(self, data)
+
+###########################
+###########################
+class Feeder:
+	"""Mix scheduled audio (absolute start times) into the loopback
+	soundcard in real time, so overlapping transmissions collide"""
+	###########################
+	def __init__(self, loopback, samplerate):
+		self.loopback = loopback
+		self.samplerate = samplerate
+		self.pending = []
+		self.active = []
+		self.lock = threading.Lock()
+
+	###########################
+	def schedule(self, start_time, audio):
+		self.lock.acquire()
+		self.pending.append((start_time, audio))
+		self.pending.sort()
+		self.lock.release()
+
+	###########################
+	def run(self):
+		nbytes = int(FEED_TIME * self.samplerate) * SAMPLE_WIDTH
+		feed_time = time.time()
+		while 1:
+			self.lock.acquire()
+			while self.pending and self.pending[0][0] <= feed_time:
+				start_time, audio = self.pending.pop(0)
+				offset = int((feed_time - start_time) * self.samplerate) * SAMPLE_WIDTH
+				self.active.append([audio, max(0, -offset)])
+			self.lock.release()
+			chunk = "\x00" * nbytes
+			for item in self.active:
+				audio, offset = item
+				piece = audio[offset:offset+nbytes]
+				chunk = audioop.add(chunk, piece + "\x00" * (nbytes - len(piece)), SAMPLE_WIDTH)
+				item[1] += nbytes
+			self.active = [item for item in self.active if item[1] < len(item[0])]
+			self.loopback.inject(chunk)
+			feed_time += FEED_TIME
+			delay = feed_time - time.time()
+			if delay > 0: time.sleep(delay)
+
+	###########################
+	def start(self):
+		thread = threading.Thread(target=self.run)
+		thread.setDaemon(True)
+		thread.start()
+
+###########################
+def create_phonepatch(options, server):
+	"""Return Phonepatch (radio opened) for the load test: loopback
+	soundcard, mock radio control and the fake APRS-IS server"""
+	template = os.path.abspath(options.template)
+	configuration_file = os.path.abspath(options.configuration_file)
+	cachefile = options.cache_file or None
+	if cachefile == "off": cachefile = ""
+	elif cachefile: cachefile = os.path.abspath(cachefile)
+	configuration = configcache.load(template, configuration_file, cachefile)
+	phonepatch = options.phonepatch or (aprstt.get_phpconfigs(configuration) or [None])[0]
+	if phonepatch not in configuration:
+		debug("phonepatch not found in configuration: %s" %phonepatch)
+		sys.exit(1)
+	section = configuration[phonepatch]
+	section["soundcard_device"] = "loopback:" + LOOPBACK_NAME
+	section["soundcard_record"] = options.record or "off"
+	section["radio_control"] = "mock:"
+	section["ptt"] = True
+	section["carrier_detection"] = "off"
+	section["outcall_askfortone_mode"] = "dtmf"
+	section["aprs_server"] = server.get_address()
+	section["user_store"] = options.user_store or "off"
+	section["metrics_listen"] = "off"
+	php = aprstt.Phonepatch(configuration, verbose=options.daemon_verbose, \
+		source=(template, configuration_file, cachefile))
+	if not php.init_php(phonepatch): sys.exit(1)
+	audiodev.loopbacks[LOOPBACK_NAME] = DriverLoopback(php.samplerate, options.driver_buffer)
+	# Festival is not run: each text prompt takes prompt_time seconds
+	def play_text(text):
+		time.sleep(options.prompt_time)
+		return ""
+	php.play_text = play_text
+	php.set_state("daemon")
+	php.open_radio()
+	return php
+
+###########################
+def user_sequence(php, generator, callsign, rng, options):
+	"""Return audio of a user check-in: askfortone button, a pause for
+	the prompt and the APRStt number with the outcall button"""
+	askfortone = generator.render_keys(php.getconf("askfortone_button"))
+	pause = "\x00" * (int(options.prompt_wait * php.samplerate) * SAMPLE_WIDTH)
+	symbol = rng.choice("0123456789ABCD")
+	keys, number = generator.render_number(callsign, symbol, php.getconf("outcall_button"))
+	return askfortone + pause + number
+
+###########################
+def run_step(php, feeder, generator, rate, callsigns, rng, options, verbose):
+	"""Inject check-ins (Poisson arrivals, rate per minute) during step_time
+	seconds. Return list of injected (callsign, start, end) and step stats"""
+	bytes_per_second = float(php.samplerate * SAMPLE_WIDTH)
+	begin, cpu, lost = time.time(), cpu_time(), feeder.loopback.lost
+	injected = []
+	next_time = begin + rng.expovariate(rate / 60.0)
+	end_time = begin + options.step_time
+	repeats = []
+	while 1:
+		if repeats and repeats[0][0] < next_time:
+			start, callsign, audio = repeats.pop(0)
+		else:
+			start = next_time
+			next_time += rng.expovariate(rate / 60.0)
+			callsign = signaling.random_callsign(rng)
+			while callsign in callsigns: callsign = signaling.random_callsign(rng)
+			callsigns[callsign] = True
+			audio = user_sequence(php, generator, callsign, rng, options)
+			if rng.random() < options.repeat:
+				repeats.append((start + len(audio) / bytes_per_second + rng.uniform(2.0, 10.0), callsign, audio))
+				repeats.sort()
+		if start >= end_time: break
+		feeder.schedule(start, audio)
+		injected.append((callsign, start, start + len(audio) / bytes_per_second))
+	delay = end_time - time.time()
+	if delay > 0: time.sleep(delay)
+	wall = time.time() - begin
+	stats = {"rate": rate, "cpu": (cpu_time() - cpu) / wall, "rss": current_rss(), \
+		"audio_lost": (feeder.loopback.lost - lost) / bytes_per_second}
+	debug("rate %0.1f/min: %d check-ins injected, cpu %0.1f%%, rss %s KB, %0.1f s audio lost" %(rate, \
+		len(injected), 100.0 * stats["cpu"], stats["rss"], stats["audio_lost"]), verbose)
+	return injected, stats
+
+###########################
+def match_packets(injected, packets):
+	"""Assign each packet to the earliest unmatched check-in of its
+	callsign that ended before it. Return (latencies, unexpected packets)"""
+	latencies = {}
+	unexpected = 0
+	for callsign, packet_time in sorted(packets, key=lambda packet: packet[1]):
+		for index, (injected_callsign, start, end) in enumerate(injected):
+			if injected_callsign == callsign and index not in latencies and end <= packet_time:
+				latencies[index] = packet_time - end
+				break
+		else: unexpected += 1
+	return latencies, unexpected
+
+###########################
+def summarize(steps, injected, latencies, options):
+	"""Per-step results and capacity (highest rate within drop and latency limits)"""
+	results = []
+	capacity = 0.0
+	for step, stats in enumerate(steps):
+		indexes = [index for index, item in enumerate(injected) if item[3] == step]
+		overlapped = 0
+		for index in indexes:
+			start, end = injected[index][1], injected[index][2]
+			for other in injected:
+				if other is not injected[index] and other[1] < end and other[2] > start:
+					overlapped += 1
+					break
+		values = [latencies[index] for index in indexes if index in latencies]
+		result = dict(stats)
+		result.update({"injected": len(indexes), "received": len(values), \
+			"dropped": len(indexes) - len(values), "overlapped": overlapped, \
+			"drop_rate": (len(indexes) - len(values)) / float(max(1, len(indexes))), \
+			"latency_p50": percentile(values, 0.5), "latency_p95": percentile(values, 0.95), \
+			"latency_max": values and max(values) or None})
+		results.append(result)
+		ok = result["drop_rate"] <= options.max_drop_rate and \
+			(result["latency_p95"] == None or result["latency_p95"] <= options.max_latency)
+		if ok and result["injected"]: capacity = max(capacity, stats["rate"])
+	return {"steps": results, "capacity_per_minute": capacity, "maxrss": \
+		resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+###########################
+def print_report(summary, output):
+	output.write("%8s %8s %8s %8s %10s %8s %8s %8s %6s %9s %9s\n" %("rate/min", "injected", "received", \
+		"dropped", "overlapped", "p50(s)", "p95(s)", "max(s)", "cpu%", "rss(KB)", "lost(s)"))
+	for step in summary["steps"]:
+		latencies = []
+		for key in ("latency_p50", "latency_p95", "latency_max"):
+			if step[key] == None: latencies.append("-")
+			else: latencies.append("%0.2f" %step[key])
+		output.write("%8.1f %8d %8d %8d %10d %8s %8s %8s %6.1f %9s %9.1f\n" %(step["rate"], step["injected"], \
+			step["received"], step["dropped"], step["overlapped"], latencies[0], latencies[1], \
+			latencies[2], 100.0 * step["cpu"], step["rss"], step["audio_lost"]))
+	output.write("capacity: %0.1f check-ins per minute\n" %summary["capacity_per_minute"])
+
+###########################
+def main():
+	usage = """
+	loadtest.py [options]: APRStt daemon load test
+
+	Run the Phonepatch daemon loop on a loopback soundcard with a mock
+	radio control and a fake APRS-IS server, and inject synthetic APRStt
+	check-ins (Poisson arrivals, so they overlap at high rates) at
+	increasing rates. Report end-to-end latency (last key to packet on
+	the wire), drops, CPU and memory, and the highest sustained rate."""
+
+	parser = optparse.OptionParser(usage)
+	parser.add_option('-q', '--quiet', dest='verbose', default=True, action='store_false', help='Be quiet')
+	parser.add_option('-f', '--configuration-file', dest='configuration_file', default="aprstt.conf", metavar='FILE', type='string', help='Configuration file')
+	parser.add_option('', '--template', dest='template', default="aprstt.conf.template", metavar='FILE', type='string', help='Configuration template')
+	parser.add_option('-c', '--cache-file', dest='cache_file', default="off", metavar='FILE', type='string', help='Compiled configuration cache ("off" to disable)')
+	parser.add_option('-p', '--phonepatch', dest='phonepatch', default="", metavar='NAME', type='string', help='Phonepatch section (default: first one)')
+	parser.add_option('-r', '--rates', dest='rates', default="2,5,10,20,40", metavar='LIST', type='string', help='Check-ins per minute of each step')
+	parser.add_option('-t', '--step-time', dest='step_time', default=120.0, metavar='SECONDS', type='float', help='Duration of each step')
+	parser.add_option('', '--drain-time', dest='drain_time', default=30.0, metavar='SECONDS', type='float', help='Wait for pending packets after the last step')
+	parser.add_option('', '--driver-buffer', dest='driver_buffer', default=0.5, metavar='SECONDS', type='float', help='Audio kept by the soundcard driver when the daemon does not read')
+	parser.add_option('', '--prompt-time', dest='prompt_time', default=1.5, metavar='SECONDS', type='float', help='Time taken by each daemon speech prompt (Festival is not run)')
+	parser.add_option('', '--prompt-wait', dest='prompt_wait', default=2.0, metavar='SECONDS', type='float', help='Pause of users between askfortone button and number')
+	parser.add_option('', '--repeat', dest='repeat', default=0.1, metavar='FRACTION', type='float', help='Fraction of check-ins sent again by the user')
+	parser.add_option('', '--tonetime', dest='tonetime', default=0.1, metavar='SECONDS', type='float', help='DTMF tone duration')
+	parser.add_option('', '--waittime', dest='waittime', default=0.1, metavar='SECONDS', type='float', help='Pause between DTMF tones')
+	parser.add_option('', '--jitter', dest='jitter', default=0.2, metavar='FRACTION', type='float', help='Timing jitter of tones and pauses')
+	parser.add_option('', '--twist-spread', dest='twist_spread', default=4.0, metavar='DB', type='float', help='Random twist per check-in')
+	parser.add_option('', '--snr', dest='snr', default="20", metavar='DB', type='string', help='Signal to noise ratio ("none" for no noise)')
+	parser.add_option('', '--max-drop-rate', dest='max_drop_rate', default=0.05, metavar='FRACTION', type='float', help='Drop rate allowed for capacity')
+	parser.add_option('', '--max-latency', dest='max_latency', default=10.0, metavar='SECONDS', type='float', help='95th percentile latency allowed for capacity')
+	parser.add_option('', '--record', dest='record', default="", metavar='FILE', type='string', help='Record daemon audio and events (soundcard_record) for replay')
+	parser.add_option('', '--user-store', dest='user_store', default="", metavar='FILE', type='string', help='Use APRStt user store')
+	parser.add_option('', '--daemon-verbose', dest='daemon_verbose', default=False, action='store_true', help='Show daemon debug output')
+	parser.add_option('', '--seed', dest='seed', default=0, metavar='NUMBER', type='int', help='Random seed')
+	parser.add_option('-o', '--output', dest='output', default="", metavar='FILE', type='string', help='Write JSON results to file')
+
+	options, args = parser.parse_args()
+	verbose = options.verbose
+	rng = random.Random(options.seed)
+	snr = None
+	if options.snr != "none": snr = float(options.snr)
+
+	# APRS module prints packets to standard output, keep it for the report
+	stdout, sys.stdout = sys.stdout, sys.stderr
+	server = FakeAprsServer()
+	server.start()
+	php = create_phonepatch(options, server)
+	generator = signaling.SequenceGenerator(php.samplerate, "S16_LE", options.tonetime, \
+		options.waittime, 0.5, options.jitter, 0.0, options.twist_spread, snr, options.seed)
+	feeder = Feeder(audiodev.loopbacks[LOOPBACK_NAME], php.samplerate)
+	feeder.start()
+	thread = threading.Thread(target=php.loop_daemon)
+	thread.setDaemon(True)
+	thread.start()
+	debug("daemon running, APRS-IS server on %s" %server.get_address(), verbose)
+
+	injected, steps, callsigns = [], [], {}
+	for step, rate in enumerate(parse_list(options.rates)):
+		items, stats = run_step(php, feeder, generator, rate, callsigns, rng, options, verbose)
+		injected += [item + (step,) for item in items]
+		steps.append(stats)
+	debug("waiting %0.0f seconds for pending packets" %options.drain_time, verbose)
+	time.sleep(options.drain_time)
+	if not thread.isAlive(): debug("daemon loop ended during the test", verbose)
+
+	server.lock.acquire()
+	packets = list(server.packets)
+	server.lock.release()
+	latencies, unexpected = match_packets([item[:3] for item in injected], packets)
+	summary = summarize(steps, injected, latencies, options)
+	summary["unexpected_packets"] = unexpected
+	sys.stdout = stdout
+	print_report(summary, sys.stdout)
+	if options.output:
+		results = {"version": __version__, "time": time.time(), "platform": sys.platform, \
+			"python": sys.version.split()[0], "options": options.__dict__, "summary": summary}
+		fd = open(options.output, "w")
+		json.dump(results, fd, indent=1, sort_keys=True)
+		fd.close()
+	sys.stdout.flush()
+	sys.exit(0)
+
+############################
+if __name__ == "__main__":
+	main()
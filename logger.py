@@ -0,0 +1,178 @@
+#!/usr/bin/python
+
+# This file is part of asterisk-phonepatch
+
+# Copyright (C) 2011 Stephen Hamilton
+#
+# Asterisk-phonepatch is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+# Standard Python modules
+import sys, os, errno
+import threading, Queue, atexit
+import weakref
+
+__version__ = "$Revision: 0.1 $"
+__author__ = "Stephen Hamilton <stephenshamilton@gmail.com>"
+__depends__ = ['Python-2.4']
+__copyright__ = """Copyright (C) 2011 Stephen Hamilton.
+This code is distributed under the terms of the GNU General Public License."""
+
+# Verbosity levels (a message is written if its level <= logger level)
+LEVELS = {"off": 0, "info": 1, "debug": 2}
+
+# Maximum number of records waiting for the writer thread
+QUEUE_SIZE = 1024
+
+# Per-module levels (set_levels), override levels given to Logger()
+module_levels = {}
+
+# Live Logger instances, updated by set_levels
+loggers = weakref.WeakKeyDictionary()
+
+###############################
+def write_stderr(line):
+	while 1:
+		try:
+			sys.stderr.write(line + "\n")
+			sys.stderr.flush()
+			return
+		except IOError, e:
+			if e.errno != errno.EINTR: raise
+
+###############################
+def format_record(prefix, format, args):
+	"""Build log line. Arguments are only formatted here (writer thread)"""
+	if not args: return prefix + format
+	try: return prefix + (format %args)
+	except (TypeError, ValueError): return "%s%s %r" %(prefix, format, args)
+
+###############################
+###############################
+class Handler:
+	"""Bounded queue drained by a writer thread. Emitting never blocks:
+	records are dropped (and counted) when the queue is full"""
+	###############################
+	def __init__(self, output=write_stderr, maxsize=QUEUE_SIZE):
+		self.output = output
+		self.maxsize = maxsize
+		self.dropped = 0
+		self.pid = None
+
+	###############################
+	def start(self):
+		# Writer thread does not survive a fork, so start one for each process
+		self.queue = Queue.Queue(self.maxsize)
+		self.pid = os.getpid()
+		self.thread = threading.Thread(target=self.run)
+		self.thread.setDaemon(True)
+		self.thread.start()
+
+	###############################
+	def emit(self, record):
+		if self.pid != os.getpid(): self.start()
+		try: self.queue.put_nowait(record)
+		except Queue.Full: self.dropped += 1
+
+	###############################
+	def run(self):
+		queue = self.queue
+		while 1:
+			prefix, format, args = queue.get()
+			try:
+				if self.dropped:
+					dropped, self.dropped = self.dropped, 0
+					self.output("logger: %d messages dropped" %dropped)
+				self.output(format_record(prefix, format, args))
+			except: pass
+			queue.task_done()
+
+	###############################
+	def flush(self):
+		"""Wait until queued records are written"""
+		if self.pid == os.getpid(): self.queue.join()
+
+handler = Handler()
+
+###############################
+def set_output(output):
+	"""Set function used to write log lines (default: standard error)"""
+	handler.output = output
+
+###############################
+def flush():
+	handler.flush()
+
+atexit.register(flush)
+
+###############################
+def parse_levels(spec):
+	"""Parse "module:level, ..." (level is a number or off/info/debug)"""
+	levels = {}
+	if not spec or spec == "off": return levels
+	for item in spec.split(","):
+		if not item.strip(): continue
+		try:
+			name, level = [x.strip() for x in item.split(":")]
+			if level in LEVELS: level = LEVELS[level]
+			levels[name] = int(level)
+		except ValueError: raise ValueError, "Invalid log level: %s" %item.strip()
+	return levels
+
+###############################
+def set_levels(spec):
+	"""Set per-module levels (see parse_levels) and apply them to the
+	existing loggers"""
+	levels = parse_levels(spec)
+	module_levels.clear()
+	module_levels.update(levels)
+	for logger in loggers.keys(): logger.set_level()
+
+###############################
+###############################
+class Logger:
+	"""Lazy logger: takes a format and its arguments and checks the
+	level before doing anything else. Formatting is done by the writer
+	thread, so arguments must not be modified after the call"""
+	###############################
+	def __init__(self, name, level=0, prefix=None):
+		self.name = name
+		self.default_level = level or 0
+		self.set_level()
+		if prefix == None: prefix = name + " - "
+		self.prefix = prefix
+		loggers[self] = True
+
+	###############################
+	def set_level(self):
+		self.level = int(module_levels.get(self.name, self.default_level))
+
+	###############################
+	def enabled(self, level=1):
+		return self.level >= level
+
+	###############################
+	def log(self, level, format, *args):
+		if self.level < level: return
+		handler.emit((self.prefix, format, args))
+
+	###############################
+	def info(self, format, *args):
+		if self.level < 1: return
+		handler.emit((self.prefix, format, args))
+
+	###############################
+	def debug(self, format, *args):
+		if self.level < 2: return
+		handler.emit((self.prefix, format, args))
@@ -0,0 +1,217 @@
+#!/usr/bin/python
+
+# This file is part of asterisk-phonepatch
+
+# Copyright (C) 2011 Stephen Hamilton
+#
+# Asterisk-phonepatch is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+# Standard Python modules
+import time, bisect
+import threading, socket, SocketServer
+
+__version__ = "$Revision: 0.1 $"
+__author__ = "Stephen Hamilton <stephenshamilton@gmail.com>"
+__depends__ = ['Python-2.4']
+__copyright__ = """Copyright (C) 2011 Stephen Hamilton.
+This code is distributed under the terms of the GNU General Public License."""
+
+# Default histogram buckets (seconds)
+TIME_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+###############################
+###############################
+class Counter:
+	"""Monotonic counter. Updates are not locked: a lost increment between
+	threads is acceptable for metrics and keeps hot paths cheap"""
+	kind = "counter"
+	###############################
+	def __init__(self, name, help):
+		self.name = name
+		self.help = help
+		self.value = 0
+
+	###############################
+	def inc(self, value=1):
+		self.value += value
+
+	###############################
+	def samples(self):
+		return [(self.name, self.value)]
+
+###############################
+###############################
+class Gauge:
+	"""Current value, either set or read from <function> when exported"""
+	kind = "gauge"
+	###############################
+	def __init__(self, name, help, function=None):
+		self.name = name
+		self.help = help
+		self.value = 0
+		self.function = function
+
+	###############################
+	def set(self, value):
+		self.value = value
+
+	###############################
+	def samples(self):
+		if self.function:
+			try: return [(self.name, self.function() or 0)]
+			except: return []
+		return [(self.name, self.value)]
+
+###############################
+###############################
+class Histogram:
+	"""Distribution of observed values in cumulative buckets"""
+	kind = "histogram"
+	###############################
+	def __init__(self, name, help, buckets=TIME_BUCKETS):
+		self.name = name
+		self.help = help
+		self.buckets = list(buckets)
+		self.counts = [0] * (len(self.buckets) + 1)
+		self.sum = 0.0
+		self.count = 0
+
+	###############################
+	def observe(self, value, count=1):
+		"""Add <count> observations of <value>"""
+		self.counts[bisect.bisect_left(self.buckets, value)] += count
+		self.sum += value * count
+		self.count += count
+
+	###############################
+	def samples(self):
+		samples = []
+		total = 0
+		for bound, count in zip(self.buckets, self.counts):
+			total += count
+			samples.append(('%s_bucket{le="%s"}' %(self.name, repr(float(bound))), total))
+		samples.append(('%s_bucket{le="+Inf"}' %self.name, self.count))
+		samples.append(("%s_sum" %self.name, self.sum))
+		samples.append(("%s_count" %self.name, self.count))
+		return samples
+
+###############################
+###############################
+class Registry:
+	"""Set of metrics, exported in Prometheus text format"""
+	###############################
+	def __init__(self):
+		self.metrics = {}
+		self.lock = threading.Lock()
+
+	###############################
+	def register(self, metric):
+		"""Register metric (return the already registered one with same name)"""
+		self.lock.acquire()
+		try: return self.metrics.setdefault(metric.name, metric)
+		finally: self.lock.release()
+
+	###############################
+	def counter(self, name, help):
+		return self.register(Counter(name, help))
+
+	###############################
+	def gauge(self, name, help, function=None):
+		gauge = self.register(Gauge(name, help, function))
+		if function: gauge.function = function
+		return gauge
+
+	###############################
+	def histogram(self, name, help, buckets=TIME_BUCKETS):
+		return self.register(Histogram(name, help, buckets))
+
+	###############################
+	def get(self, name):
+		return self.metrics.get(name)
+
+	###############################
+	def render(self):
+		"""Return metrics in Prometheus text exposition format"""
+		lines = []
+		names = self.metrics.keys()
+		names.sort()
+		for name in names:
+			metric = self.metrics[name]
+			lines.append("# HELP %s %s" %(name, metric.help))
+			lines.append("# TYPE %s %s" %(name, metric.kind))
+			for sample, value in metric.samples():
+				lines.append("%s %s" %(sample, format_value(value)))
+		return "\n".join(lines) + "\n"
+
+###############################
+def format_value(value):
+	if type(value) == float: return repr(value)
+	return str(value)
+
+# Default registry for the process
+REGISTRY = Registry()
+
+###############################
+def counter(name, help):
+	return REGISTRY.counter(name, help)
+
+###############################
+def gauge(name, help, function=None):
+	return REGISTRY.gauge(name, help, function)
+
+###############################
+def histogram(name, help, buckets=TIME_BUCKETS):
+	return REGISTRY.histogram(name, help, buckets)
+
+###############################
+###############################
+class MetricsHandler(SocketServer.StreamRequestHandler):
+	"""Minimal HTTP/1.0 handler: any request gets the metrics"""
+	###############################
+	def handle(self):
+		while 1:
+			line = self.rfile.readline()
+			if not line or not line.strip(): break
+		body = self.server.registry.render()
+		self.wfile.write("HTTP/1.0 200 OK\r\nContent-Type: %s\r\nContent-Length: %d\r\n\r\n" \
+			%(CONTENT_TYPE, len(body)))
+		self.wfile.write(body)
+
+###############################
+class TCPMetricsServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+	daemon_threads = True
+	allow_reuse_address = True
+
+###############################
+class UnixMetricsServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+	daemon_threads = True
+
+###############################
+def start_server(address, registry=REGISTRY):
+	"""Serve metrics on a thread. Address: "tcp:[host:]port" (host defaults
+	to localhost) or "unix:path". Return the server instance"""
+	import radiocontrol
+	family, sockaddr = radiocontrol.parse_address(address)
+	if family == socket.AF_UNIX:
+		radiocontrol.remove_socket(sockaddr)
+		server = UnixMetricsServer(sockaddr, MetricsHandler)
+	else: server = TCPMetricsServer(sockaddr, MetricsHandler)
+	server.registry = registry
+	thread = threading.Thread(target=server.serve_forever)
+	thread.setDaemon(True)
+	thread.start()
+	return server
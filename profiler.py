@@ -0,0 +1,135 @@
+#!/usr/bin/python
+
+# This file is part of asterisk-phonepatch
+
+# Copyright (C) 2011 Stephen Hamilton
+#
+# Asterisk-phonepatch is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+# Standard Python modules
+import sys, os, time
+import threading
+
+# External phonepatch modules
+import metrics
+
+__version__ = "$Revision: 0.1 $"
+__author__ = "Stephen Hamilton <stephenshamilton@gmail.com>"
+__depends__ = ['Python-2.6']
+__copyright__ = """Copyright (C) 2011 Stephen Hamilton.
+This code is distributed under the terms of the GNU General Public License."""
+
+# Default sampling interval (seconds) and maximum profile time
+INTERVAL = 0.01
+MAX_TIME = 60.0
+
+# Daemon stages: (name, histogram metric measuring it)
+STAGES = [("read", "aprstt_audio_read_seconds"),
+	("decode", "aprstt_dtmf_window_seconds"),
+	("play", "aprstt_radio_transmit_seconds"),
+	("send", "aprstt_aprs_send_seconds")]
+
+###############################
+def frame_label(frame):
+	code = frame.f_code
+	module = os.path.splitext(os.path.basename(code.co_filename))[0]
+	return "%s:%s" %(module, code.co_name)
+
+###############################
+def frame_stack(frame):
+	"""Return frame labels from outermost to innermost call"""
+	stack = []
+	while frame:
+		stack.append(frame_label(frame))
+		frame = frame.f_back
+	stack.reverse()
+	return stack
+
+###############################
+###############################
+class Profiler:
+	"""Sampling profiler: every <interval> seconds take the stack of all
+	threads (except the sampling one). The profiled code is not
+	instrumented, so the cost is a stack walk per thread and sample"""
+	###############################
+	def __init__(self, interval=INTERVAL, registry=metrics.REGISTRY, stages=STAGES):
+		self.interval = interval
+		self.registry = registry
+		self.stages = stages
+		self.stacks = {}
+		self.samples = 0
+		self.elapsed = 0.0
+		self.stage_times = []
+
+	###############################
+	def stage_snapshot(self):
+		snapshot = {}
+		for name, metric_name in self.stages:
+			metric = self.registry.get(metric_name)
+			if metric: snapshot[name] = (metric.count, metric.sum)
+			else: snapshot[name] = (0, 0.0)
+		return snapshot
+
+	###############################
+	def sample(self):
+		current = threading.currentThread()
+		names = dict([(thread.ident, thread.getName()) for thread in threading.enumerate()])
+		for ident, frame in sys._current_frames().items():
+			if ident == current.ident: continue
+			key = ";".join([names.get(ident, "thread-%d" %ident)] + frame_stack(frame))
+			self.stacks[key] = self.stacks.get(key, 0) + 1
+		self.samples += 1
+
+	###############################
+	def run(self, seconds):
+		"""Sample during <seconds> (limited to MAX_TIME) and return self"""
+		seconds = min(max(seconds, 0.0), MAX_TIME)
+		before = self.stage_snapshot()
+		start = time.time()
+		end = start + seconds
+		while 1:
+			self.sample()
+			now = time.time()
+			if now >= end: break
+			time.sleep(min(self.interval, end - now))
+		self.elapsed = time.time() - start
+		after = self.stage_snapshot()
+		self.stage_times = []
+		for name, metric_name in self.stages:
+			count = after[name][0] - before[name][0]
+			total = after[name][1] - before[name][1]
+			self.stage_times.append((name, count, total))
+		return self
+
+	###############################
+	def collapsed(self):
+		"""Return stacks in collapsed format ("frame;frame;... count"),
+		as used by flamegraph.pl"""
+		items = [(count, stack) for stack, count in self.stacks.items()]
+		items.sort()
+		items.reverse()
+		return ["%s %d" %(stack, count) for count, stack in items]
+
+	###############################
+	def report(self):
+		"""Return stage timings (comment lines) followed by collapsed stacks"""
+		lines = ["# profile: %0.2f seconds, %d samples, interval %0.3f seconds" \
+			%(self.elapsed, self.samples, self.interval)]
+		for name, count, total in self.stage_times:
+			mean = 0.0
+			if count: mean = total / count
+			lines.append("# stage %s: %d calls, %0.3f seconds, %0.2f ms mean, %0.1f%% of time" \
+				%(name, count, total, 1000.0 * mean, 100.0 * total / max(self.elapsed, 1e-9)))
+		return "\n".join(lines + self.collapsed()) + "\n"
@@ -19,12 +19,14 @@
 # Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
 
 # Standard Python modules
-import sys, time, math
+import sys, os, time, math
 import errno, audioop
-import struct
+import struct, threading
 
 # External phonepatch modules
-import soundcard
+import numarray
+import metrics, logger
+import audiofile, audiodev
 
 __version__ = "$Revision: 1.12 $"
 __author__ = "Arnau Sanchez <arnau@ehas.org>"
@@ -32,7 +34,283 @@ __depends__ = ['Python-2.4']
 __copyright__ = """Copyright (C) 2006 Arnau Sanchez <arnau@ehas.org>.
 This code is distributed under the terms of the GNU General Public License."""
 
-##############################
+# Metrics
+FRAMES_READ = metrics.counter("aprstt_audio_frames_read_total", "Audio frames read from the soundcard")
+CTCSS_DETECTIONS = metrics.counter("aprstt_ctcss_detections_total", "CTCSS tones detected")
+PTT_ACTIVATIONS = metrics.counter("aprstt_ptt_activations_total", "Times the PTT was set on")
+PTT_ON_TIME = metrics.counter("aprstt_ptt_on_seconds_total", "Time the PTT has been on (seconds)")
+READ_TIME = metrics.histogram("aprstt_audio_read_seconds", "Time spent in (blocking) audio reads")
+TRANSMIT_TIME = metrics.histogram("aprstt_radio_transmit_seconds", "Time spent transmitting audio to the radio")
+
+# Scheduling policy value for sched_setscheduler() (see <sched.h>)
+SCHED_FIFO = 1
+
+###################################
+def set_realtime_priority(priority):
+	"""Set SCHED_FIFO policy with given priority for the calling thread"""
+	import ctypes, ctypes.util
+	class sched_param(ctypes.Structure):
+		_fields_ = [("sched_priority", ctypes.c_int)]
+	libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+	param = sched_param(priority)
+	if libc.sched_setscheduler(0, SCHED_FIFO, ctypes.byref(param)) != 0:
+		nerror = ctypes.get_errno()
+		raise OSError, (nerror, "sched_setscheduler: %s" %os.strerror(nerror))
+
+###############################
+###############################
+class Capture:
+	"""Drain the soundcard from a dedicated thread into a bounded ring.
+
+	Each fragment read from the soundcard is stored with the time it was
+	captured, so consumers (read) are decoupled from soundcard timing. When
+	the ring is full the oldest fragment is discarded and counted as an 
+	overrun; a consumer that had a backlog and then must wait for data 
+	(it ran the ring dry) counts as an underrun. 
+	Samples lost by the driver itself (reads delayed beyond the soundcard 
+	buffer) are estimated comparing the sample clock with the wall clock.
+	"""
+	###################################
+	def __init__(self, soundcard, fragmentsize, bytes_per_second, maxfragments=64, \
+			priority=0, debug=None):
+		self.soundcard = soundcard
+		self.fragmentsize = fragmentsize
+		self.bytes_per_second = float(bytes_per_second)
+		self.maxfragments = max(2, maxfragments)
+		self.priority = priority
+		self.debug = debug or (lambda log, *args: None)
+		self.ring = []
+		self.ring_bytes = 0
+		self.pending = ""
+		# Set when a read left data in the ring (consumer is behind)
+		self.backlog = False
+		self.condition = threading.Condition()
+		self.running = False
+		self.thread = None
+		self.error = None
+		self.last_timestamp = None
+		self.stats = {"fragments": 0, "bytes": 0, "overruns": 0, "overrun_bytes": 0, \
+			"underruns": 0, "lost_bytes": 0, "max_depth": 0}
+
+	###################################
+	def start(self):
+		"""Start capture thread"""
+		self.running = True
+		self.thread = threading.Thread(target=self.run)
+		self.thread.setDaemon(True)
+		self.thread.start()
+
+	###################################
+	def stop(self, timeout=1.0):
+		"""Stop capture thread (it ends after the current soundcard read)"""
+		self.condition.acquire()
+		self.running = False
+		self.condition.notifyAll()
+		self.condition.release()
+		if self.thread: 
+			self.thread.join(timeout)
+			self.thread = None
+
+	###################################
+	def run(self):
+		if self.priority:
+			try: set_realtime_priority(self.priority)
+			except Exception, detail: self.debug("capture: cannot set SCHED_FIFO priority: %s", detail)
+			else: self.debug("capture: SCHED_FIFO priority set: %d", self.priority)
+		start_time = None
+		total = 0
+		while self.running:
+			try: buffer = self.soundcard.read(self.fragmentsize)
+			except Exception, detail: buffer = None; self.error = detail
+			now = time.time()
+			if not buffer:
+				self.condition.acquire()
+				self.running = False
+				self.condition.notifyAll()
+				self.condition.release()
+				break
+			# Timestamp refers to the first sample of the fragment
+			timestamp = now - len(buffer) / self.bytes_per_second
+			if start_time == None: start_time = timestamp
+			total += len(buffer)
+			# Samples not delivered by the driver for the elapsed time were lost
+			lost = int((now - start_time) * self.bytes_per_second) - total
+			if lost > 2 * self.fragmentsize:
+				self.stats["lost_bytes"] += lost
+				self.debug("capture: soundcard overrun at %0.3f: %d bytes lost", now, lost)
+				start_time, total = timestamp, len(buffer)
+			self.condition.acquire()
+			self.ring.append((timestamp, buffer))
+			self.ring_bytes += len(buffer)
+			self.stats["fragments"] += 1
+			self.stats["bytes"] += len(buffer)
+			if len(self.ring) > self.maxfragments:
+				oldtime, oldbuffer = self.ring.pop(0)
+				self.ring_bytes -= len(oldbuffer)
+				self.stats["overruns"] += 1
+				self.stats["overrun_bytes"] += len(oldbuffer)
+			self.stats["max_depth"] = max(self.stats["max_depth"], len(self.ring))
+			self.condition.notify()
+			self.condition.release()
+
+	###################################
+	def read(self, size):
+		"""Get <size> bytes from the ring, waiting if not available. 
+		
+		Return a shorter buffer (or void) if the capture thread has ended"""
+		self.condition.acquire()
+		try:
+			if len(self.pending) + self.ring_bytes < size and self.running:
+				if self.backlog: self.stats["underruns"] += 1
+				self.backlog = False
+			while len(self.pending) + self.ring_bytes < size and self.running:
+				self.condition.wait(1.0)
+			chunks = [self.pending]
+			length = len(self.pending)
+			if self.ring: 
+				self.last_timestamp = self.ring[0][0] - length / self.bytes_per_second
+			while self.ring and length < size:
+				timestamp, buffer = self.ring.pop(0)
+				self.ring_bytes -= len(buffer)
+				chunks.append(buffer)
+				length += len(buffer)
+			if self.ring: self.backlog = True
+		finally:
+			self.condition.release()
+		data = "".join(chunks)
+		self.pending = data[size:]
+		return data[:size]
+
+	###################################
+	def get_stats(self):
+		"""Return a copy of capture counters (includes current ring depth)"""
+		self.condition.acquire()
+		stats = dict(self.stats)
+		stats["depth"] = len(self.ring)
+		self.condition.release()
+		return stats
+
+###############################
+###############################
+class Vox:
+	"""VOX detector (attack/release) running on the sample clock.
+
+	Power of consecutive frames of <framesize> samples is computed for a 
+	whole block of audio at once. The detector turns on when the power stays
+	over <threshold> during <attack> seconds and turns off when <tailtime> 
+	seconds have passed since then. State is kept on for <maxtime> seconds
+	at most, and then is held off for <waittime> seconds. 
+	
+	process() returns the transitions as tuples (sample_offset, state, reason),
+	where sample_offset is relative to the start of the given buffer. 
+	Python code only runs per transition, not per frame, so blocks can be 
+	of any size.
+	"""
+	###################################
+	def __init__(self, samplerate, sample_width, threshold, tailtime, maxtime=0, \
+			waittime=0, attack=0, framesize=None):
+		self.samplerate = samplerate
+		self.sample_width = sample_width
+		self.sample_max = 2.0**(sample_width*8) / 2.0
+		self.framesize = framesize or max(1, samplerate / 100)
+		self.set_parameters(threshold, tailtime, maxtime, waittime, attack)
+		self.pending = None
+		self.power = None
+		self.samples = 0
+		self.clock = 0
+		self.raw = False
+		self.state = False
+		self.state_since = self.hold_until = 0
+		self.last_below = self.last_trigger = -(2**30)
+
+	###################################
+	def set_parameters(self, threshold, tailtime, maxtime=0, waittime=0, attack=0):
+		"""Set detection parameters (the current state is kept)"""
+		self.threshold = threshold
+		self.attackframes = max(1, self.to_frames(attack))
+		self.tailframes = max(1, self.to_frames(tailtime))
+		self.maxframes = self.to_frames(maxtime)
+		self.waitframes = self.to_frames(waittime)
+
+	###################################
+	def to_frames(self, seconds):
+		return int(math.ceil(float(seconds or 0) * self.samplerate / self.framesize))
+
+	###################################
+	def get_time(self):
+		"""Return time (seconds) of the sample clock"""
+		return float(self.samples) / self.samplerate
+
+	###################################
+	def frame_power(self, buffer):
+		"""Return RMS power (0..1) of each complete frame in buffer (array)"""
+		nsamples = len(buffer) / self.sample_width
+		format = "<%d%s" %(nsamples, {1: "b", 2: "h"}[self.sample_width])
+		samples = numarray.array(struct.unpack(format, buffer), type=numarray.Float64)
+		if self.pending is not None and len(self.pending):
+			samples = numarray.concatenate([self.pending, samples])
+		nframes = len(samples) / self.framesize
+		self.pending = samples[nframes*self.framesize:].copy()
+		if not nframes: return numarray.array([], type=numarray.Float64)
+		frames = numarray.reshape(samples[:nframes*self.framesize], (nframes, self.framesize))
+		return numarray.sqrt(numarray.add.reduce(frames*frames, 1) / self.framesize) / self.sample_max
+
+	###################################
+	def process(self, buffer):
+		"""Process audio buffer and return state transitions"""
+		offset = self.samples
+		self.samples += len(buffer) / self.sample_width
+		self.power = power = self.frame_power(buffer)
+		nframes = len(power)
+		if not nframes: return []
+		index = numarray.arange(nframes) + self.clock
+		
+		# Attack: frames closing a run of <attackframes> frames over threshold
+		above = power >= self.threshold
+		last_below = numarray.maximum.accumulate(numarray.where(above, self.last_below, index))
+		trigger = (index - last_below) >= self.attackframes
+		last_trigger = numarray.maximum.accumulate(numarray.where(trigger, index, self.last_trigger))
+		raw = (index - last_trigger) < self.tailframes
+		self.last_below = int(last_below[-1])
+		self.last_trigger = int(last_trigger[-1])
+		
+		# Runs of raw detection: list of (start, end), end=None if still active
+		edges = [int(x) + 1 for x in numarray.nonzero(raw[1:] != raw[:-1])[0]]
+		bounds = [0] + edges + [nframes]
+		runs = []
+		for start, end in zip(bounds[:-1], bounds[1:]):
+			if not raw[start]: continue
+			if end == nframes: runs.append((self.clock + start, None))
+			else: runs.append((self.clock + start, self.clock + end))
+		if not raw[0] and self.state and self.raw:
+			runs.insert(0, (self.clock, self.clock))
+		blockend = self.clock + nframes
+		self.raw = bool(raw[-1])
+		
+		# Apply maxtime/waittime limits only on transitions
+		events = []
+		for start, end in runs:
+			if end == None: limit = blockend
+			else: limit = end
+			current = max(start, self.hold_until)
+			while current < limit:
+				if not self.state:
+					self.state, self.state_since = True, current
+					events.append((current, True, "threshold"))
+				if not self.maxframes or self.state_since + self.maxframes > limit: break
+				current = self.state_since + self.maxframes
+				self.state = False
+				self.hold_until = current + self.waitframes
+				events.append((current, False, "maxtime"))
+				current = self.hold_until
+			if end != None and self.state:
+				self.state = False
+				events.append((end, False, "tailtime"))
+		self.clock = blockend
+		return [(max(0, frame * self.framesize - offset), state, reason) \
+			for frame, state, reason in events]
+
+###############################
 ###############################
 class Radio:
 	"""Use soundcard and external PTT apps to interface with a radio transceiver.
@@ -45,19 +323,31 @@ class Radio:
 
 	###############################
 	def __init__(self, soundcard_device, samplerate, ptt, carrier, verbose=False, \
-		soundcard_retries=1, fullduplex=False, latency=None, ctcss_mintime=False):
+		soundcard_retries=1, fullduplex=False, latency=None, ctcss_mintime=False, \
+		capture=False, capture_fragments=64, capture_priority=0, record=None):
 		"""Open a soundcard and PTT interface.
 
 		Use radio_control object to set PTT and get carrier-detection state.
 		
-		Soundcard device should be OSS files (/dev/dspX). Parameter 
-		<samplerate> will be the rate used by soundcard.
+		Soundcard device is an OSS file (/dev/dspX) or a "backend:arguments"
+		string (see audiodev). Parameter <samplerate> will be the rate used
+		by soundcard.
 		
 		PTT object is an instance  of ExecInterface with "on" and "off"
 		commands defined.
+
+		If <capture> is enabled, a dedicated thread reads the soundcard into
+		a ring of <capture_fragments> fragments (see Capture), optionally 
+		with SCHED_FIFO <capture_priority>.
+
+		A <soundcard_device> "replay:FILE" feeds a recording back as fast as
+		it is read, and radio time (self.clock) becomes a virtual clock 
+		driven by the audio read and written. If <record> is given, audio 
+		and PTT/carrier events are recorded to that file (see audiofile).
 		"""
 		self.samplerate = samplerate
 		self.verbose = verbose
+		self.logger = logger.Logger("radio", verbose, "radio -- ")
 		self.ptt = ptt
 		self.carrier = carrier
 		
@@ -78,64 +368,127 @@ class Radio:
 			if self.fragmentsize < 128: self.fragmentsize = 128
 			elif self.fragmentsize > 32768: self.fragmentsize = 32768
 			self.fragmentsize = 2**int(math.log(self.fragmentsize, 2))
-			self.debug("soundcard fragment size: %d bytes" %self.fragmentsize)
+			self.debug("soundcard fragment size: %d bytes", self.fragmentsize)
 			
 		self.onoff_dict = {False: "off", True: "on"}
-		self.ptt_offtime = self.ptt_ontime = self.ptt_tailtime = 0
-		self.carrier_offtime = self.carrier_ontime = self.carrier_tailtime = 0
+		self.clock = audiofile.Clock()
+		self.record = record
+		self.recorder = None
+		self.ptt_state = None
+		self.ptt_on_time = None
 		self.carrier_state = None
 		self.set_carrier_state(False)
+		self.set_vox()
 	
 		# CTCSS generator/decoder		
-		if ctcss_mintime:
-			import ctcss
-			self.ctcss_generator = ctcss.Generator(self.samplerate, self.sample_width)
-			self.ctcss_decoder = ctcss.Decoder(self.samplerate, self.sample_width, ctcss_mintime)
-		else: self.ctcss_generator = self.ctcss_decoder = None
+		self.set_ctcss(ctcss_mintime)
 		
 		# Open soundcard
 		self.soundcard = None
 		self.soundcard_device = soundcard_device
 		while 1:
 			try: self.soundcard = self.open_soundcard(device = soundcard_device, \
-					channels = self.audio_channels, mode = "rw", library = "oss", \
+					channels = self.audio_channels, mode = "rw", \
 					samplerate = samplerate, sampleformat = self.sampleformat, \
 					fragmentsize = self.fragmentsize)
 			except IOError, (nerror, detail): 
 				if nerror != errno.EBUSY: break
 				soundcard_retries -= 1
 				if not soundcard_retries: break
-				self.debug("soundcard busy, remaining retries: %d" %soundcard_retries)
+				self.debug("soundcard busy, remaining retries: %d", soundcard_retries)
 				time.sleep(1)
 			else: break
 				
 		if not self.soundcard:		
 			raise IOError, "cannot open soundcard: %s" %soundcard_device
+		if isinstance(self.soundcard, audiofile.ReplaySoundcard):
+			self.clock = self.soundcard.clock
+			if self.carrier and self.carrier.type == "on": 
+				self.carrier.get = self.soundcard.get_carrier
+			if capture: 
+				self.debug("capture thread disabled when replaying")
+				capture = False
 			
 		# Turn PTT off at start (for safety)
 		self.set_ptt(False)
 		
+		# Capture thread (read_audio becomes a consumer of its ring)
+		self.capture = None
+		self.capture_args = None
+		self.capture_lost = 0
+		if capture:
+			self.capture_args = capture_fragments, capture_priority
+			self.start_capture()
+		
 	###################################
 	def open_soundcard(self, *args, **kwargs):
+		"""Open audio device through its backend (see audiodev)"""
 		self.open_soundcard_args = args, kwargs
-		return soundcard.Soundcard(*args, **kwargs)
+		card = audiodev.open_device(sample_width = self.sample_width, *args, **kwargs)
+		if isinstance(card, audiofile.ReplaySoundcard): return card
+		if self.record:
+			if not self.recorder:
+				self.recorder = audiofile.Recorder(self.record, kwargs["samplerate"], \
+					kwargs["channels"], self.sample_width, self.clock)
+				self.debug("recording audio to %s", self.record)
+			card = audiofile.RecordingSoundcard(card, self.recorder)
+		return card
 
 	###################################
 	def reopen_soundcard(self):
+		self.stop_capture()
+		if isinstance(self.soundcard, audiofile.RecordingSoundcard):
+			self.soundcard = self.soundcard.soundcard
 		self.soundcard.close()
 		args, kwargs = self.open_soundcard_args
-		self.soundcard = soundcard.Soundcard(*args, **kwargs)
+		self.soundcard = self.open_soundcard(*args, **kwargs)
+		if self.capture_args: self.start_capture()
+
+	###################################
+	def start_capture(self):
+		"""Start capture thread for soundcard reads"""
+		fragments, priority = self.capture_args
+		fragmentsize = self.fragmentsize or self.buffer_size
+		bytes_per_second = self.samplerate * self.audio_channels * self.sample_width
+		self.capture = Capture(self.soundcard, fragmentsize, bytes_per_second, \
+			fragments, priority, self.debug)
+		self.capture.start()
+		metrics.gauge("aprstt_capture_queue_depth", "Fragments queued in the capture ring", \
+			lambda: self.get_capture_stats()["depth"])
+		metrics.gauge("aprstt_capture_lost_bytes", "Audio bytes lost by the capture thread", \
+			lambda: self.capture_lost)
+		self.debug("capture thread started: %d fragments of %d bytes", fragments, fragmentsize)
+
+	###################################
+	def stop_capture(self):
+		"""Stop capture thread (if running)"""
+		if not self.capture: return
+		self.capture.stop()
+		self.debug("capture thread stopped: %s", self.format_capture_stats())
+		self.capture = None
+
+	###################################
+	def get_capture_stats(self):
+		"""Return capture counters (dictionary) or None if not enabled"""
+		if not self.capture: return
+		return self.capture.get_stats()
+
+	###################################
+	def format_capture_stats(self):
+		stats = self.get_capture_stats()
+		if not stats: return "capture disabled"
+		keys = stats.keys()
+		keys.sort()
+		return ", ".join(["%s=%d" %(key, stats[key]) for key in keys])
 
 	###################################
-	def debug(self, args, exit = False):
-		"""Write logs to standard error if enabled"""
-		if not self.verbose: return
-		log = "radio -- "
-		if exit: log += "fatal error - "
-		log += str(args) + "\n"
-		sys.stderr.write(log)
-		sys.stderr.flush()
-		if exit: sys.exit(1)
+	def debug(self, log, *args, **kwargs):
+		"""Write logs if enabled (log is a format string for args)"""
+		if kwargs.get("exit"):
+			self.logger.info("fatal error - " + log, *args)
+			logger.flush()
+			sys.exit(1)
+		self.logger.info(log, *args)
 		
 	###################################
 	def get_audiofd(self):
@@ -158,17 +511,37 @@ class Radio:
 	def read_audio(self, size, power_limit=1.0):
 		"""Read data from soundcard""" 
 		if not self.soundcard: self.debug("soundcard not opened"); return
-		buffer = self.soundcard.read(size)
+		start = time.time()
+		if self.capture:
+			buffer = self.capture.read(size)
+			self.check_capture()
+		else: buffer = self.soundcard.read(size)
+		READ_TIME.observe(time.time() - start)
 		if not buffer: return
+		FRAMES_READ.inc(len(buffer) / (self.sample_width * self.audio_channels))
 		buffer = self.update_carrier_state(buffer)
 		if power_limit < 1.0:
 			buffer = self.limit_power(buffer, power_limit)
 		return buffer
 
+	#####################################
+	def check_capture(self):
+		"""Report samples lost since last check (ring overruns or driver overruns)"""
+		stats = self.capture.get_stats()
+		lost = stats["overrun_bytes"] + stats["lost_bytes"]
+		if lost == self.capture_lost: return
+		samples = (lost - self.capture_lost) / (self.sample_width * self.audio_channels)
+		self.capture_lost = lost
+		self.debug("capture: %d samples lost at %0.3f (%s)", samples, time.time(), \
+			self.format_capture_stats())
+
 	#####################################
 	def decode_ctcss(self, buffer):
 		if not self.ctcss_decoder or not self.carrier_state: return
+		tone = self.ctcss_decoder.get_tone()
 		self.ctcss_decoder.decode_buffer(buffer)
+		newtone = self.ctcss_decoder.get_tone()
+		if newtone and newtone != tone: CTCSS_DETECTIONS.inc()
 
 	#####################################
 	def clear_ctcss(self):
@@ -188,7 +561,7 @@ class Radio:
 		if self.carrier.type == "audio": return buffer
 		try: next_time = self.time_next_carrier
 		except: next_time = 0
-		now = time.time()
+		now = self.clock.time()
 		if now > next_time:
 			try: self.set_carrier_state(self.carrier.get())
 			except: self.debug("cannot get carrier state"); return buffer
@@ -201,8 +574,9 @@ class Radio:
 	########################################
 	def set_carrier_state(self, state):
 		if self.carrier_state != state:
-			self.debug("new carrier state: %s" %self.onoff_dict[state])
+			self.debug("new carrier state: %s", self.onoff_dict[state])
 			self.carrier_state = state
+			if self.recorder: self.recorder.event(audiofile.CARRIER_EVENT, state)
 		
 	########################################
 	def is_ptt_blocked(self):
@@ -212,6 +586,50 @@ class Radio:
 			return False
 		return True
 		
+	#####################################
+	def create_vox(self, control):
+		"""Return a Vox detector for the ptt/carrier parameters container"""
+		return Vox(self.samplerate, self.sample_width, control.threshold, control.tailtime, \
+			control.maxtime, control.waittime, getattr(control, "attack", 0))
+
+	#####################################
+	def set_vox(self):
+		"""(Re)create VOX detectors from current PTT and carrier parameters"""
+		self.ptt_vox = self.carrier_vox = None
+		if self.ptt: 
+			self.ptt_vox = self.create_vox(self.ptt)
+		if self.carrier and self.carrier.type == "audio": 
+			self.carrier_vox = self.create_vox(self.carrier)
+
+	#####################################
+	def update_vox(self):
+		"""Apply changed PTT and carrier parameters to the VOX detectors
+		(in place, so a transmission in progress is not cut)"""
+		for vox, control in ((self.ptt_vox, self.ptt), (self.carrier_vox, self.carrier)):
+			if not vox: continue
+			vox.set_parameters(control.threshold, control.tailtime, control.maxtime, \
+				control.waittime, getattr(control, "attack", 0))
+
+	#####################################
+	def set_ctcss(self, mintime):
+		"""(Re)create CTCSS generator and decoder (disabled if mintime is false)"""
+		if mintime:
+			import ctcss
+			self.ctcss_generator = ctcss.Generator(self.samplerate, self.sample_width)
+			self.ctcss_decoder = ctcss.Decoder(self.samplerate, self.sample_width, mintime)
+		else: self.ctcss_generator = self.ctcss_decoder = None
+
+	#####################################
+	def split_events(self, buffer, events):
+		"""Split buffer on VOX events: yield tuples (event, buffer_before_event)"""
+		frame = self.sample_width * self.audio_channels
+		position = 0
+		for event in events:
+			offset = min(len(buffer), event[0] * frame)
+			yield event, buffer[position:offset]
+			position = offset
+		yield None, buffer[position:]
+
 	#####################################
 	def vox_toradio(self, buffer, ctcss=None):
 		"""VOX PTT processing.
@@ -225,39 +643,29 @@ class Radio:
 			self.send_audio(buffer, ctcss)
 			return
 		
-		# Get power of audio fragment for VOX
-		power = audioop.rms(buffer, self.sample_width) / self.sample_max
-		now = time.time()
-		
-		if power >= self.ptt.threshold and now >= self.ptt_ontime:
-			self.ptt_tailtime = now + self.ptt.tailtime
-			if not self.ptt.get():
-				self.debug("input power threshold reached: %0.4f" %self.ptt.threshold)
+		events = self.ptt_vox.process(buffer)
+		if self.ptt_state and self.is_ptt_blocked():
+			self.debug("PTT blocked turned off due to carrier detection")
+			self.set_ptt(False)
+		for event, data in self.split_events(buffer, events):
+			self.send_audio(data, ctcss)
+			if not event: continue
+			offset, state, reason = event
+			if state:
+				self.debug("input power threshold reached: %0.4f", self.ptt.threshold)
 				# Thereshold for PTT reached, but check before if not carrier is detected
-				if not self.is_ptt_blocked():
-					self.set_ptt(True)
-					self.ptt_ontime = 0
-					if self.ptt.maxtime:
-						self.ptt_offtime = now + self.ptt.maxtime
-				else: self.debug("PTT blocked due to carrier detection")
-			elif self.ptt_offtime and now >= self.ptt_offtime and not self.ptt_ontime:
-				self.debug("ptt_max_time timed out: turn PTT off and wait %d seconds" %self.ptt.waittime)
-				self.set_ptt(False)
-				self.ptt_ontime = now + self.ptt.waittime
-			elif self.is_ptt_blocked():
-				self.debug("PTT blocked turned off due to carrier detection")
+				if self.is_ptt_blocked(): self.debug("PTT blocked due to carrier detection")
+				else: self.set_ptt(True)
+			elif reason == "maxtime":
+				self.debug("ptt_max_time timed out: turn PTT off and wait %d seconds", self.ptt.waittime)
 				self.set_ptt(False)
-				
-		elif self.ptt.get():
-			if now >= self.ptt_tailtime:
+			else:
 				self.debug("ptt_tail_time reached")
 				self.set_ptt(False)
-			elif self.is_ptt_blocked():
-				self.debug("PTT blocked due to carrier detection")
-				self.set_ptt(False)
-
-		#if self.ptt.get():
-		self.send_audio(buffer, ctcss)
+		# PTT blocked on the attack event: key it once the carrier is gone
+		if self.ptt_vox.state and not self.ptt_state and not self.is_ptt_blocked():
+			self.debug("PTT no longer blocked by carrier detection")
+			self.set_ptt(True)
 
 	#####################################
 	def vox_topeer(self, peerfd, buffer):
@@ -271,29 +679,15 @@ class Radio:
 			peerfd.flush()
 			return
 		
-		# Get power of audio fragment for VOX
-		power = audioop.rms(buffer, self.sample_width) / self.sample_max
-		now = time.time()
-		
-		if power >= self.carrier.threshold and now >= self.carrier_ontime:
-			self.carrier_tailtime = now + self.carrier.tailtime
-			if not self.carrier_state:
-				self.debug("input power threshold for radio reached: %0.4f" %self.carrier.threshold)
-				if self.ptt.get(): self.set_ptt(False)
-				self.carrier_ontime = 0
-				if self.carrier.maxtime: 
-					self.carrier_offtime = now + self.carrier.maxtime
-				self.set_carrier_state(True)
-			elif self.carrier_offtime and now >= self.carrier_offtime and not self.carrier_ontime:
-				self.debug("carrier_max_time timed out: disabling carrier_detection for %d seconds" %self.ptt.waittime)
-				self.set_carrier_state(False)
-				self.carrier_ontime = now + self.carrier.waittime
-				
-		elif self.carrier_state and now >= self.carrier_tailtime:
-			self.debug("carrier_tail_time reached")
-			self.set_carrier_state(False)
+		for offset, state, reason in self.carrier_vox.process(buffer):
+			if state:
+				self.debug("input power threshold for radio reached: %0.4f", self.carrier.threshold)
+				if self.ptt_state: self.set_ptt(False)
+			elif reason == "maxtime":
+				self.debug("carrier_max_time timed out: disabling carrier_detection for %d seconds", self.carrier.waittime)
+			else: self.debug("carrier_tail_time reached")
+			self.set_carrier_state(state)
 
-		#if self.ptt.get():
 		peerfd.write(buffer)
 		peerfd.flush()
 			
@@ -314,6 +708,81 @@ class Radio:
 
 		self.soundcard.write(buffer)
 
+	#####################################
+	def render_envelope(self, buffer, ctcss=None, txdelay=0.0, tailtime=0.0):
+		"""Build the whole outgoing audio for a transmission.
+		
+		Envelope is: <txdelay> seconds of preamble, audio buffer and <tailtime>
+		seconds of tail, padded to a fragment boundary. CTCSS (frequency, 
+		amplitude) is mixed over the whole envelope, so squelch opens during
+		the preamble. Return tuple (envelope, audio_start, audio_end) 
+		with offsets in bytes.
+		"""
+		frame = self.sample_width * self.audio_channels
+		preamble = "\x00" * (int(txdelay * self.samplerate) * frame)
+		tail = "\x00" * (int(tailtime * self.samplerate) * frame)
+		envelope = preamble + buffer + tail
+		fragmentsize = self.fragmentsize or self.buffer_size
+		envelope += "\x00" * (-len(envelope) % fragmentsize)
+		if ctcss and self.ctcss_generator:
+			freq, amplitude = ctcss
+			ctcss_buffer = self.ctcss_generator.generate(len(envelope), amplitude, freq)
+			envelope = audioop.add(envelope, ctcss_buffer, self.sample_width)
+		return envelope, len(preamble), len(preamble) + len(buffer)
+
+	#####################################
+	def get_output_delay(self):
+		"""Get bytes written to soundcard not played yet (None if unknown)"""
+		try: return self.soundcard.obufcount() * self.sample_width * self.audio_channels
+		except: return
+
+	#####################################
+	def transmit(self, buffer, ctcss=None, txdelay=0.0, tailtime=0.0, blocks=4, test_function=None):
+		"""Transmit audio with PTT control using a pre-rendered envelope.
+		
+		The envelope (see render_envelope) is written in blocks of <blocks> 
+		soundcard fragments. PTT is set on when the first sample of the 
+		envelope reaches the soundcard output (audio already queued in the 
+		soundcard is taken into account) and set off when the last sample of 
+		the tail has been played.
+		
+		test_function -- If defined, called before each block; if not succesful, 
+		abort transmission and return None. Otherwise, return audio bytes sent.
+		"""
+		if not self.soundcard: self.debug("soundcard not opened"); return
+		if not buffer: return 0
+		begin = time.time()
+		envelope, start, end = self.render_envelope(buffer, ctcss, txdelay, tailtime)
+		blocksize = (self.fragmentsize or self.buffer_size) * blocks
+		bytes_per_second = float(self.samplerate * self.sample_width * self.audio_channels)
+		queued = self.get_output_delay() or 0
+		ptt_ontime = self.clock.time() + queued / bytes_per_second
+		pttflag = False
+		written = 0
+		for offset in range(0, len(envelope), blocksize):
+			if test_function and not test_function():
+				self.debug("transmit: aborted at %0.2f seconds", offset / bytes_per_second)
+				if pttflag: self.set_ptt(False)
+				TRANSMIT_TIME.observe(time.time() - begin)
+				return
+			if not pttflag and self.clock.time() >= ptt_ontime:
+				self.set_ptt(True)
+				pttflag = True
+			self.soundcard.write(envelope[offset:offset+blocksize])
+			written = min(end, offset + blocksize) - start
+		if not pttflag: self.set_ptt(True)
+		
+		# Wait until the tail has been played (skip the padding at the end)
+		pending = self.get_output_delay()
+		if pending == None: self.flush_audio()
+		else:
+			pending -= len(envelope) - end - int(tailtime * self.samplerate) * \
+				self.sample_width * self.audio_channels
+			if pending > 0: self.clock.sleep(pending / bytes_per_second)
+		self.set_ptt(False)
+		TRANSMIT_TIME.observe(time.time() - begin)
+		return max(0, written)
+
 	#####################################
 	def flush_audio(self):
 		"""Flush buffer soundcard"""
@@ -323,10 +792,12 @@ class Radio:
 	def close(self):
 		"""Close radio interface"""
 		self.debug("closing radio interface")
+		self.stop_capture()
 		
 		if self.soundcard: 
 			self.soundcard.close()
 			self.soundcard = None
+			self.recorder = None
 			self.debug("soundcard closed")
 		else: self.debug("soundcard was not opened")
 		
@@ -335,5 +806,15 @@ class Radio:
 	###################################
 	def set_ptt(self, value):
 		if not self.ptt: return
-		self.debug("set PTT: %s" %self.onoff_dict[bool(value)])
+		self.debug("set PTT: %s", self.onoff_dict[bool(value)])
 		self.ptt.set(value)
+		if self.recorder and bool(value) != self.ptt_state: 
+			self.recorder.event(audiofile.PTT_EVENT, value)
+		now = self.clock.time()
+		if value and not self.ptt_state:
+			PTT_ACTIVATIONS.inc()
+			self.ptt_on_time = now
+		elif not value and self.ptt_state and self.ptt_on_time:
+			PTT_ON_TIME.inc(now - self.ptt_on_time)
+			self.ptt_on_time = None
+		self.ptt_state = bool(value)
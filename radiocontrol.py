@@ -19,18 +19,20 @@
 # Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
 
 # Standard Python modules
-import sys, os, optparse
+import sys, os, optparse, stat
 import time, select, re
+import struct, socket, errno
 
 # External phonepatch modules
 sys.path.append("/usr/lib/asterisk-phonepatch")
 import processcomm
 
-MODES = ("serial", "parallel", "command")
+MODES = ("serial", "parallel", "command", "mock", "socket")
 STATES = ("on", "off")
 ONOFF = {False: "off", True: "on"}
 
-DEFAULT_LINES = {"serial": ("rts", "dcd", "dtr"), "parallel": ("data", "busy", "strobe")}
+DEFAULT_LINES = {"serial": ("rts", "dcd", "dtr"), "parallel": ("data", "busy", "strobe"), \
+	"mock": ("rts", "dcd", "dtr")}
 
 SERIAL_LINES_OUT= {"rts": "setRTS", "dtr": "setDTR"}
 SERIAL_LINES_IN= {"dcd": "getCD", "cd": "getCD", "dsr": "getDSR", "cts": "getCTS"}
@@ -40,8 +42,11 @@ PARALLEL_LINES_OUT= {"data": "setData", "strobe": "setDataStrobe" , \
 PARALLEL_LINES_IN= {"ack": "getInAcknowledge", "busy": "getInBusy", 
 	"paperout": "getInPaperOut", "select": "getInSelect", "error": "getInError"}
 
-LINES_IN = {"serial": SERIAL_LINES_IN, "parallel": PARALLEL_LINES_IN}
-LINES_OUT = {"serial": SERIAL_LINES_OUT, "parallel": PARALLEL_LINES_OUT}
+LINES_IN = {"serial": SERIAL_LINES_IN, "parallel": PARALLEL_LINES_IN, "mock": SERIAL_LINES_IN}
+LINES_OUT = {"serial": SERIAL_LINES_OUT, "parallel": PARALLEL_LINES_OUT, "mock": SERIAL_LINES_OUT}
+
+# Line profiles: levels for output lines not used as PTT or power, applied along with any line change
+LINE_PROFILES = {"none": {}, "rigblaster": {"dtr": 0, "rts": 0}}
 
 ###########################
 def debug(text, verbose=True, exit=None):
@@ -52,36 +57,235 @@ def debug(text, verbose=True, exit=None):
 	if exit != None: 
 		sys.exit(exit)
 
+###################################
+###################################
+class SerialLines:
+	"""Serial port modem lines. All output lines are changed with one TIOCMSET
+	ioctl, and input lines are read with one TIOCMGET"""
+	###################################
+	def __init__(self, device):
+		import serial, termios
+		self.serial = serial.Serial(device)
+		self.outputs = {"rts": termios.TIOCM_RTS, "dtr": termios.TIOCM_DTR}
+		self.inputs = {"dcd": termios.TIOCM_CAR, "cd": termios.TIOCM_CAR, \
+			"dsr": termios.TIOCM_DSR, "cts": termios.TIOCM_CTS}
+		self.ioctls = 0
+		try: self.bits = self.ioctl(termios.TIOCMGET)
+		except IOError: self.bits = None
+
+	###################################
+	def ioctl(self, request, bits=0):
+		import fcntl
+		self.ioctls += 1
+		value = fcntl.ioctl(self.serial.fileno(), request, struct.pack("I", bits))
+		return struct.unpack("I", value)[0]
+
+	###################################
+	def set_lines(self, lines):
+		"""Set output lines (dictionary linename: level)"""
+		if self.bits == None:
+			# No modem ioctls for this device: use pyserial methods
+			for name, level in lines.items():
+				getattr(self.serial, SERIAL_LINES_OUT[name])(level)
+			return
+		import termios
+		bits = self.bits
+		for name, level in lines.items():
+			if level: bits |= self.outputs[name]
+			else: bits &= ~self.outputs[name]
+		self.ioctl(termios.TIOCMSET, bits)
+		self.bits = bits
+
+	###################################
+	def get_line(self, name):
+		if self.bits == None:
+			return getattr(self.serial, SERIAL_LINES_IN[name])()
+		import termios
+		return bool(self.ioctl(termios.TIOCMGET) & self.inputs[name])
+
+	###################################
+	def close(self):
+		self.serial.close()
+
+###################################
+###################################
+class ParallelLines:
+	"""Parallel port lines (changed one by one, pyparallel has no batch access)"""
+	###################################
+	def __init__(self, device):
+		import parallel
+		self.parallel = parallel.Parallel(device)
+	
+	###################################
+	def set_lines(self, lines):
+		for name, level in lines.items():
+			getattr(self.parallel, PARALLEL_LINES_OUT[name])(level)
+
+	###################################
+	def get_line(self, name):
+		return getattr(self.parallel, PARALLEL_LINES_IN[name])()
+
+	###################################
+	def close(self):
+		del self.parallel
+
+###################################
+###################################
+class MockLines:
+	"""Lines backend for tests: output changes are recorded in <history> 
+	(one entry per device access) and input lines are set with set_input()"""
+	###################################
+	def __init__(self, device=None):
+		self.device = device
+		self.outputs = {}
+		self.inputs = {}
+		self.history = []
+
+	###################################
+	def set_lines(self, lines):
+		self.history.append(dict(lines))
+		self.outputs.update(lines)
+
+	###################################
+	def get_line(self, name):
+		return self.inputs.get(name, False)
+
+	###################################
+	def set_input(self, name, level):
+		self.inputs[name] = bool(level)
+
+	###################################
+	def close(self):
+		pass
+
+LINE_BACKENDS = {"serial": SerialLines, "parallel": ParallelLines, "mock": MockLines}
+
+###################################
+###################################
+class LineController:
+	"""Cache the state of output lines and apply only the changes, all of them
+	in one backend access. Profile levels are applied along with every change"""
+	###################################
+	def __init__(self, backend, profile=None):
+		self.backend = backend
+		self.profile = profile or {}
+		self.state = {}
+
+	###################################
+	def set(self, lines):
+		"""Set output lines (dictionary linename: level). Return True if 
+		any line changed its state"""
+		levels = dict(self.profile)
+		levels.update(lines)
+		changes = {}
+		for name, level in levels.items():
+			level = int(bool(level))
+			if self.state.get(name) != level: changes[name] = level
+		if not changes: return False
+		self.backend.set_lines(changes)
+		self.state.update(changes)
+		return True
+
+	###################################
+	def get(self, name):
+		return self.backend.get_line(name)
+
+	###################################
+	def close(self):
+		self.backend.close()
+
+###################################
+###################################
+class SocketClient:
+	"""Client for a ControlServer (see radiocontrol --listen). Commands wait 
+	for their response, while carrier-detection state is pushed by the server"""
+	###################################
+	def __init__(self, address, timeout=2.0):
+		family, sockaddr = parse_address(address)
+		self.socket = socket.socket(family, socket.SOCK_STREAM)
+		self.socket.connect(sockaddr)
+		self.timeout = timeout
+		self.input = ""
+		self.carrier = None
+		self.request("subscribe carrier")
+
+	###################################
+	def readlines(self, timeout):
+		"""Read available lines (waiting up to timeout), return non-notification lines"""
+		lines = []
+		while 1:
+			retsel = select.select([self.socket], [], [], timeout)
+			if not retsel[0]: break
+			data = self.socket.recv(4096)
+			if not data: raise IOError, "Control server closed the connection"
+			self.input += data
+			timeout = 0
+		received = self.input.split("\n")
+		self.input = received.pop()
+		for line in received:
+			if line.find("carrier: ") == 0: self.carrier = bool(int(line.split(":")[1]))
+			elif line: lines.append(line)
+		return lines
+
+	###################################
+	def request(self, command):
+		"""Send a command and return its response"""
+		self.socket.sendall(command + "\n")
+		maxtime = time.time() + self.timeout
+		while time.time() < maxtime:
+			lines = self.readlines(maxtime - time.time())
+			if lines: return lines[0]
+		raise IOError, "No response from control server: %s" %command
+
+	###################################
+	def set_ptt(self, state):
+		response = self.request("set ptt %s" %ONOFF[bool(state)])
+		if response.find("busy:") == 0:
+			raise IOError, "PTT is owned by another control server client"
+		if response.find("done:") != 0:
+			raise IOError, "Control server error: %s" %response
+
+	###################################
+	def get_carrier(self):
+		"""Return carrier state pushed by the server (waits for the first 
+		push up to timeout, False if none arrives)"""
+		self.readlines(0)
+		maxtime = time.time() + self.timeout
+		while self.carrier == None and time.time() < maxtime:
+			self.readlines(maxtime - time.time())
+		return bool(self.carrier)
+
+	###################################
+	def close(self):
+		self.socket.close()
+
 ###################################
 ###################################
 class RadioControl:
 	"""Control PTT (Push-to-Talk) and carrier detection through the serial port, the
-	parallel port, or a external command"""
+	parallel port, a external command or a control server socket"""
 	###################################
-	def __init__(self, mode, device, device_lines=None, command_options=None, on_open_wait=0.05):
+	def __init__(self, mode, device, device_lines=None, command_options=None, on_open_wait=0.05, \
+			profile="none"):
 		"""Returns a RadioControl instance.
 		
-		mode -- "serial" | "parallel" | "command"
-		device -- serial/parallel device or path to command
+		mode -- "serial" | "parallel" | "command" | "mock" | "socket"
+		device -- serial/parallel device, path to command or control server address
 		device-options -- serial/parallel options for lines: tuple (ptt, carrierdetection, power)
 		command_options -- in command mode, enter a string: "PttOn, PttOff, GetCarrier, GetCarrierResponseRegExp"
+		profile -- line profile name (see LINE_PROFILES) for serial/parallel/mock modes
 		"""
 		if mode not in MODES:
 			raise NameError, "Mode error: %s. Available modes: %s" %(mode, ", ".join(list(MODES)))
+		if profile not in LINE_PROFILES:
+			raise NameError, "Profile error: %s. Available profiles: %s" %(profile, ", ".join(LINE_PROFILES.keys()))
 		self.mode = mode
 		self.device = device
 		self.device_lines = {}
 		self.command_options = command_options
-		if mode == "serial":
-			import serial
-			self.serial = serial.Serial(device)
-			#self.serial.setRTS(True)
-			#self.serial.setDTR(True)
-			
-		elif mode == "parallel":
-			import parallel
-			self.parallel = parallel.Parallel(device)
-		elif mode == "command":
+		self.ptt = None
+		self.lines = None
+		if mode == "command":
 			if self.command_options["get_carrier"]:
 				try: self.onstring = re.findall("\((.*)\)", self.command_options["get_carrier_response"])[0].split("|")[0]
 				except: raise ValueError, "Syntax error on get_carrier_response: %s" %self.command_options["get_carrier_response"]
@@ -93,34 +297,41 @@ class RadioControl:
 				self.command = None
 			if not self.command:
 				raise IOError, "Command could not be started: %s" %self.device
-
-		if mode == "serial" or mode == "parallel":
-			if mode == "serial": handler = self.serial
-			else: handler = self.parallel
+		elif mode == "socket":
+			try: self.client = SocketClient(device)
+			except socket.error, detail: raise IOError, "Cannot connect to control server %s: %s" %(device, detail)
+		else:
 			if not device_lines:
 				device_lines = DEFAULT_LINES[mode]
 
 			for index, line in enumerate(["ptt", "carrier", "power"]):
 				if index == 0 or index == 2: lines = LINES_OUT[mode]
 				else: lines = LINES_IN[mode]
-				lines[""] = None
-				if index >= len(device_lines): 
-					function = None
-				else:
-					linename = device_lines[index]
-					negate = False
-					if linename and linename[0] == "-": 
-						linename = linename[1:]
-						negate = True
-					try: function = lines[linename]
-					except: raise ValueError, "Error on device_line: %s" %device_lines[index]
-				if function: method = getattr(handler, function)
-				else: self.device_lines[line] = None; continue
-				if method in [x[0] for x in self.device_lines.values()]:
+				if index >= len(device_lines) or not device_lines[index]: 
+					self.device_lines[line] = None
+					continue
+				linename = device_lines[index]
+				negate = False
+				if linename[0] == "-": 
+					linename = linename[1:]
+					negate = True
+				if linename not in lines:
+					raise ValueError, "Error on device_line: %s" %device_lines[index]
+				if linename in [x[0] for x in self.device_lines.values() if x]:
 					raise ValueError, "Line already used: %s" %linename
-				self.device_lines[line] = (method, negate)
+				self.device_lines[line] = (linename, negate)
+				
+			# Profile does not apply to the PTT and power lines.
+			# Only lines the port has are used (rigblaster lines are serial)
+			profile = dict([(name, level) for name, level in LINE_PROFILES[profile].items() \
+				if name in LINES_OUT[mode]])
+			for line in ("ptt", "power"):
+				if self.device_lines[line] and self.device_lines[line][0] in profile:
+					del profile[self.device_lines[line][0]]
+			self.lines = LineController(LINE_BACKENDS[mode](device), profile)
 			if self.device_lines["power"]:
-				self.device_lines["power"][0](1^self.device_lines["power"][1])
+				linename, negate = self.device_lines["power"]
+				self.lines.set({linename: 1^negate})
 			time.sleep(on_open_wait)
 			self.set_ptt(False)
 
@@ -137,9 +348,12 @@ class RadioControl:
 		"""Get carrier detection state"""
 		if self.mode == None: 
 			raise IOError, "RadioControl is not opened"
-		if self.mode == "serial" or self.mode == "parallel":
+		if self.lines:
 			if self.device_lines["carrier"]:
-				return self.device_lines["carrier"][0]() ^ self.device_lines["carrier"][1]
+				linename, negate = self.device_lines["carrier"]
+				return self.lines.get(linename) ^ negate
+		elif self.mode == "socket":
+			return self.client.get_carrier()
 		elif self.mode == "command":
 			self.command.write(self.command_options["get_carrier"] + "\n")
 			self.command.flush()
@@ -156,34 +370,35 @@ class RadioControl:
 		
 	###################################
 	def set_ptt(self, state, timeout = 0.5):
-		"""Set PTT state (True/False)"""
-		#The following 2 lines is for the Rigblaster.  Added by Stephen Hamilton
-		self.serial.setDTR(False)
-		self.serial.setRTS(False)
+		"""Set PTT state (True/False). Device is only accessed on state changes"""
 		if self.mode == None: 
 			raise IOError, "RadioControl is not opened"
 		state = int(bool(state))
-		self.ptt = state
-		if self.mode == "serial" or self.mode == "parallel":
+		if state == self.ptt: return
+		if self.lines:
+			changes = {}
 			if self.device_lines["ptt"]:
-				self.device_lines["ptt"][0](state ^ self.device_lines["ptt"][1])
-				#debug("Test")
-				#self.serial.close()
+				linename, negate = self.device_lines["ptt"]
+				changes[linename] = state ^ negate
+			self.lines.set(changes)
 		elif self.mode == "command":
 			key = "set_ptt_%s" %(ONOFF[state])
 			self.command.write(self.command_options[key]  + "\n")
 			self.command.flush()
+		elif self.mode == "socket":
+			self.client.set_ptt(state)
+		self.ptt = state
 		
 	###################################
 	def close(self):
 		if self.mode == None: 
 			raise IOError, "RadioControl is not opened"
-		if self.mode == "serial":
-			self.serial.close()
-		elif self.mode == "parallel":
-			del self.parallel
+		if self.lines:
+			self.lines.close()
 		elif self.mode == "command":
 			self.command.close()
+		elif self.mode == "socket":
+			self.client.close()
 		self.mode = None
 
 ###################################
@@ -191,6 +406,21 @@ def output(text):
 	sys.stdout.write(text + "\n")
 	sys.stdout.flush()
 
+###################################
+def execute(radio, line):
+	"""Run a server command and return response (None for void commands)"""
+	if line.find("set ptt ") == 0:
+		if line == "set ptt on": radio.set_ptt(True)
+		elif line == "set ptt off": radio.set_ptt(False)
+		else: return "syntax error: %s" %line
+		return "done: %s" %line
+	elif line == "get carrier":
+		ret = radio.get_carrier()
+		return "get carrier: %d" %int(ret)
+	elif line == "":
+		return
+	return "unknown command: %s" %line
+
 ###################################
 def server(radio, verbose):
 	"""Allowed commands:
@@ -201,26 +431,190 @@ def server(radio, verbose):
 	while 1:
 		line = sys.stdin.readline()
 		if not line: break
-		line = line.strip()
-		if line.find("set ptt ") == 0:
-			if line == "set ptt on": radio.set_ptt(True)
-			elif line == "set ptt off": radio.set_ptt(False)
-			else: output("syntax error: %s" %line); continue
-			output("done: %s" %line)
-		elif line == "get carrier":
-			ret = radio.get_carrier()
-			output("get carrier: %d" %int(ret))
-		elif line == "":
-			continue
-		else: output("unknown command: %s" %line)
+		response = execute(radio, line.strip())
+		if response: output(response)
 	debug("end of server mode", verbose)
 
+###################################
+def parse_address(address):
+	"""Get (family, address) for a socket address string: "unix:path", 
+	"tcp:port" or "tcp:host:port" (host defaults to localhost)"""
+	import socket
+	fields = address.split(":")
+	if fields[0] == "unix" and len(fields) >= 2:
+		return socket.AF_UNIX, ":".join(fields[1:])
+	elif fields[0] == "tcp" and len(fields) in (2, 3):
+		try: port = int(fields[-1])
+		except ValueError: raise ValueError, "Invalid port in socket address: %s" %address
+		if len(fields) == 3: return socket.AF_INET, (fields[1], port)
+		return socket.AF_INET, ("127.0.0.1", port)
+	raise ValueError, "Invalid socket address (unix:path | tcp:[host:]port): %s" %address
+
+###################################
+def remove_socket(path):
+	"""Remove a stale unix socket (other kind of files are left alone)"""
+	try: mode = os.stat(path).st_mode
+	except OSError: return
+	if stat.S_ISSOCK(mode): os.unlink(path)
+
+###################################
+###################################
+class ControlServer:
+	"""Share a RadioControl between several clients through a unix or TCP socket.
+
+	Commands are the same as the stdin server, plus:
+	
+	get ptt -- Get PTT state. Returns: "get ptt: 0|1"
+	subscribe carrier -- Push "carrier: 0|1" lines when carrier-detection changes
+	unsubscribe carrier -- Stop carrier-detection notifications
+	
+	Clients may pipeline commands, responses are sent in the same order.
+	PTT is owned by the client that set it on until it sets it off (or 
+	disconnects), other clients get "busy: set ptt on" meanwhile.
+	"""
+	###################################
+	def __init__(self, radio, address, pollingtime=0.5, verbose=False):
+		self.radio = radio
+		self.address = address
+		self.pollingtime = pollingtime
+		self.verbose = verbose
+		family, sockaddr = parse_address(address)
+		if family == socket.AF_UNIX: remove_socket(sockaddr)
+		self.socket = socket.socket(family, socket.SOCK_STREAM)
+		if family == socket.AF_INET:
+			self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		self.socket.bind(sockaddr)
+		self.socket.listen(5)
+		self.sockaddr = sockaddr
+		self.family = family
+		self.clients = {}
+		self.ptt_owner = None
+		self.carrier = None
+		self.next_poll = 0
+
+	###################################
+	def serve_forever(self):
+		debug("control server listening on %s" %self.address, self.verbose)
+		while 1:
+			self.poll_carrier()
+			readers = [self.socket] + [client["socket"] for client in self.clients.values()]
+			writers = [client["socket"] for client in self.clients.values() if client["output"]]
+			timeout = max(0, self.next_poll - time.time())
+			try: ready_read, ready_write, error = select.select(readers, writers, [], timeout)
+			except select.error, (nerror, detail):
+				if nerror == errno.EINTR: continue
+				raise
+			for sock in ready_read:
+				if sock is self.socket: self.accept()
+				else: self.receive(sock.fileno())
+			for sock in ready_write:
+				if sock.fileno() in self.clients: self.send(sock.fileno())
+
+	###################################
+	def accept(self):
+		sock, address = self.socket.accept()
+		sock.setblocking(0)
+		self.clients[sock.fileno()] = {"socket": sock, "input": "", "output": "", "carrier": False}
+		debug("control server: client connected (%d clients)" %len(self.clients), self.verbose)
+
+	###################################
+	def disconnect(self, fd):
+		client = self.clients.pop(fd)
+		try: client["socket"].close()
+		except: pass
+		if self.ptt_owner == fd:
+			debug("control server: PTT owner disconnected, PTT set off", self.verbose)
+			try: self.radio.set_ptt(False)
+			except (IOError, OSError), detail:
+				debug("control server: cannot set PTT off: %s" %detail, self.verbose)
+			self.ptt_owner = None
+		debug("control server: client disconnected (%d clients)" %len(self.clients), self.verbose)
+
+	###################################
+	def receive(self, fd):
+		client = self.clients[fd]
+		try: data = client["socket"].recv(4096)
+		except socket.error: data = ""
+		if not data: self.disconnect(fd); return
+		client["input"] += data
+		lines = client["input"].split("\n")
+		client["input"] = lines.pop()
+		for line in lines:
+			response = self.execute(fd, line.strip())
+			if response: client["output"] += response + "\n"
+		if client["output"]: self.send(fd)
+
+	###################################
+	def send(self, fd):
+		client = self.clients[fd]
+		try: sent = client["socket"].send(client["output"])
+		except socket.error, (nerror, detail):
+			if nerror == errno.EAGAIN: return
+			self.disconnect(fd); return
+		client["output"] = client["output"][sent:]
+
+	###################################
+	def execute(self, fd, line):
+		"""Run a command for client fd and return its response (an error
+		response if the device fails, so other clients are still served)"""
+		try: return self.run_command(fd, line)
+		except (IOError, OSError), detail:
+			debug("control server: device error on %s: %s" %(line, detail), self.verbose)
+			return "error: %s: %s" %(line, detail)
+
+	###################################
+	def run_command(self, fd, line):
+		if line in ("set ptt on", "set ptt off"):
+			state = (line == "set ptt on")
+			if self.ptt_owner not in (None, fd): 
+				# A client which does not own the PTT is already off
+				if state: return "busy: %s" %line
+				return "done: %s" %line
+			self.radio.set_ptt(state)
+			if state: self.ptt_owner = fd
+			else: self.ptt_owner = None
+			return "done: %s" %line
+		elif line == "subscribe carrier" or line == "unsubscribe carrier":
+			self.clients[fd]["carrier"] = (line == "subscribe carrier")
+			if self.carrier == None: self.next_poll = 0
+			else: self.clients[fd]["output"] += "carrier: %d\n" %int(self.carrier)
+			return "done: %s" %line
+		elif line == "get ptt":
+			return "get ptt: %d" %int(bool(self.radio.get_ptt()))
+		return execute(self.radio, line)
+
+	###################################
+	def poll_carrier(self):
+		"""Poll carrier-detection (only if there are subscribers) and push changes"""
+		subscribers = [client for client in self.clients.values() if client["carrier"]]
+		if not subscribers: 
+			self.next_poll = time.time() + self.pollingtime
+			self.carrier = None
+			return
+		now = time.time()
+		if now < self.next_poll: return
+		self.next_poll = now + self.pollingtime
+		try: carrier = bool(self.radio.get_carrier())
+		except (IOError, OSError): debug("control server: cannot get carrier state", self.verbose); return
+		if carrier == self.carrier: return
+		self.carrier = carrier
+		for client in subscribers:
+			client["output"] += "carrier: %d\n" %int(carrier)
+
+	###################################
+	def close(self):
+		for fd in self.clients.keys(): self.disconnect(fd)
+		self.socket.close()
+		if self.family == socket.AF_UNIX:
+			try: os.unlink(self.sockaddr)
+			except OSError: pass
+
 ###################################
 def get_lines_description():
 	output = ""
 	SERIAL_LINES={"input": SERIAL_LINES_IN, "output": SERIAL_LINES_OUT}
 	PARALLEL_LINES={"input": PARALLEL_LINES_IN, "output": PARALLEL_LINES_OUT}
-	DEVICES={"serial": SERIAL_LINES, "paralell": PARALLEL_LINES}
+	DEVICES={"serial": SERIAL_LINES, "paralell": PARALLEL_LINES, "mock": SERIAL_LINES}
 
 	for device, lines in DEVICES.items():
 		output += "    device mode: %s\n" %device
@@ -253,7 +647,14 @@ Server mode accepts the following commands:
 
 set ptt on --  Set PTT on
 set ptt off --  Set PTT off
-get carrier --  Get Carrier-Detection state. Returns: "get carrier: 0|1" """ %get_lines_description()
+get carrier --  Get Carrier-Detection state. Returns: "get carrier: 0|1"
+
+With --listen, server mode accepts several clients on a unix or TCP socket, 
+and also these commands:
+
+get ptt --  Get PTT state. Returns: "get ptt: 0|1"
+subscribe carrier --  Push "carrier: 0|1" lines on carrier-detection changes
+unsubscribe carrier --  Stop carrier-detection notifications """ %get_lines_description()
 	
 	optpar = optparse.OptionParser(usage)
 	optpar.add_option('-v', '--verbose', dest='verbose', default = False, action='store_true', help = 'Be verbose')
@@ -263,7 +664,10 @@ get carrier --  Get Carrier-Detection state. Returns: "get carrier: 0|1" """ %ge
 	optpar.add_option('-c', '--carrier-detection',  dest='carrier',  default = False, action = 'store_true', help = 'Get carrier-detection state')
 	optpar.add_option('-w', '--wait-time',  dest='wait', type = "float", default = None, metavar = 'SECONDS', help = 'On PTT mode, time to wait before exit. On Carrier detection, time before reading')
 	optpar.add_option('-s', '--server',  dest='server',  default = False, action = 'store_true', help = 'Start in server mode')
+	optpar.add_option('-l', '--listen',  dest='listen', type = "string", default = "", metavar = 'ADDRESS', help = 'Server mode on a socket: unix:path | tcp:[host:]port')
+	optpar.add_option('-t', '--polling-time',  dest='pollingtime', type = "float", default = 0.5, metavar = 'SECONDS', help = 'Carrier-detection polling time for socket server mode')
 	optpar.add_option('-o', '--command-options',  dest='command_options', type = "string", default = "", metavar = 'OPTIONS', help = 'Strings for command mode: ptt-on,ptt-off,get-carrier,get-carrier-response-regexp')
+	optpar.add_option('', '--profile',  dest='profile', type = "string", default = "none", metavar = 'NAME', help = 'Line profile: %s' %" | ".join(LINE_PROFILES.keys()))
 	optpar.add_option('', '--device-lines',  dest='device_lines', type = "string", default = "", metavar = 'OPTIONS', help = 'Strings for serial/parallel lines (start with "-" to negate line): ptt,get-carrier,carrier-power')
 	
 	options, args = optpar.parse_args()
@@ -279,6 +683,9 @@ get carrier --  Get Carrier-Detection state. Returns: "get carrier: 0|1" """ %ge
 		debug("\nSupported PTT states: %s" % ", ".join(list(STATES)), exit = 1)
 	if not options.device:
 		if options.mode == "serial": options.device = "/dev/ttyS0"
+		elif options.mode == "socket":
+			optpar.print_help()
+			debug("You must specify a control server address (in device option) for socket mode", exit = 1)
 		elif options.mode == "serial":  options.device = "/dev/parport0"
 		elif options.mode == "command": 
 			optpar.print_help()
@@ -308,10 +715,21 @@ get carrier --  Get Carrier-Detection state. Returns: "get carrier: 0|1" """ %ge
 	if device_lines: debug("options - device-lines: %s" %device_lines, verbose)
 	if options.wait != None: debug("options - wait time: %s" %str(options.wait), verbose)
 	debug("opening device: %s" %options.device, verbose)
-	rc = RadioControl(options.mode, options.device, device_lines, command_options)
+	if options.profile not in LINE_PROFILES:
+		debug("Supported line profiles: %s" %", ".join(LINE_PROFILES.keys()), exit = 1)
+	rc = RadioControl(options.mode, options.device, device_lines, command_options, profile=options.profile)
 	debug("device opened: %s" %options.device, verbose)
 
-	if options.server: 
+	if options.server and options.listen:
+		try: control = ControlServer(rc, options.listen, options.pollingtime, verbose)
+		except (ValueError, socket.error), detail:
+			rc.close()
+			debug("cannot start control server: %s" %str(detail), exit = 1)
+		try: control.serve_forever()
+		except KeyboardInterrupt: pass
+		control.close()
+		rc.close(); sys.exit(0)
+	elif options.server: 
 		server(rc, verbose)
 		rc.close(); sys.exit(0)
 
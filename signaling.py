@@ -0,0 +1,255 @@
+#!/usr/bin/python
+
+# This file is part of asterisk-phonepatch
+
+# Copyright (C) 2011 Stephen Hamilton
+#
+# Asterisk-phonepatch is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+"""Inband signaling test transmitter.
+
+Render whole APRStt sequences (callsign, symbol, checksum and terminator)
+to PCM audio from precomputed tone tables (see dtmf.Generator), with
+timing jitter, twist and noise, and write them to a file or transmit them
+through a radio.Radio for over-the-air tests of remote nodes."""
+
+# Standard Python modules
+import os, sys, time, math
+import random, optparse
+import numarray
+
+# External phonepatch modules
+import dtmf, touchtone
+
+__version__ = "$Revision: 0.1 $"
+__author__ = "Stephen Hamilton <stephenshamilton@gmail.com>"
+__depends__ = ['Numeric-Extension', 'Python-2.4']
+__copyright__ = """Copyright (C) 2011 Stephen Hamilton.
+This code is distributed under the terms of the GNU General Public License."""
+
+# Length of the precomputed noise table (seconds)
+NOISE_TIME = 2.0
+
+CALLSIGN_CHARS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+# Sample format used by radio.Radio
+RADIO_SAMPLEFORMAT = "S16_LE"
+
+###############################
+def random_callsign(rng):
+	"""Return a random callsign: 1-2 letters, a digit and 1-3 letters"""
+	prefix = "".join([rng.choice(CALLSIGN_CHARS) for x in range(rng.randint(1, 2))])
+	suffix = "".join([rng.choice(CALLSIGN_CHARS) for x in range(rng.randint(1, 3))])
+	return prefix + rng.choice("0123456789") + suffix
+
+###############################
+###############################
+class SequenceGenerator:
+	"""Render DTMF key sequences to audio.
+
+	Each tone and gap lasts tonetime/waittime seconds changed by a random
+	factor within +/-jitter. Twist (dB of high tone relative to the low one)
+	is twist +/- twist_spread, drawn once per sequence. If snr (dB, relative
+	to the tones) is given, gaussian noise is added to the whole sequence"""
+	###############################
+	def __init__(self, samplerate=8000, sampleformat="S16_LE", tonetime=0.1, waittime=0.1, \
+			gain=0.5, jitter=0.0, twist=0.0, twist_spread=0.0, snr=None, seed=None):
+		self.generator = dtmf.Generator(samplerate = samplerate, sampleformat = sampleformat)
+		self.samplerate = samplerate
+		self.tonetime = tonetime
+		self.waittime = waittime
+		self.gain = gain
+		self.jitter = jitter
+		self.twist = twist
+		self.twist_spread = twist_spread
+		self.snr = snr
+		self.rng = random.Random(seed)
+		self.noise = None
+
+	###############################
+	def get_samples(self, seconds):
+		"""Return samples for a duration with jitter applied"""
+		if self.jitter: seconds *= self.rng.uniform(1.0 - self.jitter, 1.0 + self.jitter)
+		return max(1, int(seconds * self.samplerate))
+
+	###############################
+	def get_noise(self, nsamples):
+		"""Return nsamples of unit gaussian noise, sliced (at a random
+		offset) from a table computed once"""
+		if self.noise is None:
+			gauss = self.rng.gauss
+			size = int(NOISE_TIME * self.samplerate)
+			self.noise = numarray.array([gauss(0.0, 1.0) for x in range(size)], type=numarray.Float64)
+		size = len(self.noise)
+		offset = self.rng.randrange(size)
+		blocks = []
+		while nsamples > 0:
+			block = self.noise[offset:offset+nsamples]
+			blocks.append(block)
+			nsamples -= len(block)
+			offset = 0
+		return numarray.concatenate(blocks)
+
+	###############################
+	def render_keys(self, keys, lead=0.0, trail=0.0):
+		"""Return audio for a sequence of DTMF keys (with lead/trail silence)"""
+		twist = self.twist
+		if self.twist_spread: twist += self.rng.uniform(-self.twist_spread, self.twist_spread)
+		zeros = numarray.zeros
+		blocks = [zeros(int(lead * self.samplerate), type=numarray.Float64)]
+		for index, key in enumerate(keys):
+			if index: blocks.append(zeros(self.get_samples(self.waittime), type=numarray.Float64))
+			blocks.append(self.generator.key_samples(key, self.get_samples(self.tonetime), 0, self.gain, twist))
+		blocks.append(zeros(int(trail * self.samplerate), type=numarray.Float64))
+		samples = numarray.concatenate(blocks)
+		if self.snr != None:
+			high_gain = 10.0 ** (twist / 20.0)
+			tone_rms = self.gain * math.sqrt((1.0 + high_gain**2) / 2.0) / (1.0 + high_gain)
+			sigma = tone_rms / (10.0 ** (self.snr / 20.0))
+			samples = samples + sigma * self.get_noise(len(samples))
+		return self.generator.to_audio(samples)
+
+	###############################
+	def render_number(self, callsign, symbol="0", terminator="#", lead=0.0, trail=0.0):
+		"""Return tuple (keys, audio) of a APRStt callsign number"""
+		keys = touchtone.encode_number(callsign, symbol) + terminator
+		return keys, self.render_keys(keys, lead, trail)
+
+###############################
+###############################
+class Ptt:
+	"""PTT parameters for radio.Radio from a radiocontrol.RadioControl"""
+	###############################
+	def __init__(self, radio_control):
+		self.set = radio_control.set_ptt
+		self.get = radio_control.get_ptt
+		self.threshold = self.tailtime = self.maxtime = self.waittime = 0
+
+###############################
+###############################
+class Transmitter:
+	"""Transmit rendered sequences through a radio.Radio"""
+	###############################
+	def __init__(self, radio, ctcss=None, txdelay=0.0, tailtime=0.0):
+		self.radio = radio
+		self.ctcss = ctcss
+		self.txdelay = txdelay
+		self.tailtime = tailtime
+		self.sent = 0
+		self.seconds = 0.0
+
+	###############################
+	def transmit(self, audio):
+		"""Transmit audio (PTT on during the transmission)"""
+		begin = time.time()
+		written = self.radio.transmit(audio, self.ctcss, self.txdelay, self.tailtime)
+		self.seconds += time.time() - begin
+		self.sent += 1
+		return written
+
+	###############################
+	def stream(self, sequences, interval=0.0):
+		"""Transmit audio buffers from an iterable, waiting interval seconds
+		between transmissions. Return number of transmissions"""
+		count = 0
+		for audio in sequences:
+			if count and interval: time.sleep(interval)
+			self.transmit(audio)
+			count += 1
+		return count
+
+###############################
+def open_radio(device, samplerate, control=None, ctcss=None):
+	"""Open a radio.Radio with optional PTT radio control ("mode:device")"""
+	import radio
+	ptt = None
+	if control:
+		import radiocontrol
+		try: mode, controldevice = control.split(":", 1)
+		except ValueError: raise ValueError, "Syntax error on radio control: %s" %control
+		ptt = Ptt(radiocontrol.RadioControl(mode, controldevice))
+	return radio.Radio(device, samplerate, ptt, None, ctcss_mintime=ctcss and 0.5)
+
+###############################
+def main():
+	usage = """
+	signaling.py [options] [CALLSIGN ...]: APRStt signaling test transmitter
+
+	Render APRStt numbers for the given (or --random) callsigns and write
+	them as raw audio to the output file or transmit them with --radio"""
+
+	parser = optparse.OptionParser(usage)
+	parser.add_option('-s', '--samplerate', dest='samplerate', default=8000, metavar='SPS', type='int', help='Set sampling rate')
+	parser.add_option('-f', '--sampleformat', dest='sampleformat', default="S16_LE", metavar='AFMT_FORMAT', type='string', help='Set audio sample format (only S16_LE with --radio)')
+	parser.add_option('-t', '--tonetime', dest='tonetime', default=0.1, metavar='SECONDS', type='float', help='Tone duration')
+	parser.add_option('-w', '--waittime', dest='waittime', default=0.1, metavar='SECONDS', type='float', help='Pause between tones')
+	parser.add_option('-g', '--gain', dest='gain', default=0.5, metavar='VALUE', type='float', help='Tone gain (1.0 for full scale)')
+	parser.add_option('-j', '--jitter', dest='jitter', default=0.0, metavar='FRACTION', type='float', help='Timing jitter of tones and pauses (0.2 for +/-20%)')
+	parser.add_option('-T', '--twist', dest='twist', default=0.0, metavar='DB', type='float', help='Level of high tone relative to low tone')
+	parser.add_option('', '--twist-spread', dest='twist_spread', default=0.0, metavar='DB', type='float', help='Random twist variation per sequence')
+	parser.add_option('-n', '--snr', dest='snr', default=None, metavar='DB', type='float', help='Add noise with this signal-to-noise ratio')
+	parser.add_option('-y', '--symbol', dest='symbol', default="0", metavar='KEY', type='string', help='Symbol key of APRStt numbers')
+	parser.add_option('-R', '--random', dest='random', default=0, metavar='COUNT', type='int', help='Number of random callsigns')
+	parser.add_option('-e', '--seed', dest='seed', default=None, metavar='NUMBER', type='int', help='Random seed')
+	parser.add_option('-i', '--interval', dest='interval', default=1.0, metavar='SECONDS', type='float', help='Silence (or wait when transmitting) between sequences')
+	parser.add_option('-o', '--output', dest='output', default="-", metavar='FILE', type='string', help='Raw audio output file ("-" for standard output)')
+	parser.add_option('-d', '--radio', dest='radio', default="", metavar='DEVICE', type='string', help='Transmit through radio soundcard device')
+	parser.add_option('-p', '--radio-control', dest='radio_control', default="", metavar='MODE:DEVICE', type='string', help='PTT radio control (serial, parallel, mock or socket)')
+	parser.add_option('-c', '--ctcss', dest='ctcss', default=None, metavar='FREQ', type='float', help='Transmit CTCSS tone')
+	parser.add_option('-v', '--verbose', dest='verbose', default=False, action='store_true', help='Print sequences to standard error')
+
+	options, callsigns = parser.parse_args()
+	if options.radio and options.sampleformat != RADIO_SAMPLEFORMAT:
+		parser.error("--radio only supports the %s sample format" %RADIO_SAMPLEFORMAT)
+	generator = SequenceGenerator(options.samplerate, options.sampleformat, options.tonetime, \
+		options.waittime, options.gain, options.jitter, options.twist, options.twist_spread, \
+		options.snr, options.seed)
+	rng = random.Random(options.seed)
+	callsigns += [random_callsign(rng) for x in range(options.random)]
+	if not callsigns:
+		parser.print_help()
+		sys.exit(1)
+
+	if options.radio:
+		ctcss = None
+		if options.ctcss: ctcss = (options.ctcss, 0.1)
+		radio = open_radio(options.radio, options.samplerate, options.radio_control, ctcss)
+		transmitter = Transmitter(radio, ctcss)
+		lead = trail = 0.0
+	else:
+		if options.output == "-": output = sys.stdout
+		else: output = open(options.output, "wb")
+		lead, trail = options.interval / 2.0, options.interval / 2.0
+
+	def sequences():
+		for callsign in callsigns:
+			try: keys, audio = generator.render_number(callsign, options.symbol, "#", lead, trail)
+			except ValueError, detail:
+				sys.stderr.write("%s: %s\n" %(callsign, detail))
+				continue
+			if options.verbose: sys.stderr.write("%s %s\n" %(callsign, keys))
+			yield audio
+
+	if options.radio:
+		try: transmitter.stream(sequences(), options.interval)
+		finally: radio.close()
+	else:
+		for audio in sequences(): output.write(audio)
+		output.close()
+	sys.exit(0)
+
+############################
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,239 @@
+#!/usr/bin/python
+
+# This file is part of asterisk-phonepatch
+
+# Copyright (C) 2011 Stephen Hamilton
+#
+# Asterisk-phonepatch is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+"""Fork-server supervisor for background daemons.
+
+The supervisor preloads modules and decoder tables, detaches once and
+forks one worker per section. Workers share the preloaded memory (copy on
+write). Workers that crash (non-zero exit code or killed by a signal) are
+restarted with exponential backoff. SIGHUP
+is forwarded to the workers (configuration reload), SIGTERM/SIGINT stop
+them and the supervisor."""
+
+# Standard Python modules
+import os, time, errno
+import signal, syslog, traceback
+
+# External phonepatch modules
+import daemonize, logger
+
+__version__ = "$Revision: 0.1 $"
+__author__ = "Stephen Hamilton <stephenshamilton@gmail.com>"
+__depends__ = ['Python-2.4']
+__copyright__ = """Copyright (C) 2011 Stephen Hamilton.
+This code is distributed under the terms of the GNU General Public License."""
+
+# Restart delay (doubled on each crash up to MAX_RESTART_DELAY), reset
+# when a worker has run for STABLE_TIME seconds
+RESTART_DELAY = 1.0
+MAX_RESTART_DELAY = 60.0
+STABLE_TIME = 60.0
+
+# Seconds given to workers to exit on SIGTERM before killing them
+STOP_TIMEOUT = 5.0
+
+# Maximum sleep of the supervisor loop (SIGCHLD wakes it earlier)
+POLL_TIME = 1.0
+
+###############################
+def exit_status(status):
+	"""Describe a waitpid status"""
+	if os.WIFSIGNALED(status): return "killed by signal %d" %os.WTERMSIG(status)
+	return "exit code %d" %os.WEXITSTATUS(status)
+
+###############################
+###############################
+class Worker:
+	###############################
+	def __init__(self, name):
+		self.name = name
+		self.pid = None
+		self.started = 0.0
+		self.delay = RESTART_DELAY
+		self.restart_time = 0.0
+		self.restarts = 0
+		self.finished = False
+
+###############################
+###############################
+class Supervisor:
+	"""Run run_worker(name) in a child process for each name, restarting
+	it when it crashes. Exit code 0 means a deliberate shutdown (the worker
+	is not restarted). preload() is called once before forking, and
+	cleanup(name) before each (re)start (to remove stale pidfiles)"""
+	###############################
+	def __init__(self, names, run_worker, pidfile=None, preload=None, cleanup=None, verbose=False):
+		self.workers = [Worker(name) for name in names]
+		self.run_worker = run_worker
+		self.pidfile = pidfile
+		self.preload = preload
+		self.cleanup = cleanup
+		self.logger = logger.Logger("supervisor", verbose)
+		self.stopping = False
+		self.pending_signals = []
+
+	###############################
+	def signal_handler(self, signum, frame):
+		if signum in (signal.SIGTERM, signal.SIGINT): self.stopping = True
+		elif signum == signal.SIGHUP: self.pending_signals.append(signum)
+
+	###############################
+	def set_signals(self, handler):
+		for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGCHLD):
+			if handler == signal.SIG_DFL: signal.signal(signum, signal.SIG_DFL)
+			# SIGCHLD only has to interrupt the loop sleep
+			elif signum == signal.SIGCHLD: signal.signal(signum, lambda signum, frame: None)
+			else: signal.signal(signum, handler)
+
+	###############################
+	def write_pidfile(self):
+		if not self.pidfile: return
+		fd = open(self.pidfile, "w")
+		fd.write(str(os.getpid()) + "\n")
+		fd.close()
+
+	###############################
+	def read_pidfile(self):
+		"""Return pid of a running supervisor (None if not running)"""
+		if not self.pidfile: return
+		try: pid = int(open(self.pidfile).readline().strip())
+		except (IOError, ValueError): return
+		try: os.kill(pid, 0)
+		except OSError, e:
+			if e.errno == errno.ESRCH: return
+		return pid
+
+	###############################
+	def delete_pidfile(self):
+		if not self.pidfile: return
+		try: os.unlink(self.pidfile)
+		except OSError, e:
+			if e.errno != errno.ENOENT: raise
+
+	###############################
+	def run(self, background=True):
+		"""Supervise workers until SIGTERM/SIGINT. Return exit code"""
+		pid = self.read_pidfile()
+		if pid:
+			self.logger.info("supervisor is already running with pid %d", pid)
+			return 1
+		if self.preload: self.preload()
+		if background:
+			daemonize.daemonize()
+			syslog.openlog("phonepatch", syslog.LOG_PID, syslog.LOG_DAEMON)
+			logger.set_output(syslog.syslog)
+		self.write_pidfile()
+		self.set_signals(self.signal_handler)
+		self.logger.info("supervisor started (pid %d), workers: %s", os.getpid(), \
+			", ".join([worker.name for worker in self.workers]))
+		try:
+			while not self.stopping:
+				if not [worker for worker in self.workers if not worker.finished]: break
+				now = time.time()
+				for worker in self.workers:
+					if worker.pid == None and not worker.finished and now >= worker.restart_time:
+						self.spawn(worker)
+				self.reap()
+				while self.pending_signals:
+					self.forward(self.pending_signals.pop(0))
+				if self.stopping: break
+				waits = [worker.restart_time - now for worker in self.workers \
+					if worker.pid == None and not worker.finished]
+				time.sleep(max(0.0, min([POLL_TIME] + waits)))
+		finally:
+			self.stop()
+			self.delete_pidfile()
+		self.logger.info("supervisor stopped")
+		logger.flush()
+		return 0
+
+	###############################
+	def spawn(self, worker):
+		if self.cleanup: self.cleanup(worker.name)
+		try: pid = os.fork()
+		except OSError, detail:
+			self.logger.info("cannot fork worker %s: %s", worker.name, detail)
+			self.schedule_restart(worker, time.time())
+			return
+		if pid == 0:
+			self.set_signals(signal.SIG_DFL)
+			os._exit(self.worker_main(worker.name))
+		worker.pid = pid
+		worker.started = time.time()
+		self.logger.info("worker %s started (pid %d)", worker.name, pid)
+
+	###############################
+	def worker_main(self, name):
+		"""Run worker in the child process, return exit code"""
+		code = 1
+		try:
+			try: code = self.run_worker(name)
+			except SystemExit, e: code = e.code
+			except:
+				for line in traceback.format_exc().splitlines():
+					self.logger.info("worker %s: %s", name, line)
+		finally: logger.flush()
+		if code == None: return 0
+		if type(code) != int: return 1
+		return code
+
+	###############################
+	def reap(self):
+		while 1:
+			try: pid, status = os.waitpid(-1, os.WNOHANG)
+			except OSError, e:
+				if e.errno == errno.EINTR: continue
+				if e.errno == errno.ECHILD: return
+				raise
+			if not pid: return
+			for worker in self.workers:
+				if worker.pid != pid: continue
+				worker.pid = None
+				self.logger.info("worker %s (pid %d) ended: %s", worker.name, pid, exit_status(status))
+				if self.stopping: continue
+				if os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0: worker.finished = True
+				else: self.schedule_restart(worker, time.time())
+
+	###############################
+	def schedule_restart(self, worker, now):
+		if worker.started and now - worker.started >= STABLE_TIME: worker.delay = RESTART_DELAY
+		worker.restart_time = now + worker.delay
+		worker.restarts += 1
+		self.logger.info("worker %s restart in %0.1f seconds", worker.name, worker.delay)
+		worker.delay = min(2 * worker.delay, MAX_RESTART_DELAY)
+
+	###############################
+	def forward(self, signum):
+		for worker in self.workers:
+			if worker.pid == None: continue
+			try: os.kill(worker.pid, signum)
+			except OSError: pass
+
+	###############################
+	def stop(self):
+		"""Terminate workers (SIGTERM, SIGKILL after STOP_TIMEOUT)"""
+		self.forward(signal.SIGTERM)
+		end = time.time() + STOP_TIMEOUT
+		while [worker for worker in self.workers if worker.pid != None]:
+			self.reap()
+			if time.time() >= end:
+				self.forward(signal.SIGKILL)
+				end = time.time() + STOP_TIMEOUT
+			time.sleep(0.05)
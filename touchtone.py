@@ -0,0 +1,249 @@
+#!/usr/bin/python
+
+# This file is part of asterisk-phonepatch
+
+# Copyright (C) 2011 Stephen Hamilton
+#
+# Asterisk-phonepatch is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+__version__ = "$Revision: 0.1 $"
+__author__ = "Stephen Hamilton <stephenshamilton@gmail.com>"
+__depends__ = ['Python-2.4']
+__copyright__ = """Copyright (C) 2011 Stephen Hamilton.
+This code is distributed under the terms of the GNU General Public License."""
+
+# APRStt number: "A" + callsign (two-key letters and digits) + symbol + checksum
+CALLSIGN_PREFIX = "A"
+
+# Two-key method: digit key followed by A/B/C/D selects a letter of that key
+LETTERS = {"2A": "A", "2B": "B", "2C": "C", "3A": "D", "3B": "E", "3C": "F",
+	"4A": "G", "4B": "H", "4C": "I", "5A": "J", "5B": "K", "5C": "L",
+	"6A": "M", "6B": "N", "6C": "O", "7A": "P", "7B": "Q", "7C": "R", "7D": "S",
+	"8A": "T", "8B": "U", "8C": "V", "9A": "W", "9B": "X", "9C": "Y", "9D": "Z"}
+
+LETTER_KEYS = dict([(letter, keys) for keys, letter in LETTERS.items()])
+
+# Values of keys for checksum calculation
+DIGIT_VALUES = {"A": 0, "B": 1, "C": 2, "D": 3}
+for digit in "0123456789": DIGIT_VALUES[digit] = int(digit)
+
+# Callsign characters of key pairs (as decode_callsign): "" for pairs
+# skipped (first key not a digit), missing pairs make the callsign invalid
+CALLSIGN_PAIRS = dict(LETTERS)
+for first in "0123456789": 
+	for second in "0123456789": CALLSIGN_PAIRS[first + second] = first
+for first in "ABCD*#":
+	for second in "0123456789ABCD*#": CALLSIGN_PAIRS[first + second] = ""
+
+###################################
+def process_noisy_number(number, noisy_button):
+	"""All repetitions between a noisy_button are
+	removed (and noisy_button itself)"""
+	if not noisy_button or type(noisy_button) != str or len(noisy_button) != 1:
+		return number
+	output = ""
+	memory = None
+	for n in number:
+		if n == noisy_button and memory != None:
+			output += memory
+			memory = None
+		elif n != noisy_button and memory != None and n != memory:
+			output += memory
+			memory = n
+		elif n != noisy_button and memory == None:
+			memory = n
+	if memory != None:
+		output = output + memory
+	return output
+
+###################################
+def get_checksum(number):
+	"""Return expected checksum key for a number (keys between first and
+	last one) or None if it contains keys not valid for checksum"""
+	verify = 0
+	for key in number[1:-1]:
+		if key not in DIGIT_VALUES: return
+		verify += DIGIT_VALUES[key]
+	return str(verify % 10)
+
+###################################
+def verify_checksum(number):
+	"""Check that the last key of number is its checksum"""
+	return len(number) >= 2 and get_checksum(number) == number[-1]
+
+###################################
+def decode_callsign(number):
+	"""Decode the callsign of a APRStt number (None if not a callsign)
+
+	Consecutive keys are taken as pairs: digit+letter is translated using
+	the two-key method and digit+digit gives the first digit. Last two keys
+	(symbol and checksum) are not part of the callsign."""
+	if not number or number[0] != CALLSIGN_PREFIX: return
+	callsign = ""
+	for p in range(1, len(number) - 3):
+		key, nextkey = number[p], number[p+1]
+		if not key.isdigit(): continue
+		if nextkey.isdigit(): callsign += key
+		elif key + nextkey in LETTERS: callsign += LETTERS[key + nextkey]
+		else: return
+	return callsign
+
+###################################
+def encode_callsign(callsign):
+	"""Return keys of a callsign (letters and digits) for decode_callsign:
+	letters use the two-key method, digits a single key (doubled when last,
+	as the last key of the callsign only closes a pair)"""
+	keys = ""
+	callsign = callsign.upper()
+	for index, char in enumerate(callsign):
+		if char.isdigit():
+			keys += char
+			if index == len(callsign) - 1: keys += char
+		elif char in LETTER_KEYS: keys += LETTER_KEYS[char]
+		else: raise ValueError, "Invalid callsign character: %s" %char
+	return keys
+
+###################################
+def encode_number(callsign, symbol="0"):
+	"""Return APRStt number (prefix, callsign, symbol and checksum)"""
+	if symbol not in DIGIT_VALUES: raise ValueError, "Invalid symbol key: %s" %symbol
+	number = CALLSIGN_PREFIX + encode_callsign(callsign) + symbol
+	return number + get_checksum(number + "0")
+
+###################################
+def parse_number(number):
+	"""Return a dictionary with the fields of a APRStt number"""
+	fields = {"number": number, "checksum": verify_checksum(number), \
+		"callsign": None, "symbol": None}
+	if len(number) >= 2: fields["symbol"] = number[-2]
+	fields["callsign"] = decode_callsign(number)
+	return fields
+
+# Validator.feed results
+INCOMPLETE = "incomplete"
+CLEARED = "cleared"
+VOID = "void"
+ACCEPTED = "accepted"
+REJECTED = "rejected"
+
+###################################
+###################################
+class Validator:
+	"""Streaming APRStt number validator: feed it keys as the decoder emits
+	them. Noisy-button collapse, checksum and callsign fields are updated
+	with every key, so a number is accepted or rejected as soon as the
+	terminator arrives. Same results as process_noisy_number and 
+	parse_number on the keys before the terminator"""
+	###################################
+	def __init__(self, terminator="#", clear=None, noisy_button=None):
+		self.terminator = terminator
+		self.clear = clear
+		if not noisy_button or type(noisy_button) != str or len(noisy_button) != 1:
+			noisy_button = None
+		self.noisy_button = noisy_button
+		self.fields = None
+		self.reset()
+
+	###################################
+	def reset(self):
+		"""Start a new number"""
+		# Raw keys received and keys after noisy-button collapse
+		self.raw = []
+		self.keys = []
+		self.memory = None
+		# Checksum: sum of values (and invalid keys) of keys after the first one
+		self.total = 0
+		self.invalid = 0
+		# Callsign decoded (list of characters) up to pair keys[-4:-2]
+		self.callsign = []
+		self.callsign_valid = True
+
+	###################################
+	def get_number(self):
+		"""Return raw keys received for the current number"""
+		return "".join(self.raw)
+
+	###################################
+	def add_key(self, key):
+		"""Add a key (after noisy collapse) to the number fields"""
+		keys = self.keys
+		keys.append(key)
+		index = len(keys) - 1
+		if not index: return
+		value = DIGIT_VALUES.get(key)
+		if value == None: self.invalid += 1
+		else: self.total += value
+		# Pairs (p, p+1) are known to be part of the callsign once key p+3 arrives
+		if index >= 4 and self.callsign_valid and keys[0] == CALLSIGN_PREFIX:
+			character = CALLSIGN_PAIRS.get(keys[index-3] + keys[index-2])
+			if character == None: self.callsign_valid = False
+			elif character: self.callsign.append(character)
+
+	###################################
+	def feed(self, key):
+		"""Process a key, return INCOMPLETE, CLEARED, VOID (terminator with
+		no number), ACCEPTED or REJECTED (checksum). For the last two the
+		number fields (see parse_number) are left in self.fields"""
+		if key == self.clear:
+			self.reset()
+			return CLEARED
+		if key == self.terminator:
+			return self.finish()
+		self.raw.append(key)
+		noisy = self.noisy_button
+		if not noisy: self.add_key(key)
+		elif key == noisy:
+			if self.memory != None: 
+				self.add_key(self.memory)
+				self.memory = None
+		elif self.memory == None: self.memory = key
+		elif key != self.memory:
+			self.add_key(self.memory)
+			self.memory = key
+		return INCOMPLETE
+
+	###################################
+	def finish(self):
+		if self.memory != None: self.add_key(self.memory)
+		keys = self.keys
+		if not keys:
+			self.reset()
+			return VOID
+		last = keys[-1]
+		checksum = None
+		if len(keys) >= 2:
+			total, invalid = self.total, self.invalid
+			if last in DIGIT_VALUES: total -= DIGIT_VALUES[last]
+			else: invalid -= 1
+			if not invalid: checksum = str(total % 10)
+		number = "".join(keys)
+		self.fields = {"number": number, "checksum": checksum != None and checksum == last, \
+			"expected_checksum": checksum, "callsign": None, "symbol": None}
+		if len(keys) >= 2: self.fields["symbol"] = keys[-2]
+		if keys[0] == CALLSIGN_PREFIX and self.callsign_valid: 
+			self.fields["callsign"] = "".join(self.callsign)
+		self.reset()
+		if self.fields["checksum"]: return ACCEPTED
+		return REJECTED
+
+	###################################
+	def feed_keys(self, keys):
+		"""Feed a sequence of keys, return list of (result, fields) for the
+		numbers completed"""
+		output = []
+		for key in keys:
+			result = self.feed(key)
+			if result in (ACCEPTED, REJECTED): output.append((result, self.fields))
+		return output
@@ -0,0 +1,265 @@
+#!/usr/bin/python
+
+# This file is part of asterisk-phonepatch
+
+# Copyright (C) 2011 Stephen Hamilton
+#
+# Asterisk-phonepatch is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+"""Persistent APRStt user store (SQLite, WAL journal).
+
+Tables:
+	users     DTMF keys (number without symbol and checksum) -> callsign,
+	          symbol, last position, last heard time and number of reports
+	aliases   abbreviated keys (tactical numbers) -> callsign
+	readback  text-to-speech audio by (text, language, samplerate)
+
+Lookups go through in-memory LRU caches, so repeat users do not touch
+the database."""
+
+# Standard Python modules
+import sys, time, threading, optparse
+try: import sqlite3
+except ImportError: from pysqlite2 import dbapi2 as sqlite3
+
+# External phonepatch modules
+import metrics
+
+__version__ = "$Revision: 0.1 $"
+__author__ = "Stephen Hamilton <stephenshamilton@gmail.com>"
+__depends__ = ['sqlite3', 'Python-2.4']
+__copyright__ = """Copyright (C) 2011 Stephen Hamilton.
+This code is distributed under the terms of the GNU General Public License."""
+
+# Entries kept in memory (users/aliases and readback audio)
+CACHE_SIZE = 256
+READBACK_CACHE_SIZE = 16
+
+SCHEMA = [
+	"CREATE TABLE IF NOT EXISTS users (keys TEXT PRIMARY KEY, callsign TEXT NOT NULL, "
+		"symbol TEXT, position TEXT, last_heard REAL, reports INTEGER NOT NULL DEFAULT 0)",
+	"CREATE TABLE IF NOT EXISTS aliases (keys TEXT PRIMARY KEY, callsign TEXT NOT NULL)",
+	"CREATE TABLE IF NOT EXISTS readback (text TEXT NOT NULL, language TEXT NOT NULL, "
+		"samplerate INTEGER NOT NULL, audio BLOB NOT NULL, created REAL, "
+		"PRIMARY KEY (text, language, samplerate))",
+	"CREATE INDEX IF NOT EXISTS users_last_heard ON users (last_heard)"]
+
+USER_FIELDS = ("keys", "callsign", "symbol", "position", "last_heard", "reports")
+
+CACHE_HITS = metrics.counter("aprstt_user_cache_hits_total", "User store lookups answered from memory")
+CACHE_MISSES = metrics.counter("aprstt_user_cache_misses_total", "User store lookups read from database")
+
+###############################
+###############################
+class LRUCache:
+	"""Dictionary keeping the <maxsize> most recently used entries. When
+	full, the least recently used quarter is evicted at once"""
+	###############################
+	def __init__(self, maxsize):
+		self.maxsize = max(1, maxsize)
+		self.data = {}
+		self.tick = 0
+
+	###############################
+	def __len__(self):
+		return len(self.data)
+
+	###############################
+	def __contains__(self, key):
+		return key in self.data
+
+	###############################
+	def get(self, key, default=None):
+		entry = self.data.get(key)
+		if entry == None: return default
+		self.tick += 1
+		entry[1] = self.tick
+		return entry[0]
+
+	###############################
+	def put(self, key, value):
+		self.tick += 1
+		self.data[key] = [value, self.tick]
+		if len(self.data) > self.maxsize: self.evict()
+
+	###############################
+	def discard(self, key):
+		self.data.pop(key, None)
+
+	###############################
+	def evict(self):
+		items = [(entry[1], key) for key, entry in self.data.items()]
+		items.sort()
+		for tick, key in items[:max(1, len(items) / 4)]:
+			del self.data[key]
+
+###############################
+###############################
+class UserStore:
+	"""APRStt users, aliases and readback audio. Methods are thread-safe"""
+	Error = sqlite3.Error
+
+	###############################
+	def __init__(self, path, cache_size=CACHE_SIZE):
+		self.path = path
+		self.db = sqlite3.connect(path, check_same_thread=False)
+		self.db.text_factory = str
+		self.lock = threading.Lock()
+		self.execute("PRAGMA journal_mode=WAL")
+		self.execute("PRAGMA synchronous=NORMAL")
+		for statement in SCHEMA: self.execute(statement)
+		self.db.commit()
+		# Cached users (None for keys known not to be in the table)
+		self.users = LRUCache(cache_size)
+		self.aliases = LRUCache(cache_size)
+		self.readbacks = LRUCache(READBACK_CACHE_SIZE)
+
+	###############################
+	def execute(self, statement, args=()):
+		return self.db.execute(statement, args)
+
+	###############################
+	def cached(self, cache, key, query):
+		"""Return cache[key], reading it with query (one row or None) on miss"""
+		self.lock.acquire()
+		try:
+			if key in cache: 
+				CACHE_HITS.inc()
+				return cache.get(key)
+			CACHE_MISSES.inc()
+			value = self.execute(query, (key,)).fetchone()
+			cache.put(key, value)
+			return value
+		finally: self.lock.release()
+
+	###############################
+	def get_user(self, keys):
+		"""Return user dictionary (see USER_FIELDS) for keys, or None"""
+		row = self.cached(self.users, keys, "SELECT %s FROM users WHERE keys = ?" %", ".join(USER_FIELDS))
+		if row: return dict(zip(USER_FIELDS, row))
+
+	###############################
+	def get_alias(self, keys):
+		row = self.cached(self.aliases, keys, "SELECT callsign FROM aliases WHERE keys = ?")
+		if row: return row[0]
+
+	###############################
+	def resolve(self, keys):
+		"""Return callsign for keys (alias first, then known users) or None"""
+		callsign = self.get_alias(keys)
+		if callsign: return callsign
+		user = self.get_user(keys)
+		if user: return user["callsign"]
+
+	###############################
+	def heard(self, keys, callsign, symbol=None, position=None, when=None):
+		"""Record a report from a user"""
+		if when == None: when = time.time()
+		self.lock.acquire()
+		try:
+			cursor = self.execute("UPDATE users SET callsign = ?, symbol = ?, position = ?, "
+				"last_heard = ?, reports = reports + 1 WHERE keys = ?", (callsign, symbol, position, when, keys))
+			if not cursor.rowcount:
+				self.execute("INSERT INTO users (keys, callsign, symbol, position, last_heard, reports) "
+					"VALUES (?, ?, ?, ?, ?, 1)", (keys, callsign, symbol, position, when))
+			self.db.commit()
+			# Keep the updated row cached, the user is likely to report again
+			row = self.execute("SELECT %s FROM users WHERE keys = ?" %", ".join(USER_FIELDS), (keys,)).fetchone()
+			self.users.put(keys, row)
+		finally: self.lock.release()
+
+	###############################
+	def set_alias(self, keys, callsign):
+		"""Add (or replace) an abbreviated entry. A false callsign removes it"""
+		self.lock.acquire()
+		try:
+			if callsign: self.execute("INSERT OR REPLACE INTO aliases (keys, callsign) VALUES (?, ?)", (keys, callsign))
+			else: self.execute("DELETE FROM aliases WHERE keys = ?", (keys,))
+			self.db.commit()
+			self.aliases.discard(keys)
+		finally: self.lock.release()
+
+	###############################
+	def list_aliases(self):
+		self.lock.acquire()
+		try: return self.execute("SELECT keys, callsign FROM aliases ORDER BY keys").fetchall()
+		finally: self.lock.release()
+
+	###############################
+	def recent(self, limit=20):
+		"""Return last heard users (most recent first)"""
+		self.lock.acquire()
+		try: rows = self.execute("SELECT %s FROM users ORDER BY last_heard DESC LIMIT ?" \
+			%", ".join(USER_FIELDS), (limit,)).fetchall()
+		finally: self.lock.release()
+		return [dict(zip(USER_FIELDS, row)) for row in rows]
+
+	###############################
+	def get_readback(self, text, language, samplerate):
+		"""Return cached readback audio for text or None"""
+		row = self.cached(self.readbacks, (text, language, samplerate), 
+			"SELECT audio FROM readback WHERE text = ? AND language = ? AND samplerate = ?")
+		if row: return str(row[0])
+
+	###############################
+	def put_readback(self, text, language, samplerate, audio):
+		self.lock.acquire()
+		try:
+			self.execute("INSERT OR REPLACE INTO readback (text, language, samplerate, audio, created) "
+				"VALUES (?, ?, ?, ?, ?)", (text, language, samplerate, sqlite3.Binary(audio), time.time()))
+			self.db.commit()
+			self.readbacks.put((text, language, samplerate), (audio,))
+		finally: self.lock.release()
+
+	###############################
+	def clear_cache(self):
+		"""Forget cached entries (to see changes made by other processes)"""
+		self.lock.acquire()
+		try:
+			for cache in (self.users, self.aliases, self.readbacks): cache.data.clear()
+		finally: self.lock.release()
+
+	###############################
+	def close(self):
+		self.lock.acquire()
+		try: self.db.close()
+		finally: self.lock.release()
+
+###############################
+def main():
+	usage = """
+	userstore.py [options] DATABASE: Show and edit the APRStt user store"""
+	parser = optparse.OptionParser(usage)
+	parser.add_option('-a', '--alias', dest='alias', default="", metavar='KEYS=CALLSIGN', type='string', help='Add abbreviated entry (empty callsign removes it)')
+	parser.add_option('-l', '--list', dest='list', default=0, metavar='NUMBER', type='int', help='List last heard users')
+	options, args = parser.parse_args()
+	if len(args) != 1:
+		parser.print_help()
+		sys.exit(1)
+	store = UserStore(args[0])
+	if options.alias:
+		if options.alias.find("=") < 0: parser.error("alias syntax: KEYS=CALLSIGN")
+		keys, callsign = options.alias.split("=", 1)
+		store.set_alias(keys.strip(), callsign.strip())
+	for keys, callsign in store.list_aliases():
+		print "alias %s %s" %(keys, callsign)
+	for user in store.recent(options.list):
+		print "user %s %s symbol=%s position=%s reports=%d last_heard=%s" %(user["keys"], user["callsign"], \
+			user["symbol"], user["position"], user["reports"], time.ctime(user["last_heard"]))
+	store.close()
+
+############################
+if __name__ == "__main__":
+	main()